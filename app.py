@@ -2,14 +2,41 @@ import os
 from flask import Flask, jsonify, request, abort
 from database.models import setup_db
 from flask_cors import CORS
-from database.models import Actor, Movie, Cast
-from auth.auth import AuthError, requires_auth
+from database.models import db, Actor, Movie, Cast
+from database.bulk import (BULK_MAX_ITEMS, assign_casts, bulk_insert,
+                           missing_ids, validate_actor, validate_items,
+                           validate_movie)
+from database.documents import EXPANDED_LISTING_JSON, listing_documents
+from database.filters import (ACTOR_FILTERS, ACTOR_SORTS, CAST_FILTERS,
+                              CAST_SORTS, MOVIE_FILTERS, MOVIE_SORTS,
+                              listing_args_check, parse_listing_args)
+from database.pagination import get_page_args
+from database.replicas import remember_writes
+from database.search import check_search_args, search_page, search_terms
+from web.compression import compress_response
+from web.conditional import versioned_response
+from web.documents import document_listing_response
+from web.metrics import count_auth_failure, install_metrics
+from web.streaming import ndjson_response, wants_ndjson
+from web.timing import install_request_timing
+from auth.auth import AuthError, check_permissions, requires_auth
 
 
 def create_app(test_config=None):
     app = Flask(__name__)
     setup_db(app)
 
+    """
+    Time the phases of every request when REQUEST_TIMING_HEADER or
+    REQUEST_TIMING_LOG is set, see web/timing.py
+    """
+    install_request_timing(app)
+
+    """
+    Serve Prometheus metrics at /metrics, see web/metrics.py
+    """
+    install_metrics(app)
+
     """
     Set up CORS. Allow '*' for origins.
     """
@@ -29,11 +56,28 @@ def create_app(test_config=None):
         )
         response.headers.add(
             'Access-Control-Allow-Methods',
-            'GET,PATCH,POST,DELETE,OPTIONS'
+            'GET,PUT,PATCH,POST,DELETE,OPTIONS'
         )
 
         return response
 
+    """
+    Compress large JSON responses, see web/compression.py
+    """
+
+    @app.after_request
+    def after_request_compress(response):
+        return compress_response(request, response)
+
+    """
+    Keep the reads of a client that just wrote on the primary database,
+    see database/replicas.py
+    """
+
+    @app.after_request
+    def after_request_replicas(response):
+        return remember_writes(request, response)
+
     @app.route('/')
     def get_greeting():
         excited = os.environ['EXCITED']
@@ -47,18 +91,88 @@ def create_app(test_config=None):
     def be_cool():
         return "Be cool, man, be coooool! You're almost a FSND grad!"
 
+    """
+    Bulk creation of actors and movies
+    """
+
+    def bulk_create(model, validate):
+        items = request.get_json()
+        if not isinstance(items, list) or not items:
+            abort(400)
+        if len(items) > BULK_MAX_ITEMS:
+            abort(413)
+
+        atomic = request.args.get('atomic', 'true')
+        if atomic not in ('true', 'false'):
+            abort(400)
+
+        rows, indexes, errors = validate_items(items, validate)
+        if errors and (atomic == 'true' or not rows):
+            return jsonify({
+                'success': False,
+                'error': 422,
+                'message': 'Unprocessable',
+                'errors': errors
+            }), 422
+
+        try:
+            ids = bulk_insert(model, rows)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(e)
+            abort(400)
+
+        created = [None] * len(items)
+        for index, id in zip(indexes, ids):
+            created[index] = id
+
+        return jsonify({
+            'success': True,
+            'created': len(ids),
+            'ids': created,
+            'errors': errors
+        })
+
     """
     Actors
     """
 
     @app.route('/api/actors', methods=['GET'])
     @requires_auth("get:actors")
+    @versioned_response('actors', expand_tables=('casts', 'movies'),
+                        check_args=listing_args_check(
+                            ACTOR_FILTERS, ACTOR_SORTS, 'id', Actor))
     def get_actors(payload):
-        actors = Actor.query.all()
+        expand = request.args.get('expand')
+        try:
+            limit, cursor = get_page_args(request.args)
+            criteria, sort, descending = parse_listing_args(
+                request.args, ACTOR_FILTERS, ACTOR_SORTS, 'id')
+            if expand is not None:
+                query, serialize = Actor.query_for_listing(expand), Actor.long
+            else:
+                query, serialize = Actor.query_for_short(), Actor.short_row
+            query = query.filter(*criteria)
+            if wants_ndjson(request):
+                return ndjson_response(
+                    sort.query(query, cursor, descending), serialize)
+            if expand is not None and EXPANDED_LISTING_JSON == 'database':
+                ids, next_cursor = sort.page(
+                    db.session.query(Actor.id).filter(*criteria), limit,
+                    cursor, descending)
+                return document_listing_response('actors', listing_documents(
+                    db.session, 'actors', [row.id for row in ids]),
+                    next_cursor)
+            actors, next_cursor = sort.page(query, limit, cursor, descending)
+        except ValueError as e:
+            print(e)
+            abort(400)
 
         return jsonify({
             'success': True,
-            'actors': [actor.short() for actor in actors]
+            'actors': [serialize(actor) for actor in actors],
+            'next_cursor': next_cursor
         })
 
     @app.route('/api/actors', methods=['POST'])
@@ -79,6 +193,11 @@ def create_app(test_config=None):
             'actor': actor.short()
         })
 
+    @app.route('/api/actors/bulk', methods=['POST'])
+    @requires_auth("post:actors")
+    def add_actors_bulk(payload):
+        return bulk_create(Actor, validate_actor)
+
     @app.route('/api/actors/<int:id>', methods=['PATCH'])
     @requires_auth('patch:actors')
     def update_actor(payload, id):
@@ -121,12 +240,39 @@ def create_app(test_config=None):
 
     @app.route('/api/movies', methods=['GET'])
     @requires_auth("get:movies")
+    @versioned_response('movies', expand_tables=('casts', 'actors'),
+                        check_args=listing_args_check(
+                            MOVIE_FILTERS, MOVIE_SORTS, 'id', Movie))
     def get_movies(payload):
-        movies = Movie.query.all()
+        expand = request.args.get('expand')
+        try:
+            limit, cursor = get_page_args(request.args)
+            criteria, sort, descending = parse_listing_args(
+                request.args, MOVIE_FILTERS, MOVIE_SORTS, 'id')
+            if expand is not None:
+                query, serialize = Movie.query_for_listing(expand), Movie.long
+            else:
+                query, serialize = Movie.query_for_short(), Movie.short_row
+            query = query.filter(*criteria)
+            if wants_ndjson(request):
+                return ndjson_response(
+                    sort.query(query, cursor, descending), serialize)
+            if expand is not None and EXPANDED_LISTING_JSON == 'database':
+                ids, next_cursor = sort.page(
+                    db.session.query(Movie.id).filter(*criteria), limit,
+                    cursor, descending)
+                return document_listing_response('movies', listing_documents(
+                    db.session, 'movies', [row.id for row in ids]),
+                    next_cursor)
+            movies, next_cursor = sort.page(query, limit, cursor, descending)
+        except ValueError as e:
+            print(e)
+            abort(400)
 
         return jsonify({
             'success': True,
-            'movies': [movie.short() for movie in movies]
+            'movies': [serialize(movie) for movie in movies],
+            'next_cursor': next_cursor
         })
 
     @app.route('/api/movies', methods=['POST'])
@@ -145,6 +291,11 @@ def create_app(test_config=None):
             'movie': movie.short()
         })
 
+    @app.route('/api/movies/bulk', methods=['POST'])
+    @requires_auth("post:movies")
+    def add_movies_bulk(payload):
+        return bulk_create(Movie, validate_movie)
+
     @app.route('/api/movies/<int:id>', methods=['PATCH'])
     @requires_auth('patch:movies')
     def update_movie(payload, id):
@@ -184,12 +335,27 @@ def create_app(test_config=None):
     """
 
     @app.route('/api/casts', methods=['GET'])
+    @versioned_response('casts', 'movies', 'actors',
+                        check_args=listing_args_check(
+                            CAST_FILTERS, CAST_SORTS, 'movie_id'))
     def get_all_casts():
-        casts = Cast.query.all()
+        try:
+            limit, cursor = get_page_args(request.args)
+            criteria, sort, descending = parse_listing_args(
+                request.args, CAST_FILTERS, CAST_SORTS, 'movie_id')
+            query = Cast.query_for_format().filter(*criteria)
+            if wants_ndjson(request):
+                return ndjson_response(sort.query(query, cursor, descending),
+                                       Cast.format)
+            casts, next_cursor = sort.page(query, limit, cursor, descending)
+        except ValueError as e:
+            print(e)
+            abort(400)
 
         return jsonify({
             'success': True,
-            'casts': [cast.format() for cast in casts]
+            'casts': [cast.format() for cast in casts],
+            'next_cursor': next_cursor
         })
 
     @app.route('/api/casts', methods=['POST'])
@@ -208,14 +374,19 @@ def create_app(test_config=None):
         })
 
     @app.route('/api/casts/<int:id>', methods=['PATCH'])
+    @requires_auth('patch:casts')
     def update_cast(payload, id):
         request_data = request.get_json()
-        cast = Cast.query.get_or_404(id)
+        cast = Cast.get_by_legacy_id(id)
+        if cast is None:
+            abort(404)
         try:
             cast.movie_id = request_data['movie_id']
             cast.actor_id = request_data['actor_id']
+            cast.move_legacy_id(id)
             cast.update()
         except Exception as e:
+            db.session.rollback()
             abort(400)
 
         return jsonify({
@@ -224,9 +395,13 @@ def create_app(test_config=None):
         })
 
     @app.route('/api/casts/<int:id>', methods=['DELETE'])
+    @requires_auth('delete:casts')
     def delete_cast(payload, id):
-        cast = Cast.query.get_or_404(id)
+        cast = Cast.get_by_legacy_id(id)
+        if cast is None:
+            abort(404)
         try:
+            Cast.drop_legacy_id(id)
             cast.delete()
         except Exception as e:
             abort(400)
@@ -236,6 +411,101 @@ def create_app(test_config=None):
             'cast': cast.format()
         })
 
+    """
+    Search
+    """
+
+    @app.route('/api/search', methods=['GET'])
+    @requires_auth('get:movies')
+    @versioned_response('actors', 'movies', check_args=check_search_args)
+    def search(payload):
+        check_permissions('get:actors', payload)
+        try:
+            limit, cursor = get_page_args(request.args)
+            terms = search_terms(request.args.get('q'))
+            hits, next_cursor = search_page(db.session, terms, limit, cursor)
+        except ValueError as e:
+            print(e)
+            abort(400)
+
+        found = {}
+        for kind, model in (('actor', Actor), ('movie', Movie)):
+            ids = [id for hit_kind, id in hits if hit_kind == kind]
+            if ids:
+                found[kind] = {row.id: row for row in
+                               model.query.filter(model.id.in_(ids))}
+
+        return jsonify({
+            'success': True,
+            'results': [{'type': kind, kind: found[kind][id].short()}
+                        for kind, id in hits
+                        if id in found.get(kind, {})],
+            'next_cursor': next_cursor
+        })
+
+    """
+    Cast assignment
+    """
+
+    def assign(owner_key, owner_id, member_model, replace):
+        member_ids = request.get_json()
+        if (not isinstance(member_ids, list) or
+                any(type(id) is not int for id in member_ids)):
+            abort(400)
+        if len(member_ids) > BULK_MAX_ITEMS:
+            abort(413)
+
+        member_ids = sorted(set(member_ids))
+        member_table = member_model.__table__
+        unknown_ids = missing_ids(member_table, member_ids)
+        if unknown_ids:
+            return jsonify({
+                'success': False,
+                'error': 422,
+                'message': 'Unprocessable',
+                'unknown_ids': unknown_ids
+            }), 422
+
+        try:
+            added, removed = assign_casts(owner_key, owner_id, member_table,
+                                          member_ids, replace=replace)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(e)
+            abort(400)
+
+        return jsonify({
+            'success': True,
+            owner_key: owner_id,
+            'added': added,
+            'removed': removed
+        })
+
+    @app.route('/api/movies/<int:id>/actors', methods=['POST'])
+    @requires_auth('post:casts')
+    def add_movie_actors(payload, id):
+        movie = Movie.query.get_or_404(id)
+        return assign('movie_id', movie.id, Actor, replace=False)
+
+    @app.route('/api/movies/<int:id>/actors', methods=['PUT'])
+    @requires_auth('patch:casts')
+    def replace_movie_actors(payload, id):
+        movie = Movie.query.get_or_404(id)
+        return assign('movie_id', movie.id, Actor, replace=True)
+
+    @app.route('/api/actors/<int:id>/movies', methods=['POST'])
+    @requires_auth('post:casts')
+    def add_actor_movies(payload, id):
+        actor = Actor.query.get_or_404(id)
+        return assign('actor_id', actor.id, Movie, replace=False)
+
+    @app.route('/api/actors/<int:id>/movies', methods=['PUT'])
+    @requires_auth('patch:casts')
+    def replace_actor_movies(payload, id):
+        actor = Actor.query.get_or_404(id)
+        return assign('actor_id', actor.id, Movie, replace=True)
+
     """
     Error handling
     """
@@ -249,6 +519,14 @@ def create_app(test_config=None):
             'message': 'Bad request'
         }), 400
 
+    @app.errorhandler(413)
+    def payload_too_large(error):
+        return jsonify({
+            'success': False,
+            'error': 413,
+            'message': 'Payload too large'
+        }), 413
+
     @app.errorhandler(422)
     def unprocessable(error):
         return jsonify({
@@ -275,6 +553,7 @@ def create_app(test_config=None):
 
     @app.errorhandler(AuthError)
     def auth_error(error):
+        count_auth_failure(error)
         return jsonify({
             'success': False,
             'error': error.status_code,
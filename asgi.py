@@ -0,0 +1,24 @@
+'''
+ASGI entry point of the app, see web/asgi.py
+
+    uvicorn asgi:app --workers 4
+
+with the database URLs naming an asyncio driver, e.g.
+
+    DATABASE_URL=postgresql+asyncpg://user@localhost:5432/capstone
+'''
+from functools import partial
+
+from app import app as wsgi_app
+from auth import auth
+from web.asgi import ASGIApp, AsyncJWKSKeyStore
+from web.warmup import warm_up
+
+auth.jwks_store = AsyncJWKSKeyStore(
+    auth.JWKS_URL,
+    ttl=auth.JWKS_CACHE_TTL,
+    min_refresh_interval=auth.JWKS_MIN_REFRESH_INTERVAL,
+    key_loader=auth.jwt_backend.load_key)
+
+# warm up like the gunicorn workers: mappers, pool and signing keys
+app = ASGIApp(wsgi_app, on_startup=partial(warm_up, wsgi_app))
@@ -1,14 +1,48 @@
-import json
 import os
 from flask import request, _request_ctx_stack
 from functools import wraps
-from jose import jwt
-from urllib.request import urlopen
+from auth.backends import (ExpiredTokenError, InvalidClaimsError,
+                           InvalidTokenError, get_backend)
+from auth.jwks import JWKSKeyStore
+from auth.token_cache import TokenCache
+from web.timing import phase
 
 AUTH0_DOMAIN = os.environ['AUTH0_DOMAIN']
 ALGORITHMS = ['RS256']
 API_AUDIENCE = os.environ['API_AUDIENCE']
 
+JWKS_URL = os.environ.get('JWKS_URL',
+                          f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
+JWKS_CACHE_TTL = int(os.environ.get('JWKS_CACHE_TTL', 600))
+JWKS_MIN_REFRESH_INTERVAL = int(
+    os.environ.get('JWKS_MIN_REFRESH_INTERVAL', 30))
+JWT_BACKEND = os.environ.get('JWT_BACKEND', 'jose')
+
+'''
+jwt_backend
+    library used to parse and verify tokens, see auth/backends.py
+'''
+jwt_backend = get_backend(JWT_BACKEND)
+
+'''
+jwks_store
+    process-wide cache of the Auth0 signing keys used by verify_decode_jwt
+'''
+jwks_store = JWKSKeyStore(JWKS_URL,
+                          ttl=JWKS_CACHE_TTL,
+                          min_refresh_interval=JWKS_MIN_REFRESH_INTERVAL,
+                          key_loader=jwt_backend.load_key)
+
+'''
+token_cache
+    process-wide cache of verified token payloads used by requires_auth,
+    disabled when TOKEN_CACHE_SIZE is 0
+'''
+token_cache = TokenCache(
+    max_entries=int(os.environ.get('TOKEN_CACHE_SIZE', 1024)),
+    max_bytes=int(os.environ.get('TOKEN_CACHE_MAX_BYTES', 1024 * 1024)),
+    max_ttl=int(os.environ.get('TOKEN_CACHE_MAX_TTL', 300)))
+
 ## AuthError Exception
 '''
 AuthError Exception
@@ -101,6 +135,7 @@ Implement verify_decode_jwt(token) method
 
     it should be an Auth0 token with key id (kid)
     it should verify the token using Auth0 /.well-known/jwks.json
+        (cached in jwks_store, refetched on ttl expiry or an unknown kid)
     it should decode the payload from the token
     it should validate the claims
     return the decoded payload
@@ -110,49 +145,46 @@ Implement verify_decode_jwt(token) method
 
 
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
-    unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
+    try:
+        unverified_header = jwt_backend.get_unverified_header(token)
+    except InvalidTokenError:
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Unable to parse authentication token.'
+        }, 400)
     if 'kid' not in unverified_header:
         raise AuthError({
             'code': 'invalid_header',
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
-    if rsa_key:
+    with phase('auth.key'):
+        rsa_key = jwks_store.get_key(unverified_header['kid'])
+    if rsa_key is not None:
         try:
-            payload = jwt.decode(
-                token,
-                rsa_key,
-                algorithms=ALGORITHMS,
-                audience=API_AUDIENCE,
-                issuer='https://' + AUTH0_DOMAIN + '/'
-            )
+            with phase('auth.decode'):
+                payload = jwt_backend.decode(
+                    token,
+                    rsa_key,
+                    algorithms=ALGORITHMS,
+                    audience=API_AUDIENCE,
+                    issuer='https://' + AUTH0_DOMAIN + '/'
+                )
 
             return payload
 
-        except jwt.ExpiredSignatureError:
+        except ExpiredTokenError:
             raise AuthError({
                 'code': 'token_expired',
                 'description': 'Token expired.'
             }, 401)
 
-        except jwt.JWTClaimsError:
+        except InvalidClaimsError:
             raise AuthError({
                 'code': 'invalid_claims',
                 'description': 'Incorrect claims. Please, check the audience and issuer.'
             }, 401)
-        except Exception:
+        except InvalidTokenError:
             raise AuthError({
                 'code': 'invalid_header',
                 'description': 'Unable to parse authentication token.'
@@ -170,6 +202,7 @@ Implement @requires_auth(permission) decorator method
 
     it should use the get_token_auth_header method to get the token
     it should use the verify_decode_jwt method to decode the jwt
+        (unless the payload of the same token is still in token_cache)
     it should use the check_permissions method validate claims and check the requested permission
     return the decorator which passes the decoded payload to the decorated method
 '''
@@ -179,9 +212,16 @@ def requires_auth(permission=''):
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
-            check_permissions(permission, payload)
+            with phase('auth.header'):
+                token = get_token_auth_header()
+            with phase('auth.cache'):
+                payload = token_cache.get(token)
+            if payload is None:
+                payload = verify_decode_jwt(token)
+                token_cache.put(token, payload)
+            with phase('auth.permissions'):
+                check_permissions(permission, payload)
+            _request_ctx_stack.top.current_user = payload
             return f(payload, *args, **kwargs)
 
         return wrapper
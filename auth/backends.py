@@ -0,0 +1,119 @@
+import json
+
+from jose import jwk, jwt
+
+'''
+JWT signature backends
+    verify_decode_jwt delegates parsing the header, loading the JWKS keys
+    and verifying the token to one of these backends, selected with the
+    JWT_BACKEND setting.
+
+    every backend raises the same three exceptions below, which
+    verify_decode_jwt turns into the usual AuthError codes.
+'''
+
+
+class ExpiredTokenError(Exception):
+    pass
+
+
+class InvalidClaimsError(Exception):
+    pass
+
+
+class InvalidTokenError(Exception):
+    pass
+
+
+'''
+JoseBackend
+    python-jose with whichever crypto backend it picks up (pycryptodome
+    with the pinned python-jose-cryptodome)
+'''
+
+
+class JoseBackend:
+    name = 'jose'
+
+    def load_key(self, key):
+        return jwk.construct(key, 'RS256').prepared_key
+
+    def get_unverified_header(self, token):
+        try:
+            return jwt.get_unverified_header(token)
+        except Exception as e:
+            raise InvalidTokenError(e)
+
+    def decode(self, token, key, algorithms, audience, issuer):
+        try:
+            # jose takes a mapping of already constructed keys as-is
+            return jwt.decode(token,
+                              {'rsa_key': key},
+                              algorithms=algorithms,
+                              audience=audience,
+                              issuer=issuer)
+        except jwt.ExpiredSignatureError as e:
+            raise ExpiredTokenError(e)
+        except jwt.JWTClaimsError as e:
+            raise InvalidClaimsError(e)
+        except Exception as e:
+            raise InvalidTokenError(e)
+
+
+'''
+PyJWTBackend
+    PyJWT on top of the cryptography package (OpenSSL), noticeably faster
+    at RS256 verification. Both packages are optional:
+
+        pip install PyJWT cryptography
+'''
+
+
+class PyJWTBackend:
+    name = 'pyjwt'
+
+    def __init__(self):
+        import jwt as pyjwt
+        from jwt.algorithms import RSAAlgorithm
+        self._jwt = pyjwt
+        self._rsa = RSAAlgorithm
+
+    def load_key(self, key):
+        return self._rsa.from_jwk(json.dumps(key))
+
+    def get_unverified_header(self, token):
+        try:
+            return self._jwt.get_unverified_header(token)
+        except Exception as e:
+            raise InvalidTokenError(e)
+
+    def decode(self, token, key, algorithms, audience, issuer):
+        try:
+            return self._jwt.decode(token,
+                                    key,
+                                    algorithms=algorithms,
+                                    audience=audience,
+                                    issuer=issuer)
+        except self._jwt.ExpiredSignatureError as e:
+            raise ExpiredTokenError(e)
+        except (self._jwt.InvalidAudienceError,
+                self._jwt.InvalidIssuerError,
+                self._jwt.ImmatureSignatureError,
+                self._jwt.InvalidIssuedAtError,
+                self._jwt.MissingRequiredClaimError) as e:
+            raise InvalidClaimsError(e)
+        except Exception as e:
+            raise InvalidTokenError(e)
+
+
+BACKENDS = {
+    JoseBackend.name: JoseBackend,
+    PyJWTBackend.name: PyJWTBackend
+}
+
+
+def get_backend(name):
+    if name not in BACKENDS:
+        raise ValueError(f'Unknown JWT backend {name!r}, '
+                         f'expected one of {sorted(BACKENDS)}')
+    return BACKENDS[name]()
@@ -0,0 +1,126 @@
+import json
+import logging
+import threading
+import time
+from urllib.request import urlopen
+
+logger = logging.getLogger(__name__)
+
+'''
+JWKSKeyStore
+    process-wide cache of the identity provider's signing keys
+
+    the key set is fetched from `url` (https:// in production, file:// or a
+    local http server in tests) and parsed once by `key_loader`, the
+    load_key of the JWT backend that verifies the tokens, into ready-to-use
+    RSA keys indexed by `kid`.
+
+    - keys are refetched once they are older than `ttl` seconds
+    - an unknown `kid` triggers a refetch, at most once every
+      `min_refresh_interval` seconds, so bad tokens cannot cause a storm
+    - if a refetch fails the previously fetched keys keep being served
+    - refresh(rate_limited=False) fetches ahead of any request, such as a
+      worker's warmup, whose failure must not delay the first requests
+'''
+
+
+class JWKSKeyStore:
+    def __init__(self, url, key_loader, ttl=600, min_refresh_interval=30,
+                 timeout=5, clock=time.monotonic):
+        self.url = url
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self.key_loader = key_loader
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._keys = {}
+        self._fetched_at = None
+        self._attempted_at = None
+
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+
+    def get_key(self, kid):
+        if self._is_stale():
+            self.refresh()
+
+        key = self._keys.get(kid)
+        if key is None:
+            self.misses += 1
+            with self._lock:
+                # a refresh in flight may have brought the key in while we
+                # were waiting for the lock
+                key = self._keys.get(kid)
+                if key is None and self._may_refresh():
+                    self._refresh()
+                    key = self._keys.get(kid)
+        else:
+            self.hits += 1
+
+        return key
+
+    def refresh(self, rate_limited=True):
+        attempted_at = self._attempted_at
+        with self._lock:
+            # another thread refreshed while we were waiting for the lock
+            if self._attempted_at != attempted_at:
+                return bool(self._keys)
+            return self._refresh(rate_limited)
+
+    def _refresh(self, rate_limited=True):
+        # stamped once the attempt is over, so that the requests waiting
+        # for it are not turned away by the rate limit
+        try:
+            keys = self._parse(self._fetch())
+        except Exception as e:
+            self.refresh_failures += 1
+            logger.warning('Unable to refresh JWKS from %s: %s',
+                           self.url, e)
+            if rate_limited:
+                self._attempted_at = self._clock()
+            return False
+
+        self._keys = keys
+        self._fetched_at = self._attempted_at = self._clock()
+        self.refreshes += 1
+        return True
+
+    def stats(self):
+        return {
+            'keys': len(self._keys),
+            'hits': self.hits,
+            'misses': self.misses,
+            'refreshes': self.refreshes,
+            'refresh_failures': self.refresh_failures
+        }
+
+    def _is_stale(self):
+        if self._fetched_at is None:
+            return self._may_refresh()
+        if self._clock() - self._fetched_at < self.ttl:
+            return False
+        return self._may_refresh()
+
+    def _may_refresh(self):
+        if self._attempted_at is None:
+            return True
+        return self._clock() - self._attempted_at >= self.min_refresh_interval
+
+    def _fetch(self):
+        with urlopen(self.url, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    def _parse(self, jwks):
+        keys = {}
+        for key in jwks['keys']:
+            if key.get('kty') != 'RSA' or key.get('use', 'sig') != 'sig':
+                continue
+            try:
+                keys[key['kid']] = self.key_loader(key)
+            except Exception as e:
+                logger.warning('Skipping unusable JWKS key %s: %s',
+                               key.get('kid'), e)
+        return keys
@@ -0,0 +1,125 @@
+import base64
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from Crypto.PublicKey import RSA
+from jose import jwt
+
+'''
+ROLE_PERMISSIONS
+    permissions granted to each role, mirroring the permission matrix
+    in the README
+'''
+ROLE_PERMISSIONS = {
+    'casting_assistant': [
+        'get:actors', 'get:movies', 'get:casts'
+    ],
+    'casting_director': [
+        'get:actors', 'post:actors', 'patch:actors', 'delete:actors',
+        'get:movies', 'patch:movies',
+        'get:casts', 'post:casts', 'patch:casts', 'delete:casts'
+    ],
+    'executive_producer': [
+        'get:actors', 'post:actors', 'patch:actors', 'delete:actors',
+        'get:movies', 'post:movies', 'patch:movies', 'delete:movies',
+        'get:casts', 'post:casts', 'patch:casts', 'delete:casts'
+    ]
+}
+
+
+def _b64_uint(value):
+    data = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+'''
+LocalIdentityProvider
+    offline stand-in for Auth0, used by tests and benchmarks
+
+    generates an RS256 key pair, publishes it as a JWKS document (as a
+    dict, a file or over a local http server) and mints access tokens
+    carrying the given permissions
+'''
+
+
+class LocalIdentityProvider:
+    def __init__(self, domain, audience, kid='local-key', bits=2048):
+        self.domain = domain
+        self.audience = audience
+        self.kid = kid
+        self.key = RSA.generate(bits)
+        self._private_pem = self.key.exportKey('PEM').decode('ascii')
+        self._server = None
+
+    @property
+    def issuer(self):
+        return 'https://' + self.domain + '/'
+
+    def jwks(self):
+        public_key = self.key.publickey()
+        return {
+            'keys': [{
+                'kty': 'RSA',
+                'kid': self.kid,
+                'use': 'sig',
+                'alg': 'RS256',
+                'n': _b64_uint(public_key.n),
+                'e': _b64_uint(public_key.e)
+            }]
+        }
+
+    def write_jwks(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.jwks(), f)
+        return 'file://' + path
+
+    def mint(self, permissions=(), expires_in=3600, kid=None, **claims):
+        now = int(time.time())
+        payload = {
+            'iss': self.issuer,
+            'sub': 'local|' + self.kid,
+            'aud': self.audience,
+            'iat': now,
+            'exp': now + expires_in,
+            'permissions': list(permissions)
+        }
+        payload.update(claims)
+        return jwt.encode(payload, self._private_pem, algorithm='RS256',
+                          headers={'kid': kid or self.kid})
+
+    def mint_for_role(self, role, **kwargs):
+        return self.mint(ROLE_PERMISSIONS[role], sub='local|' + role,
+                         **kwargs)
+
+    def serve(self, host='127.0.0.1', port=0):
+        body = json.dumps(self.jwks()).encode('utf-8')
+
+        class JWKSHandler(BaseHTTPRequestHandler):
+            requests_served = 0
+
+            def do_GET(self):
+                JWKSHandler.requests_served += 1
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), JWKSHandler)
+        self._server.handler = JWKSHandler
+        thread = threading.Thread(target=self._server.serve_forever,
+                                  daemon=True)
+        thread.start()
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/.well-known/jwks.json'
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
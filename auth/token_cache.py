@@ -0,0 +1,103 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+'''
+TokenCache
+    bounded LRU cache of already verified token payloads
+
+    entries are keyed by the sha256 digest of the token, so raw tokens are
+    never kept in memory, and expire at the token's `exp` claim or after
+    `max_ttl` seconds, whichever comes first. Tokens without an `exp`
+    claim are not cached.
+
+    the cache is bounded by `max_entries` and by `max_bytes`, the
+    approximate size of the cached payloads serialized as JSON.
+'''
+
+
+class TokenCache:
+    def __init__(self, max_entries=1024, max_bytes=1024 * 1024, max_ttl=300,
+                 clock=time.time):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_ttl = max_ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def _digest(token):
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def get(self, token):
+        if self.max_entries <= 0:
+            return None
+
+        key = self._digest(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            payload, expires_at, size = entry
+            if self._clock() >= expires_at:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return payload
+
+    def put(self, token, payload):
+        exp = payload.get('exp')
+        if self.max_entries <= 0 or not isinstance(exp, (int, float)):
+            return
+
+        expires_at = min(exp, self._clock() + self.max_ttl)
+        size = len(json.dumps(payload))
+        if size > self.max_bytes:
+            return
+
+        key = self._digest(token)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (payload, expires_at, size)
+            self._bytes += size
+            while (len(self._entries) > self.max_entries or
+                   self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+    def _remove(self, key):
+        payload, expires_at, size = self._entries.pop(key)
+        self._bytes -= size
@@ -0,0 +1,176 @@
+'''
+Throughput and tail latency of the sync and the ASGI app under many
+concurrent clients
+
+    python -m benchmarks.bench_asgi [--clients 1000] [--duration 20]
+        [--workers 4] [--path /api/actors?limit=20] [--database URL]
+
+seeds a synthetic catalog in a temporary SQLite file (or uses --database),
+then serves the app on a local port, one way after the other:
+
+    sync   gunicorn --workers N app:app, sync workers, DATABASE_URL as is
+    async  uvicorn asgi:app --workers N, DATABASE_URL with its asyncio
+           driver (sqlite+aiosqlite, postgresql+asyncpg)
+
+and drives each with --clients concurrent clients for --duration seconds.
+Every client sends its requests one after the other on fresh connections,
+with a casting assistant token. Prints requests per second, p50 and p99
+latency and the number of failed requests. The async run needs
+
+    pip install uvicorn aiosqlite    # asyncpg for PostgreSQL
+
+and is skipped when uvicorn is missing.
+'''
+import argparse
+import asyncio
+import importlib.util
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import AUDIENCE, DOMAIN, seed_catalog
+
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite',
+                 'postgresql': 'postgresql+asyncpg'}
+
+
+def async_url(database_url):
+    scheme, rest = database_url.split(':', 1)
+    return ASYNC_DRIVERS.get(scheme, scheme) + ':' + rest
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+async def fetch(port, request, timeout):
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection('127.0.0.1', port), timeout)
+    try:
+        writer.write(request)
+        await writer.drain()
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+    return status_line.split(b' ', 2)[1] == b'200'
+
+
+async def client(port, request, deadline, timeout, latencies, failures):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            ok = await fetch(port, request, timeout)
+        except (OSError, asyncio.TimeoutError, IndexError):
+            ok = False
+        if ok:
+            latencies.append(time.perf_counter() - start)
+        else:
+            failures.append(time.perf_counter() - start)
+
+
+async def load(port, request, clients, duration, timeout):
+    latencies, failures = [], []
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(*(client(port, request, deadline, timeout,
+                                  latencies, failures)
+                           for _ in range(clients)))
+    return latencies, failures
+
+
+def wait_until_serving(port, server, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError('server exited with %d' % server.returncode)
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('server did not start')
+
+
+def run(name, command, env, args, token):
+    port = free_port()
+    request = (f'GET {args.path} HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\n'
+               f'Authorization: Bearer {token}\r\n'
+               f'Connection: close\r\n\r\n').encode('ascii')
+    server = subprocess.Popen(
+        [argument.format(port=port) for argument in command], env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_serving(port, server)
+        # warm every worker up before measuring
+        asyncio.run(load(port, request, args.workers * 4, 2, args.timeout))
+        latencies, failures = asyncio.run(load(
+            port, request, args.clients, args.duration, args.timeout))
+    finally:
+        server.terminate()
+        server.wait()
+
+    if not latencies:
+        print(f'{name:6s} no successful request, {len(failures)} failed')
+        return
+    print(f'{name:6s} {len(latencies) / args.duration:10.0f} '
+          f'{percentile(latencies, 0.5) * 1000:9.1f} '
+          f'{percentile(latencies, 0.99) * 1000:9.1f} {len(failures):8d}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--path', default='/api/actors?limit=20')
+    parser.add_argument('--database')
+    args = parser.parse_args()
+
+    # one socket per client, plus the servers' when they run on this host
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    from auth.local_idp import LocalIdentityProvider
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        database_url = args.database or 'sqlite:///' + os.path.join(
+            tmpdir, 'catalog.db')
+        seed_catalog(database_url, movies=1000, actors=1000,
+                     casts_per_movie=5)
+        idp = LocalIdentityProvider(DOMAIN, AUDIENCE)
+        env = dict(os.environ, AUTH0_DOMAIN=DOMAIN, API_AUDIENCE=AUDIENCE,
+                   EXCITED='true', DATABASE_URL=database_url,
+                   JWKS_URL=idp.write_jwks(os.path.join(tmpdir,
+                                                        'jwks.json')))
+        token = idp.mint_for_role('casting_assistant')
+
+        print(f'{args.clients} clients, {args.workers} workers, {args.path}')
+        print(f'{"mode":6s} {"req/s":>10s} {"p50 ms":>9s} {"p99 ms":>9s} '
+              f'{"failed":>8s}')
+        run('sync', [sys.executable, '-m', 'gunicorn', '--workers',
+                     str(args.workers), '--backlog', '4096',
+                     '--bind', '127.0.0.1:{port}', 'app:app'],
+            env, args, token)
+        if importlib.util.find_spec('uvicorn') is None:
+            print('async  skipped: pip install uvicorn aiosqlite')
+            return
+        run('async', [sys.executable, '-m', 'uvicorn', '--workers',
+                      str(args.workers), '--backlog', '4096',
+                      '--port', '{port}', '--no-access-log', 'asgi:app'],
+            dict(env, DATABASE_URL=async_url(database_url)), args, token)
+
+
+if __name__ == '__main__':
+    main()
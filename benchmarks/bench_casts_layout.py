@@ -0,0 +1,204 @@
+'''
+Size and join timings of the casts table, keyed by a surrogate id or by
+(movie_id, actor_id)
+
+    python -m benchmarks.bench_casts_layout [--database URL]
+        [--rows 10000000] [--movies 100000] [--actors 1000000]
+        [--lookups 2000]
+
+builds both layouts side by side from the same synthetic pairs:
+
+    surrogate  id primary key, unique (movie_id, actor_id), index
+               (actor_id), as before migration 8d41f6b0c2e7
+    composite  primary key (movie_id, actor_id), index (actor_id, movie_id)
+
+then prints the size of each table and index and the mean time of the
+joins behind Actor.movies and Movie.actors for random actors and movies.
+Without --database a temporary SQLite file is used; a PostgreSQL URL
+must point to a database the script may create tables in.
+'''
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import (Column, DateTime, ForeignKey, Index, Integer,
+                        MetaData, String, Table, UniqueConstraint,
+                        create_engine, text)
+
+metadata = MetaData()
+
+movies = Table(
+    'bench_movies', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('title', String),
+    Column('release_date', DateTime))
+
+actors = Table(
+    'bench_actors', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('name', String),
+    Column('age', Integer),
+    Column('gender', String))
+
+LAYOUTS = {
+    'surrogate': Table(
+        'bench_casts_surrogate', metadata,
+        Column('id', Integer, primary_key=True),
+        Column('movie_id', Integer, ForeignKey('bench_movies.id'),
+               nullable=False),
+        Column('actor_id', Integer, ForeignKey('bench_actors.id'),
+               nullable=False),
+        UniqueConstraint('movie_id', 'actor_id'),
+        Index('ix_bench_casts_surrogate_actor_id', 'actor_id')),
+    'composite': Table(
+        'bench_casts_composite', metadata,
+        Column('movie_id', Integer, ForeignKey('bench_movies.id'),
+               primary_key=True),
+        Column('actor_id', Integer, ForeignKey('bench_actors.id'),
+               primary_key=True),
+        Index('ix_bench_casts_composite_actor_id_movie_id',
+              'actor_id', 'movie_id'),
+        sqlite_with_rowid=False),
+}
+
+# the statements Actor.movies and Movie.actors load through `secondary`
+ACTOR_MOVIES = ('SELECT m.id, m.title, m.release_date FROM bench_movies m '
+                'JOIN {casts} casts ON m.id = casts.movie_id '
+                'WHERE casts.actor_id = :id')
+MOVIE_ACTORS = ('SELECT a.id, a.name, a.age, a.gender FROM bench_actors a '
+                'JOIN {casts} casts ON a.id = casts.actor_id '
+                'WHERE casts.movie_id = :id')
+
+
+def series(connection, count):
+    if connection.dialect.name == 'postgresql':
+        return f'(SELECT i FROM generate_series(0, {count - 1}) AS i) AS n'
+    return (f'(WITH RECURSIVE s(i) AS (SELECT 0 UNION ALL '
+            f'SELECT i + 1 FROM s WHERE i < {count - 1}) SELECT i FROM s) '
+            f'AS n')
+
+
+'''
+seed(engine, rows, movie_count, actor_count)
+    movie i gets the rows / movie_count actors (i * 7919 + k) mod
+    actor_count, distinct as long as 7919 and actor_count are coprime
+'''
+
+
+def seed(engine, rows, movie_count, actor_count):
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+    per_movie = rows // movie_count
+    with engine.begin() as connection:
+        connection.execute(text(
+            f"INSERT INTO bench_movies (id, title, release_date) "
+            f"SELECT i + 1, 'Movie ' || i, :start "
+            f"FROM {series(connection, movie_count)}"),
+            {'start': '2000-01-01 00:00:00'})
+        connection.execute(text(
+            f"INSERT INTO bench_actors (id, name, age, gender) "
+            f"SELECT i + 1, 'Actor ' || i, 18 + i % 60, 'n/a' "
+            f"FROM {series(connection, actor_count)}"))
+        for name, table in LAYOUTS.items():
+            start = time.perf_counter()
+            connection.execute(text(
+                f'INSERT INTO {table.name} (movie_id, actor_id) '
+                f'SELECT i / {per_movie} + 1, '
+                f'((i / {per_movie}) * 7919 + i % {per_movie}) '
+                f'% {actor_count} + 1 '
+                f'FROM {series(connection, movie_count * per_movie)} '
+                f'ORDER BY 1, 2'))
+            print(f'loaded {name:10s} in '
+                  f'{time.perf_counter() - start:8.1f} s')
+    with engine.connect() as connection:
+        if connection.dialect.name == 'postgresql':
+            connection = connection.execution_options(
+                isolation_level='AUTOCOMMIT')
+            connection.exec_driver_sql('VACUUM ANALYZE')
+        else:
+            connection.exec_driver_sql('ANALYZE')
+
+
+def sizes(connection, table):
+    if connection.dialect.name == 'postgresql':
+        return connection.execute(text(
+            'SELECT relname, pg_relation_size(oid) FROM pg_class '
+            'WHERE oid = CAST(:table AS regclass) OR oid IN ('
+            'SELECT indexrelid FROM pg_index '
+            'WHERE indrelid = CAST(:table AS regclass)) '
+            'ORDER BY relkind DESC, relname'), {'table': table}).fetchall()
+    return connection.execute(text(
+        'SELECT name, SUM(pgsize) FROM dbstat WHERE name IN ('
+        'SELECT name FROM sqlite_master WHERE tbl_name = :table) '
+        'GROUP BY name ORDER BY name != :table, name'),
+        {'table': table}).fetchall()
+
+
+def time_joins(connection, statement, ids):
+    statement = text(statement)
+    start = time.perf_counter()
+    rows = 0
+    for id in ids:
+        rows += len(connection.execute(statement, {'id': id}).fetchall())
+    return (time.perf_counter() - start) * 1000 / len(ids), rows / len(ids)
+
+
+def plan(connection, statement):
+    if connection.dialect.name == 'postgresql':
+        lines = connection.execute(text('EXPLAIN ' + statement),
+                                   {'id': 1}).scalars()
+    else:
+        lines = (row[-1] for row in connection.execute(
+            text('EXPLAIN QUERY PLAN ' + statement), {'id': 1}))
+    return ' / '.join(line.strip() for line in lines
+                      if 'casts' in line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--database')
+    parser.add_argument('--rows', type=int, default=10000000)
+    parser.add_argument('--movies', type=int, default=100000)
+    parser.add_argument('--actors', type=int, default=1000000)
+    parser.add_argument('--lookups', type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        engine = create_engine(args.database or 'sqlite:///' + os.path.join(
+            tmpdir, 'casts.db'))
+        seed(engine, args.rows, args.movies, args.actors)
+
+        generator = random.Random(42)
+        actor_ids = [generator.randint(1, args.actors)
+                     for _ in range(args.lookups)]
+        movie_ids = [generator.randint(1, args.movies)
+                     for _ in range(args.lookups)]
+
+        with engine.connect() as connection:
+            for name, table in LAYOUTS.items():
+                print()
+                print(f'== {name} ==')
+                total = 0
+                for relation, size in sizes(connection, table.name):
+                    total += size
+                    print(f'  {relation:45s} {size / 2 ** 20:10.1f} MB')
+                print(f'  {"total":45s} {total / 2 ** 20:10.1f} MB')
+
+                for label, statement, ids in (
+                        ('Actor.movies', ACTOR_MOVIES, actor_ids),
+                        ('Movie.actors', MOVIE_ACTORS, movie_ids)):
+                    statement = statement.format(casts=table.name)
+                    mean_ms, mean_rows = time_joins(connection, statement,
+                                                    ids)
+                    print(f'  {label:13s} {mean_ms:8.3f} ms/query '
+                          f'{mean_rows:6.1f} rows  '
+                          f'{plan(connection, statement)}')
+
+        metadata.drop_all(engine)
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+'''
+Latency of the first requests served by a new gunicorn worker, with and
+without the warmup of gunicorn.conf.py
+
+    python -m benchmarks.bench_cold_start [--runs 5] [--settle 2]
+        [--database URL]
+
+starts gunicorn with one worker against a synthetic catalog in a
+temporary SQLite file (or --database), the signing keys served by a local
+HTTP server, in two modes:
+
+    cold  GUNICORN_PRELOAD=false GUNICORN_WARMUP=false
+    warm  the defaults of gunicorn.conf.py
+
+waits --settle seconds after the worker booted, then sends one request
+to each route below in turn, the first one being the worker's first
+request, and a last request to the first route. Prints the median
+latency of each request over --runs fresh servers.
+'''
+import argparse
+import http.client
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import AUDIENCE, DOMAIN, seed_catalog
+
+PATHS = ['/api/actors?limit=20', '/api/movies?limit=20',
+         '/api/casts?limit=20', '/api/search?q=act',
+         '/api/actors?limit=20']
+
+MODES = {
+    'cold': {'GUNICORN_PRELOAD': 'false', 'GUNICORN_WARMUP': 'false'},
+    'warm': {}
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_worker(server, timeout=30):
+    deadline = time.monotonic() + timeout
+    for line in server.stderr:
+        if 'Booting worker' in line:
+            return
+        if time.monotonic() > deadline:
+            break
+    raise RuntimeError('gunicorn did not boot a worker')
+
+
+def first_requests(env, token, settle):
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--workers', '1',
+         '--bind', f'127.0.0.1:{port}', 'app:app'],
+        env=dict(env, PORT=str(port)), stderr=subprocess.PIPE, text=True,
+        stdout=subprocess.DEVNULL)
+    try:
+        wait_for_worker(server)
+        time.sleep(settle)
+        latencies = []
+        for path in PATHS:
+            connection = http.client.HTTPConnection('127.0.0.1', port)
+            start = time.perf_counter()
+            connection.request('GET', path, headers={
+                'Authorization': 'Bearer ' + token})
+            response = connection.getresponse()
+            response.read()
+            latencies.append(time.perf_counter() - start)
+            connection.close()
+            assert response.status == 200, (path, response.status)
+    finally:
+        server.terminate()
+        server.communicate()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--settle', type=float, default=2)
+    parser.add_argument('--database')
+    args = parser.parse_args()
+
+    from auth.local_idp import LocalIdentityProvider
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        database_url = args.database or 'sqlite:///' + os.path.join(
+            tmpdir, 'catalog.db')
+        seed_catalog(database_url, movies=1000, actors=1000,
+                     casts_per_movie=5)
+        idp = LocalIdentityProvider(DOMAIN, AUDIENCE)
+        env = dict(os.environ, AUTH0_DOMAIN=DOMAIN, API_AUDIENCE=AUDIENCE,
+                   EXCITED='true', DATABASE_URL=database_url,
+                   JWKS_URL=idp.serve())
+        token = idp.mint_for_role('executive_producer')
+
+        try:
+            results = {mode: [first_requests(dict(env, **settings), token,
+                                             args.settle)
+                              for _ in range(args.runs)]
+                       for mode, settings in MODES.items()}
+        finally:
+            idp.shutdown()
+
+    print(f'{"request":4s} {"path":24s} ' +
+          ' '.join(f'{mode + " ms":>9s}' for mode in MODES))
+    for index, path in enumerate(PATHS):
+        print(f'{index + 1:<4d} {path:24s} ' + ' '.join(
+            f'{statistics.median(run[index] for run in runs) * 1000:9.1f}'
+            for runs in results.values()))
+
+
+if __name__ == '__main__':
+    main()
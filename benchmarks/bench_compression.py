@@ -0,0 +1,69 @@
+'''
+Bytes saved against CPU spent by response compression, per endpoint
+
+    python -m benchmarks.bench_compression [--limit 1000] [--repeat 20]
+
+fetches one uncompressed page of each listing from a synthetic catalog,
+then compresses the body with gzip and, when the brotli package is
+installed, brotli at a few levels. Prints the compressed size, the share
+of bytes saved and the CPU time per response, best of --repeat runs.
+'''
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.common import offline_app, seed_catalog
+
+ENDPOINTS = ['/api/actors', '/api/movies', '/api/casts',
+             '/api/movies?expand=actors']
+
+LEVELS = {'gzip': [1, 6, 9], 'br': [1, 4, 11]}
+
+
+def compress(compressor):
+    def run(body):
+        return compressor.compress(body) + compressor.finish()
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--limit', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        database_url = 'sqlite:///' + os.path.join(tmpdir, 'catalog.db')
+        seed_catalog(database_url, movies=2000, actors=5000,
+                     casts_per_movie=10)
+        app, headers = offline_app(database_url, tmpdir)
+        from web import compression
+
+        client = app.test_client()
+        print(f'{"endpoint":28s} {"coding":10s} {"bytes":>10s} '
+              f'{"saved":>7s} {"cpu ms":>8s} {"MB/s":>7s}')
+        for endpoint in ENDPOINTS:
+            separator = '&' if '?' in endpoint else '?'
+            body = client.get(f'{endpoint}{separator}limit={args.limit}',
+                              headers=headers['casting_assistant']).get_data()
+            print(f'{endpoint:28s} {"identity":10s} {len(body):10d}')
+            for encoding, levels in LEVELS.items():
+                if encoding not in compression.COMPRESSORS:
+                    continue
+                for level in levels:
+                    best = None
+                    for _ in range(args.repeat):
+                        compressor = compression.COMPRESSORS[encoding](level)
+                        start = time.process_time()
+                        size = len(compress(compressor)(body))
+                        elapsed = time.process_time() - start
+                        best = elapsed if best is None else min(best, elapsed)
+                    print(f'{"":28s} {encoding + " " + str(level):10s} '
+                          f'{size:10d} {1 - size / len(body):7.1%} '
+                          f'{best * 1000:8.2f} '
+                          f'{len(body) / best / 2 ** 20:7.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+'''
+Time-to-first-byte and peak RSS of a full actor export
+
+    python -m benchmarks.bench_export [--rows 200000]
+
+compares the previous single-response listing (every ORM object, the list
+of dicts and the JSON string built in memory at once) with the streaming
+NDJSON export. Each mode runs in its own process against the same SQLite
+file so the peak RSS figures do not mix.
+'''
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import offline_app, seed_catalog
+
+
+def run_mode(mode, database_url, tmpdir):
+    app, headers = offline_app(database_url, tmpdir)
+    from flask import jsonify
+    from database.models import Actor
+
+    client = app.test_client()
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    if mode == 'json':
+        with app.test_request_context():
+            response = jsonify({
+                'success': True,
+                'actors': [actor.short() for actor in Actor.query.all()]
+            })
+        chunks = iter(response.response)
+    else:
+        response = client.get('/api/actors?format=ndjson', headers=headers[
+            'casting_assistant'], buffered=False)
+        chunks = response.response
+
+    size = 0
+    ttfb = None
+    for chunk in chunks:
+        if ttfb is None:
+            ttfb = time.perf_counter() - start
+        size += len(chunk)
+    total = time.perf_counter() - start
+    response.close()
+
+    return {
+        'mode': mode,
+        'ttfb_ms': ttfb * 1000,
+        'total_ms': total * 1000,
+        'bytes': size,
+        'baseline_rss_kb': baseline_rss,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--mode', choices=['json', 'ndjson'])
+    parser.add_argument('--database')
+    args = parser.parse_args()
+
+    if args.mode:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            print(json.dumps(run_mode(args.mode, args.database, tmpdir)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        database_url = 'sqlite:///' + os.path.join(tmpdir, 'export.db')
+        seed_catalog(database_url, movies=0, actors=args.rows)
+
+        print(f'{"mode":8s} {"ttfb ms":>10s} {"total ms":>10s} '
+              f'{"MB":>8s} {"peak RSS MB":>12s} {"over baseline":>14s}')
+        for mode in ('json', 'ndjson'):
+            output = subprocess.run(
+                [sys.executable, '-W', 'ignore', '-m',
+                 'benchmarks.bench_export', '--mode', mode,
+                 '--database', database_url],
+                check=True, capture_output=True, text=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            added_kb = result['peak_rss_kb'] - result['baseline_rss_kb']
+            print(f'{mode:8s} {result["ttfb_ms"]:10.1f} '
+                  f'{result["total_ms"]:10.1f} '
+                  f'{result["bytes"] / 2 ** 20:8.1f} '
+                  f'{result["peak_rss_kb"] / 1024:12.1f} '
+                  f'{added_kb / 1024:14.1f}')
+
+
+if __name__ == '__main__':
+    main()
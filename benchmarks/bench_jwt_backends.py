@@ -0,0 +1,52 @@
+'''
+RS256 verification throughput of each JWT backend
+
+    python -m benchmarks.bench_jwt_backends [--seconds 2]
+
+tokens are signed with a locally generated key; backends whose optional
+packages are not installed are reported as unavailable.
+'''
+import argparse
+import time
+
+from auth.backends import BACKENDS, get_backend
+from auth.local_idp import LocalIdentityProvider
+
+DOMAIN = 'capstone.test'
+AUDIENCE = 'capstone-app'
+
+
+def measure(backend, key, token, seconds):
+    issuer = 'https://' + DOMAIN + '/'
+    verifications = 0
+    deadline = time.perf_counter() + seconds
+    start = time.perf_counter()
+    while time.perf_counter() < deadline:
+        backend.decode(token, key, algorithms=['RS256'],
+                       audience=AUDIENCE, issuer=issuer)
+        verifications += 1
+    return verifications / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--seconds', type=float, default=2.0)
+    args = parser.parse_args()
+
+    idp = LocalIdentityProvider(DOMAIN, AUDIENCE)
+    token = idp.mint(['get:actors', 'get:movies'])
+    jwk = idp.jwks()['keys'][0]
+
+    for name in sorted(BACKENDS):
+        try:
+            backend = get_backend(name)
+        except ImportError as e:
+            print(f'{name:8s} unavailable ({e})')
+            continue
+        rate = measure(backend, backend.load_key(jwk), token, args.seconds)
+        print(f'{name:8s} {rate:10.0f} verifications/s '
+              f'{1e6 / rate:8.1f} us/verification')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+'''
+Per-request cost of the Prometheus metrics of web/metrics.py
+
+    python -m benchmarks.bench_metrics [--requests 500] [--rounds 3]
+
+seeds a synthetic catalog in a temporary SQLite file and serves the
+routes below through the Flask test client, the response cache off so
+that every request reads the database, in a new process per mode:
+
+    off            METRICS_ENABLED=false
+    single         metrics kept in memory
+    multiprocess   metrics written to files in PROMETHEUS_MULTIPROC_DIR,
+                   as under gunicorn
+
+Prints the median CPU time per request and per scrape of /metrics over
+--rounds rounds. Needs pip install prometheus_client.
+'''
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import offline_app, seed_catalog
+
+PATHS = ['/api/actors?limit=20', '/api/movies?limit=20',
+         '/api/casts?limit=20', '/api/search?q=act']
+
+MODES = ['off', 'single', 'multiprocess']
+
+
+def measure(database_url, tmpdir, requests):
+    app, headers = offline_app(database_url, tmpdir)
+    headers = headers['casting_assistant']
+    client = app.test_client()
+    for index in range(len(PATHS) * 5 + requests):
+        if index == len(PATHS) * 5:
+            start = time.process_time()
+        response = client.get(PATHS[index % len(PATHS)], headers=headers)
+        assert response.status_code == 200, response.status_code
+    per_request = (time.process_time() - start) / requests
+
+    if client.get('/metrics').status_code == 404:
+        return per_request, None
+    start = time.process_time()
+    scrapes = 20
+    for _ in range(scrapes):
+        client.get('/metrics')
+    return per_request, (time.process_time() - start) / scrapes
+
+
+def run_mode(mode, database_url, tmpdir, requests):
+    env = dict(os.environ, RESPONSE_CACHE_SIZE='0',
+               METRICS_ENABLED=str(mode != 'off').lower())
+    env.pop('PROMETHEUS_MULTIPROC_DIR', None)
+    if mode == 'multiprocess':
+        env['PROMETHEUS_MULTIPROC_DIR'] = tempfile.mkdtemp(dir=tmpdir)
+    output = subprocess.run(
+        [sys.executable, '-W', 'ignore', '-m', 'benchmarks.bench_metrics',
+         '--measure', database_url, '--tmpdir', tmpdir,
+         '--requests', str(requests)],
+        env=env, check=True, stdout=subprocess.PIPE, text=True).stdout
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--measure', help=argparse.SUPPRESS)
+    parser.add_argument('--tmpdir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.measure, args.tmpdir, args.requests)))
+        return
+
+    if importlib.util.find_spec('prometheus_client') is None:
+        sys.exit('pip install prometheus_client')
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        database_url = 'sqlite:///' + os.path.join(tmpdir, 'catalog.db')
+        seed_catalog(database_url, movies=1000, actors=1000,
+                     casts_per_movie=5)
+        results = {mode: [] for mode in MODES}
+        for _ in range(args.rounds):
+            for mode in MODES:
+                results[mode].append(run_mode(mode, database_url, tmpdir,
+                                              args.requests))
+
+    off = statistics.median(request for request, _ in results['off'])
+    print(f'requests: {args.requests} x {args.rounds} rounds')
+    print(f'{"mode":13s} {"us/request":>11s} {"added":>8s} '
+          f'{"us/scrape":>10s}')
+    for mode, runs in results.items():
+        per_request = statistics.median(request for request, _ in runs)
+        scrapes = [scrape for _, scrape in runs if scrape is not None]
+        per_scrape = (f'{statistics.median(scrapes) * 1e6:10.1f}'
+                      if scrapes else f'{"-":>10s}')
+        print(f'{mode:13s} {per_request * 1e6:11.1f} '
+              f'{(per_request - off) / off:+8.1%} {per_scrape}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+'''
+Latency of GET /api/search over a million-row catalog
+
+    python -m benchmarks.bench_search [--actors 800000] [--movies 200000]
+        [--queries 300] [--database URL]
+
+actor names and movie titles are drawn from a synthetic vocabulary of
+made-up words, so that prefixes are about as selective as in a real
+catalog. Typeahead queries are prefixes of 2 to 6 letters of words in
+the catalog, alone (from MIN_PREFIX_LENGTH letters) or after a complete
+first word. Latencies are reported for search_page alone and for the
+whole request, auth and JSON included. Without --database a temporary
+SQLite file is used.
+'''
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from benchmarks.common import configure_environment, offline_app
+
+SYLLABLES = ['ka', 'ri', 'mo', 'an', 'le', 'su', 'to', 'vi', 'na', 'el',
+             'do', 'ra', 'mi', 'ben', 'sa', 'lo', 'ter', 'gi', 'ur', 'phe']
+
+
+def vocabulary(generator, count):
+    words = set()
+    while len(words) < count:
+        words.add(''.join(generator.choice(SYLLABLES)
+                          for _ in range(generator.randint(2, 4))))
+    return sorted(words)
+
+
+def seed(database_url, actors, movies, generator):
+    configure_environment(database_url)
+
+    from datetime import datetime
+    from sqlalchemy import create_engine
+    from database.models import Actor, Movie, db
+    from database.search import rebuild_search_index
+
+    first_names = vocabulary(generator, 2000)
+    last_names = vocabulary(generator, 20000)
+    title_words = vocabulary(generator, 8000)
+
+    engine = create_engine(database_url)
+    db.Model.metadata.create_all(engine)
+    with engine.begin() as connection:
+        for start in range(0, actors, 10000):
+            connection.execute(Actor.__table__.insert(), [
+                {'name': f'{generator.choice(first_names).title()} '
+                         f'{generator.choice(last_names).title()}',
+                 'age': 30, 'gender': 'n/a'}
+                for _ in range(start, min(actors, start + 10000))])
+        for start in range(0, movies, 10000):
+            connection.execute(Movie.__table__.insert(), [
+                {'title': ' '.join(generator.choice(title_words).title()
+                                   for _ in range(generator.randint(1, 4))),
+                 'release_date': datetime(2000, 1, 1)}
+                for _ in range(start, min(movies, start + 10000))])
+        rebuild_search_index(connection)
+        if connection.dialect.name == 'sqlite':
+            for table in ('actors_search', 'movies_search'):
+                connection.exec_driver_sql(
+                    f"INSERT INTO {table} ({table}) VALUES ('optimize')")
+    engine.dispose()
+    return first_names + last_names + title_words
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return {p: samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+            for p in (50, 95, 99)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--actors', type=int, default=800000)
+    parser.add_argument('--movies', type=int, default=200000)
+    parser.add_argument('--queries', type=int, default=300)
+    parser.add_argument('--database')
+    args = parser.parse_args()
+
+    generator = random.Random(7)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        database_url = args.database or 'sqlite:///' + os.path.join(
+            tmpdir, 'search.db')
+        start = time.perf_counter()
+        words = seed(database_url, args.actors, args.movies, generator)
+        print(f'seeded {args.actors + args.movies} rows in '
+              f'{time.perf_counter() - start:.1f} s')
+
+        app, headers = offline_app(database_url, tmpdir)
+        from database.models import db
+        from database.search import (MIN_PREFIX_LENGTH, search_page,
+                                     search_terms)
+
+        client = app.test_client()
+        print(f'{"query":22s} {"hits/page":>9s} {"p50 ms":>8s} '
+              f'{"p95 ms":>8s} {"p99 ms":>8s} {"route p50":>10s}')
+        for length in (2, 3, 4, 6):
+            for two_words in (False, True):
+                if not two_words and length < MIN_PREFIX_LENGTH:
+                    continue
+                queries = []
+                for _ in range(args.queries):
+                    word = generator.choice(words)
+                    query = word[:length]
+                    if two_words:
+                        query = generator.choice(words) + ' ' + query
+                    queries.append(query)
+
+                timings, route_timings, hits = [], [], 0
+                with app.app_context():
+                    for query in queries:
+                        start = time.perf_counter()
+                        page, _ = search_page(db.session,
+                                              search_terms(query), 10)
+                        timings.append((time.perf_counter() - start) * 1000)
+                        hits += len(page)
+                        db.session.remove()
+                for query in queries:
+                    start = time.perf_counter()
+                    client.get('/api/search', query_string={
+                        'q': query, 'limit': 10},
+                        headers=headers['casting_assistant'])
+                    route_timings.append(
+                        (time.perf_counter() - start) * 1000)
+
+                label = ('word + ' if two_words else '') + f'{length} letters'
+                result = percentiles(timings)
+                print(f'{label:22s} {hits / len(queries):9.1f} '
+                      f'{result[50]:8.2f} {result[95]:8.2f} '
+                      f'{result[99]:8.2f} '
+                      f'{statistics.median(route_timings):10.2f}')
+
+
+if __name__ == '__main__':
+    main()
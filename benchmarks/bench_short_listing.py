@@ -0,0 +1,83 @@
+'''
+Throughput and allocations of short() listings, through ORM instances or
+plain column rows
+
+    python -m benchmarks.bench_short_listing [--rows 100000] [--repeat 5]
+        [--database URL]
+
+each path reads every actor, then every movie, builds the list of
+short() dictionaries and the JSON body jsonify sends:
+
+    orm   Model.query, one ORM instance per row, instance.short()
+    rows  Model.query_for_short(), Model.short_row(row)
+
+prints the best of --repeat runs as rows per second, and the peak memory
+allocated by one run as traced by tracemalloc, and checks that both paths
+produce byte-identical bodies. Without --database a temporary SQLite file
+is used.
+'''
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.common import offline_app, seed_catalog
+
+
+def listing(app, model, path):
+    from flask import jsonify
+    from database.models import db
+
+    with app.test_request_context():
+        if path == 'orm':
+            items = [item.short()
+                     for item in model.query.order_by(model.id)]
+        else:
+            items = [model.short_row(row) for row in
+                     model.query_for_short().order_by(model.id)]
+        body = jsonify({'success': True, 'items': items,
+                        'next_cursor': None}).get_data()
+        db.session.remove()
+    return body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--database')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        database_url = args.database or 'sqlite:///' + os.path.join(
+            tmpdir, 'listing.db')
+        seed_catalog(database_url, movies=args.rows, actors=args.rows)
+        app, _ = offline_app(database_url, tmpdir)
+        from database.models import Actor, Movie
+
+        print(f'{"table":8s} {"path":6s} {"rows/s":>10s} {"ms":>8s} '
+              f'{"peak MB":>9s} {"bytes/row":>10s}')
+        for model in (Actor, Movie):
+            bodies = {}
+            for path in ('orm', 'rows'):
+                best = None
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    bodies[path] = listing(app, model, path)
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+
+                tracemalloc.start()
+                listing(app, model, path)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+                print(f'{model.__tablename__:8s} {path:6s} '
+                      f'{args.rows / best:10.0f} {best * 1000:8.1f} '
+                      f'{peak / 2 ** 20:9.1f} {peak / args.rows:10.0f}')
+            assert bodies['orm'] == bodies['rows'], model.__tablename__
+
+
+if __name__ == '__main__':
+    main()
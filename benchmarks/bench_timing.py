@@ -0,0 +1,100 @@
+'''
+Per-request cost of the request timing of web/timing.py
+
+    python -m benchmarks.bench_timing [--requests 500] [--rounds 5]
+
+seeds a synthetic catalog in a temporary SQLite file and serves the
+routes below through the Flask test client, the response cache off so
+that every request reads the database, with two apps in turn:
+
+    off  REQUEST_TIMING_HEADER and REQUEST_TIMING_LOG unset
+    on   both set, the log lines written to /dev/null
+
+Prints the median CPU time per request over --rounds rounds, and the cost
+of the phases requires_auth still enters when timing is off.
+'''
+import argparse
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+from benchmarks.common import offline_app, seed_catalog
+
+PATHS = ['/api/actors?limit=20', '/api/movies?limit=20',
+         '/api/casts?limit=20', '/api/search?q=act']
+
+# phases entered by requires_auth for a cached token
+AUTH_PHASES = 3
+
+
+def run(app, headers, requests):
+    client = app.test_client()
+    start = time.process_time()
+    for index in range(requests):
+        response = client.get(PATHS[index % len(PATHS)], headers=headers)
+        assert response.status_code == 200, (response.status_code,
+                                             response.data)
+    return (time.process_time() - start) / requests
+
+
+def disabled_phase_cost(app, count=200000):
+    from web.timing import phase
+
+    with app.test_request_context():
+        start = time.process_time()
+        for _ in range(count):
+            with phase('auth.header'):
+                pass
+        return (time.process_time() - start) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    os.environ['RESPONSE_CACHE_SIZE'] = '0'
+    for name in ('REQUEST_TIMING_HEADER', 'REQUEST_TIMING_LOG'):
+        os.environ.pop(name, None)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        database_url = 'sqlite:///' + os.path.join(tmpdir, 'catalog.db')
+        seed_catalog(database_url, movies=1000, actors=1000,
+                     casts_per_movie=5)
+
+        from auth.local_idp import LocalIdentityProvider
+        from web.timing import logger
+        logger.addHandler(logging.StreamHandler(open(os.devnull, 'w')))
+
+        idp = LocalIdentityProvider(os.environ['AUTH0_DOMAIN'],
+                                    os.environ['API_AUDIENCE'])
+        apps = {}
+        apps['off'], headers = offline_app(database_url, tmpdir, idp)
+        os.environ['REQUEST_TIMING_HEADER'] = 'true'
+        os.environ['REQUEST_TIMING_LOG'] = 'true'
+        apps['on'], _ = offline_app(database_url, tmpdir, idp)
+        headers = headers['casting_assistant']
+
+        for app in apps.values():
+            run(app, headers, len(PATHS) * 5)
+        results = {mode: [] for mode in apps}
+        for _ in range(args.rounds):
+            for mode, app in apps.items():
+                results[mode].append(run(app, headers, args.requests))
+
+        phase_cost = disabled_phase_cost(apps['off'])
+
+    off, on = (statistics.median(results[mode]) for mode in ('off', 'on'))
+    print(f'requests:             {args.requests} x {args.rounds} rounds')
+    print(f'timing off:           {off * 1e6:10.1f} us CPU/request')
+    print(f'timing on:            {on * 1e6:10.1f} us CPU/request '
+          f'({(on - off) / off:+.1%})')
+    print(f'disabled auth phases: {phase_cost * AUTH_PHASES * 1e6:10.2f} us '
+          f'CPU/request ({phase_cost * AUTH_PHASES / off:.3%})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+'''
+Per-request CPU cost of requires_auth with and without the token cache
+
+    python -m benchmarks.bench_token_cache [--requests 2000]
+
+runs fully offline: the signing key and JWKS come from a
+LocalIdentityProvider and the JWKS is read from a temporary file.
+'''
+import argparse
+import os
+import tempfile
+import time
+
+os.environ.setdefault('AUTH0_DOMAIN', 'capstone.test')
+os.environ.setdefault('API_AUDIENCE', 'capstone-app')
+
+from flask import Flask
+
+from auth import auth
+from auth.jwks import JWKSKeyStore
+from auth.local_idp import LocalIdentityProvider
+from auth.token_cache import TokenCache
+
+
+def run(view, app, headers, requests):
+    start = time.process_time()
+    for _ in range(requests):
+        with app.test_request_context(headers=headers):
+            view()
+    return (time.process_time() - start) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    idp = LocalIdentityProvider(auth.AUTH0_DOMAIN, auth.API_AUDIENCE)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        auth.jwks_store = JWKSKeyStore(
+            idp.write_jwks(os.path.join(tmpdir, 'jwks.json')),
+            key_loader=auth.jwt_backend.load_key)
+        auth.jwks_store.refresh()
+
+        app = Flask(__name__)
+        headers = {'Authorization': 'Bearer ' + idp.mint(['get:actors'])}
+        view = auth.requires_auth('get:actors')(lambda payload: payload)
+
+        auth.token_cache = TokenCache(max_entries=0)
+        uncached = run(view, app, headers, args.requests)
+
+        auth.token_cache = TokenCache()
+        cached = run(view, app, headers, args.requests)
+
+    print(f'requests:           {args.requests}')
+    print(f'without cache:      {uncached * 1e6:10.1f} us CPU/request')
+    print(f'with cache:         {cached * 1e6:10.1f} us CPU/request')
+    print(f'saved per request:  {(uncached - cached) * 1e6:10.1f} us '
+          f'({uncached / cached:.1f}x)')
+    print(f'cache stats:        {auth.token_cache.stats()}')
+
+
+if __name__ == '__main__':
+    main()
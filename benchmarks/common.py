@@ -0,0 +1,98 @@
+'''
+Shared setup for the offline benchmarks
+
+the app is created against the given database URL and accepts tokens
+minted by a LocalIdentityProvider, its keys read from a JWKS file or from
+`jwks_url`, so neither Postgres nor Auth0 is required. Environment
+variables must be in place before `app` is imported, hence the imports
+inside the functions.
+'''
+import os
+from datetime import datetime, timedelta
+
+DOMAIN = 'capstone.test'
+AUDIENCE = 'capstone-app'
+
+
+def configure_environment(database_url):
+    os.environ['DATABASE_URL'] = database_url
+    os.environ.setdefault('AUTH0_DOMAIN', DOMAIN)
+    os.environ.setdefault('API_AUDIENCE', AUDIENCE)
+    os.environ.setdefault('EXCITED', 'true')
+
+
+def offline_app(database_url, tmpdir, idp=None, jwks_url=None):
+    configure_environment(database_url)
+
+    from app import create_app
+    from auth import auth
+    from auth.jwks import JWKSKeyStore
+    from auth.local_idp import ROLE_PERMISSIONS, LocalIdentityProvider
+    from database.models import setup_db
+
+    idp = idp or LocalIdentityProvider(auth.AUTH0_DOMAIN, auth.API_AUDIENCE)
+    auth.jwks_store = JWKSKeyStore(
+        jwks_url or idp.write_jwks(os.path.join(tmpdir, 'jwks.json')),
+        key_loader=auth.jwt_backend.load_key)
+
+    app = create_app()
+    setup_db(app, database_url)
+
+    headers = {
+        role: {'Authorization': 'Bearer ' + idp.mint_for_role(role)}
+        for role in ROLE_PERMISSIONS
+    }
+    return app, headers
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+'''
+seed_catalog(database_url, movies, actors, casts_per_movie)
+    creates the tables and fills them with a deterministic synthetic
+    catalog using batched executemany inserts
+'''
+
+
+def seed_catalog(database_url, movies, actors, casts_per_movie=0,
+                 chunk_size=10000):
+    configure_environment(database_url)
+
+    from sqlalchemy import create_engine
+    from database.models import Actor, Movie, Cast, db
+    from database.search import rebuild_search_index
+
+    engine = create_engine(database_url)
+    db.Model.metadata.create_all(engine)
+
+    start = datetime(2000, 1, 1, 12, 30, 15, 125000)
+    genders = ['female', 'male', 'n/a']
+    actor_rows = ({'name': f'Actor {i}',
+                   'age': 18 + i % 60,
+                   'gender': genders[i % 3]}
+                  for i in range(actors))
+    movie_rows = ({'title': f'Movie {i}',
+                   'release_date': start + timedelta(hours=i)}
+                  for i in range(movies))
+    cast_rows = ({'movie_id': movie_id,
+                  'actor_id': (movie_id * 7 + offset) % actors + 1}
+                 for movie_id in range(1, movies + 1)
+                 for offset in range(min(casts_per_movie, actors)))
+
+    with engine.begin() as connection:
+        for table, rows in ((Actor.__table__, actor_rows),
+                            (Movie.__table__, movie_rows),
+                            (Cast.__table__, cast_rows)):
+            for chunk in _chunks(rows, chunk_size):
+                connection.execute(table.insert(), chunk)
+        rebuild_search_index(connection)
+    engine.dispose()
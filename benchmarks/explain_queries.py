@@ -0,0 +1,133 @@
+'''
+Query plans of the API without and with its secondary indexes
+
+    python -m benchmarks.explain_queries [--database URL]
+        [--actors 20000] [--movies 5000] [--casts-per-movie 5]
+
+drives every route once, with and without filters and sorts, against a
+seeded catalog and records the SQL it issues, then prints the plan of
+each distinct statement with the indexes dropped and again with them
+created. Without --database a temporary
+SQLite file is used; a PostgreSQL URL must point to an empty database.
+'''
+import argparse
+import os
+import tempfile
+
+from sqlalchemy import create_engine, event
+
+from benchmarks.common import offline_app, seed_catalog
+
+INDEXES = ['ix_casts_actor_id_movie_id', 'ix_movies_release_date',
+           'ix_actors_lower_name']
+
+REQUESTS = [
+    ('GET', '/api/actors', 'casting_assistant', None),
+    ('GET', '/api/actors?expand=movies', 'casting_assistant', None),
+    ('GET', '/api/movies', 'casting_assistant', None),
+    ('GET', '/api/movies?expand=actors', 'casting_assistant', None),
+    ('GET', '/api/casts', 'casting_assistant', None),
+    ('GET', '/api/actors?name_prefix=actor%2012', 'casting_assistant', None),
+    ('GET', '/api/actors?sort=name&limit=20', 'casting_assistant', None),
+    ('GET', '/api/actors?gender=female&age_min=30&age_max=40',
+     'casting_assistant', None),
+    ('GET', '/api/movies?released_after=2000-03-01&released_before=2000-04-01',
+     'casting_assistant', None),
+    ('GET', '/api/movies?sort=-release_date&limit=20', 'casting_assistant',
+     None),
+    ('GET', '/api/casts?actor_id=7', 'casting_assistant', None),
+    ('PUT', '/api/actors/1/movies', 'casting_director', [1, 2, 3]),
+    ('PUT', '/api/movies/1/actors', 'casting_director', [1, 2, 3]),
+    ('DELETE', '/api/actors/2', 'casting_director', None),
+    ('DELETE', '/api/movies/2', 'executive_producer', None),
+]
+
+
+def record_statements(app, headers):
+    from database.models import db
+
+    statements = {}
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context,
+                              executemany):
+        if executemany or statement.lstrip().upper().startswith(
+                ('INSERT', 'PRAGMA', 'SAVEPOINT', 'RELEASE')):
+            return
+        if statement not in statements:
+            statements[statement] = parameters
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    client = app.test_client()
+    try:
+        for method, url, role, body in REQUESTS:
+            response = client.open(url, method=method, json=body,
+                                   headers=headers[role])
+            if response.status_code != 200:
+                raise RuntimeError(f'{method} {url}: {response.status}')
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+    return list(statements.items())
+
+
+def explain(connection, statement, parameters):
+    if connection.dialect.name == 'sqlite':
+        rows = connection.exec_driver_sql(
+            'EXPLAIN QUERY PLAN ' + statement, parameters)
+        return [row[-1] for row in rows]
+    rows = connection.exec_driver_sql('EXPLAIN ' + statement, parameters)
+    return [row[0] for row in rows]
+
+
+def print_plans(engine, statements, title):
+    print(f'==== {title} ====')
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        for statement, parameters in statements:
+            print()
+            print(' '.join(statement.split()))
+            for line in explain(connection, statement, parameters):
+                print('    ' + line)
+        transaction.rollback()
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--database')
+    parser.add_argument('--actors', type=int, default=20000)
+    parser.add_argument('--movies', type=int, default=5000)
+    parser.add_argument('--casts-per-movie', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        database_url = args.database or 'sqlite:///' + os.path.join(
+            tmpdir, 'explain.db')
+        seed_catalog(database_url, movies=args.movies, actors=args.actors,
+                     casts_per_movie=args.casts_per_movie)
+        app, headers = offline_app(database_url, tmpdir)
+        statements = record_statements(app, headers)
+
+        from database.models import db
+        indexes = {index.name: index
+                   for table in db.Model.metadata.tables.values()
+                   for index in table.indexes if index.name in INDEXES}
+
+        engine = create_engine(database_url)
+        for name in INDEXES:
+            indexes[name].drop(engine)
+        with engine.begin() as connection:
+            connection.exec_driver_sql('ANALYZE')
+        print_plans(engine, statements, 'without indexes')
+
+        for name in INDEXES:
+            indexes[name].create(engine)
+        with engine.begin() as connection:
+            connection.exec_driver_sql('ANALYZE')
+        print_plans(engine, statements, 'with indexes')
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -5,8 +5,6 @@
 -- Dumped from database version 13.14
 -- Dumped by pg_dump version 13.14
 
--- Started on 2024-03-07 13:49:23
-
 SET statement_timeout = 0;
 SET lock_timeout = 0;
 SET idle_in_transaction_session_timeout = 0;
@@ -18,12 +16,28 @@ SET xmloption = content;
 SET client_min_messages = warning;
 SET row_security = off;
 
+--
+-- Name: bump_table_version(); Type: FUNCTION; Schema: public; Owner: postgres
+--
+
+CREATE FUNCTION public.bump_table_version() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+    UPDATE table_versions SET version = version + 1
+    WHERE table_name = TG_TABLE_NAME;
+    RETURN NULL;
+END
+$$;
+
+
+ALTER FUNCTION public.bump_table_version() OWNER TO postgres;
+
 SET default_tablespace = '';
 
 SET default_table_access_method = heap;
 
 --
--- TOC entry 202 (class 1259 OID 39538)
 -- Name: actors; Type: TABLE; Schema: public; Owner: postgres
 --
 
@@ -38,7 +52,6 @@ CREATE TABLE public.actors (
 ALTER TABLE public.actors OWNER TO postgres;
 
 --
--- TOC entry 201 (class 1259 OID 39536)
 -- Name: actors_id_seq; Type: SEQUENCE; Schema: public; Owner: postgres
 --
 
@@ -54,8 +67,6 @@ CREATE SEQUENCE public.actors_id_seq
 ALTER TABLE public.actors_id_seq OWNER TO postgres;
 
 --
--- TOC entry 3025 (class 0 OID 0)
--- Dependencies: 201
 -- Name: actors_id_seq; Type: SEQUENCE OWNED BY; Schema: public; Owner: postgres
 --
 
@@ -63,7 +74,6 @@ ALTER SEQUENCE public.actors_id_seq OWNED BY public.actors.id;
 
 
 --
--- TOC entry 200 (class 1259 OID 39531)
 -- Name: alembic_version; Type: TABLE; Schema: public; Owner: postgres
 --
 
@@ -75,46 +85,31 @@ CREATE TABLE public.alembic_version (
 ALTER TABLE public.alembic_version OWNER TO postgres;
 
 --
--- TOC entry 206 (class 1259 OID 39560)
--- Name: casts; Type: TABLE; Schema: public; Owner: postgres
+-- Name: cast_legacy_ids; Type: TABLE; Schema: public; Owner: postgres
 --
 
-CREATE TABLE public.casts (
+CREATE TABLE public.cast_legacy_ids (
     id integer NOT NULL,
     movie_id integer NOT NULL,
     actor_id integer NOT NULL
 );
 
 
-ALTER TABLE public.casts OWNER TO postgres;
+ALTER TABLE public.cast_legacy_ids OWNER TO postgres;
 
 --
--- TOC entry 205 (class 1259 OID 39558)
--- Name: casts_id_seq; Type: SEQUENCE; Schema: public; Owner: postgres
+-- Name: casts; Type: TABLE; Schema: public; Owner: postgres
 --
 
-CREATE SEQUENCE public.casts_id_seq
-    AS integer
-    START WITH 1
-    INCREMENT BY 1
-    NO MINVALUE
-    NO MAXVALUE
-    CACHE 1;
-
-
-ALTER TABLE public.casts_id_seq OWNER TO postgres;
-
---
--- TOC entry 3026 (class 0 OID 0)
--- Dependencies: 205
--- Name: casts_id_seq; Type: SEQUENCE OWNED BY; Schema: public; Owner: postgres
---
+CREATE TABLE public.casts (
+    movie_id integer NOT NULL,
+    actor_id integer NOT NULL
+);
 
-ALTER SEQUENCE public.casts_id_seq OWNED BY public.casts.id;
 
+ALTER TABLE public.casts OWNER TO postgres;
 
 --
--- TOC entry 204 (class 1259 OID 39549)
 -- Name: movies; Type: TABLE; Schema: public; Owner: postgres
 --
 
@@ -128,7 +123,6 @@ CREATE TABLE public.movies (
 ALTER TABLE public.movies OWNER TO postgres;
 
 --
--- TOC entry 203 (class 1259 OID 39547)
 -- Name: movies_id_seq; Type: SEQUENCE; Schema: public; Owner: postgres
 --
 
@@ -144,8 +138,6 @@ CREATE SEQUENCE public.movies_id_seq
 ALTER TABLE public.movies_id_seq OWNER TO postgres;
 
 --
--- TOC entry 3027 (class 0 OID 0)
--- Dependencies: 203
 -- Name: movies_id_seq; Type: SEQUENCE OWNED BY; Schema: public; Owner: postgres
 --
 
@@ -153,23 +145,25 @@ ALTER SEQUENCE public.movies_id_seq OWNED BY public.movies.id;
 
 
 --
--- TOC entry 2868 (class 2604 OID 39541)
--- Name: actors id; Type: DEFAULT; Schema: public; Owner: postgres
+-- Name: table_versions; Type: TABLE; Schema: public; Owner: postgres
 --
 
-ALTER TABLE ONLY public.actors ALTER COLUMN id SET DEFAULT nextval('public.actors_id_seq'::regclass);
+CREATE TABLE public.table_versions (
+    table_name character varying NOT NULL,
+    version bigint NOT NULL
+);
+
 
+ALTER TABLE public.table_versions OWNER TO postgres;
 
 --
--- TOC entry 2870 (class 2604 OID 39563)
--- Name: casts id; Type: DEFAULT; Schema: public; Owner: postgres
+-- Name: actors id; Type: DEFAULT; Schema: public; Owner: postgres
 --
 
-ALTER TABLE ONLY public.casts ALTER COLUMN id SET DEFAULT nextval('public.casts_id_seq'::regclass);
+ALTER TABLE ONLY public.actors ALTER COLUMN id SET DEFAULT nextval('public.actors_id_seq'::regclass);
 
 
 --
--- TOC entry 2869 (class 2604 OID 39552)
 -- Name: movies id; Type: DEFAULT; Schema: public; Owner: postgres
 --
 
@@ -177,92 +171,72 @@ ALTER TABLE ONLY public.movies ALTER COLUMN id SET DEFAULT nextval('public.movie
 
 
 --
--- TOC entry 3015 (class 0 OID 39538)
--- Dependencies: 202
 -- Data for Name: actors; Type: TABLE DATA; Schema: public; Owner: postgres
 --
 
 COPY public.actors (id, name, age, gender) FROM stdin;
-1	Lee Gleichner	41	n/a
-2	Pat Gutmann	31	female
-3	Karla Christiansen	53	female
-4	Toby Christiansen II	43	male
-5	Freda Hirthe	45	n/a
 \.
 
 
 --
--- TOC entry 3013 (class 0 OID 39531)
--- Dependencies: 200
 -- Data for Name: alembic_version; Type: TABLE DATA; Schema: public; Owner: postgres
 --
 
 COPY public.alembic_version (version_num) FROM stdin;
-feb35a2178a9
+4b7a90e3f1c5
 \.
 
 
 --
--- TOC entry 3019 (class 0 OID 39560)
--- Dependencies: 206
--- Data for Name: casts; Type: TABLE DATA; Schema: public; Owner: postgres
+-- Data for Name: cast_legacy_ids; Type: TABLE DATA; Schema: public; Owner: postgres
 --
 
-COPY public.casts (id, movie_id, actor_id) FROM stdin;
-4	2	2
+COPY public.cast_legacy_ids (id, movie_id, actor_id) FROM stdin;
 \.
 
 
 --
--- TOC entry 3017 (class 0 OID 39549)
--- Dependencies: 204
--- Data for Name: movies; Type: TABLE DATA; Schema: public; Owner: postgres
+-- Data for Name: casts; Type: TABLE DATA; Schema: public; Owner: postgres
 --
 
-COPY public.movies (id, title, release_date) FROM stdin;
-1	Enim molestiae rerum et.	2024-03-26 07:16:58.125
-2	Sed error consequuntur.	2024-03-23 07:17:59.671
+COPY public.casts (movie_id, actor_id) FROM stdin;
 \.
 
 
 --
--- TOC entry 3028 (class 0 OID 0)
--- Dependencies: 201
--- Name: actors_id_seq; Type: SEQUENCE SET; Schema: public; Owner: postgres
+-- Data for Name: movies; Type: TABLE DATA; Schema: public; Owner: postgres
 --
 
-SELECT pg_catalog.setval('public.actors_id_seq', 6, true);
+COPY public.movies (id, title, release_date) FROM stdin;
+\.
 
 
 --
--- TOC entry 3029 (class 0 OID 0)
--- Dependencies: 205
--- Name: casts_id_seq; Type: SEQUENCE SET; Schema: public; Owner: postgres
+-- Data for Name: table_versions; Type: TABLE DATA; Schema: public; Owner: postgres
 --
 
-SELECT pg_catalog.setval('public.casts_id_seq', 4, true);
+COPY public.table_versions (table_name, version) FROM stdin;
+actors	1792360603268966
+movies	1792360603268966
+casts	1792360603268966
+\.
 
 
 --
--- TOC entry 3030 (class 0 OID 0)
--- Dependencies: 203
--- Name: movies_id_seq; Type: SEQUENCE SET; Schema: public; Owner: postgres
+-- Name: actors_id_seq; Type: SEQUENCE SET; Schema: public; Owner: postgres
 --
 
-SELECT pg_catalog.setval('public.movies_id_seq', 2, true);
+SELECT pg_catalog.setval('public.actors_id_seq', 6, true);
 
 
 --
--- TOC entry 2878 (class 2606 OID 39567)
--- Name: casts _movie_actor_uc; Type: CONSTRAINT; Schema: public; Owner: postgres
+-- Name: movies_id_seq; Type: SEQUENCE SET; Schema: public; Owner: postgres
 --
 
-ALTER TABLE ONLY public.casts
-    ADD CONSTRAINT _movie_actor_uc UNIQUE (movie_id, actor_id);
+SELECT pg_catalog.setval('public.movies_id_seq', 2, true);
 
 
 --
--- TOC entry 2874 (class 2606 OID 39546)
 -- Name: actors actors_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
 --
 
@@ -271,7 +245,6 @@ ALTER TABLE ONLY public.actors
 
 
 --
--- TOC entry 2872 (class 2606 OID 39535)
 -- Name: alembic_version alembic_version_pkc; Type: CONSTRAINT; Schema: public; Owner: postgres
 --
 
@@ -280,16 +253,22 @@ ALTER TABLE ONLY public.alembic_version
 
 
 --
--- TOC entry 2880 (class 2606 OID 39565)
+-- Name: cast_legacy_ids cast_legacy_ids_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.cast_legacy_ids
+    ADD CONSTRAINT cast_legacy_ids_pkey PRIMARY KEY (id);
+
+
+--
 -- Name: casts casts_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
 --
 
 ALTER TABLE ONLY public.casts
-    ADD CONSTRAINT casts_pkey PRIMARY KEY (id);
+    ADD CONSTRAINT casts_pkey PRIMARY KEY (movie_id, actor_id);
 
 
 --
--- TOC entry 2876 (class 2606 OID 39557)
 -- Name: movies movies_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
 --
 
@@ -298,7 +277,77 @@ ALTER TABLE ONLY public.movies
 
 
 --
--- TOC entry 2881 (class 2606 OID 39568)
+-- Name: table_versions table_versions_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.table_versions
+    ADD CONSTRAINT table_versions_pkey PRIMARY KEY (table_name);
+
+
+--
+-- Name: ix_actors_lower_name; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX ix_actors_lower_name ON public.actors USING btree (lower((name)::text));
+
+
+--
+-- Name: ix_actors_lower_name_pattern; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX ix_actors_lower_name_pattern ON public.actors USING btree (lower((name)::text) text_pattern_ops);
+
+
+--
+-- Name: ix_actors_name_search; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX ix_actors_name_search ON public.actors USING gin (to_tsvector('simple'::regconfig, (COALESCE(name, ''::character varying))::text));
+
+
+--
+-- Name: ix_casts_actor_id_movie_id; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX ix_casts_actor_id_movie_id ON public.casts USING btree (actor_id, movie_id);
+
+
+--
+-- Name: ix_movies_release_date; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX ix_movies_release_date ON public.movies USING btree (release_date);
+
+
+--
+-- Name: ix_movies_title_search; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX ix_movies_title_search ON public.movies USING gin (to_tsvector('simple'::regconfig, (COALESCE(title, ''::character varying))::text));
+
+
+--
+-- Name: actors actors_version; Type: TRIGGER; Schema: public; Owner: postgres
+--
+
+CREATE TRIGGER actors_version AFTER INSERT OR DELETE OR UPDATE OR TRUNCATE ON public.actors FOR EACH STATEMENT EXECUTE FUNCTION public.bump_table_version();
+
+
+--
+-- Name: casts casts_version; Type: TRIGGER; Schema: public; Owner: postgres
+--
+
+CREATE TRIGGER casts_version AFTER INSERT OR DELETE OR UPDATE OR TRUNCATE ON public.casts FOR EACH STATEMENT EXECUTE FUNCTION public.bump_table_version();
+
+
+--
+-- Name: movies movies_version; Type: TRIGGER; Schema: public; Owner: postgres
+--
+
+CREATE TRIGGER movies_version AFTER INSERT OR DELETE OR UPDATE OR TRUNCATE ON public.movies FOR EACH STATEMENT EXECUTE FUNCTION public.bump_table_version();
+
+
+--
 -- Name: casts casts_actor_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: postgres
 --
 
@@ -307,16 +356,12 @@ ALTER TABLE ONLY public.casts
 
 
 --
--- TOC entry 2882 (class 2606 OID 39573)
 -- Name: casts casts_movie_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: postgres
 --
 
 ALTER TABLE ONLY public.casts
     ADD CONSTRAINT casts_movie_id_fkey FOREIGN KEY (movie_id) REFERENCES public.movies(id);
 
-
--- Completed on 2024-03-07 13:49:24
-
 --
 -- PostgreSQL database dump complete
 --
@@ -0,0 +1,214 @@
+import os
+from datetime import timezone
+
+from dateutil import parser as date_parser
+from sqlalchemy import Integer, exists, literal, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from database.models import db, Cast
+from database.search import SEARCHED_COLUMNS, index_documents
+
+'''
+Bulk inserts
+    POST /api/actors/bulk and POST /api/movies/bulk validate every item
+    before touching the database, then insert the valid rows in a single
+    transaction with batched executemany statements.
+'''
+
+BULK_MAX_ITEMS = int(os.environ.get('BULK_MAX_ITEMS', 1000))
+BULK_BATCH_SIZE = int(os.environ.get('BULK_BATCH_SIZE', 500))
+
+
+def _is_text(value):
+    return isinstance(value, str) and value.strip() != ''
+
+
+'''
+validate_actor(item), validate_movie(item)
+    return the column values for one item of a bulk request and a dict of
+    field errors, empty when the item is valid
+'''
+
+
+def validate_actor(item):
+    if not isinstance(item, dict):
+        return None, {'item': 'Expected an object'}
+
+    errors = {}
+    if not _is_text(item.get('name')):
+        errors['name'] = 'Expected a non-empty string'
+    age = item.get('age')
+    if type(age) is not int or age < 0:
+        errors['age'] = 'Expected a non-negative integer'
+    if not _is_text(item.get('gender')):
+        errors['gender'] = 'Expected a non-empty string'
+    if errors:
+        return None, errors
+
+    return {
+        'name': item['name'],
+        'age': age,
+        'gender': item['gender']
+    }, errors
+
+
+def validate_movie(item):
+    if not isinstance(item, dict):
+        return None, {'item': 'Expected an object'}
+
+    errors = {}
+    if not _is_text(item.get('title')):
+        errors['title'] = 'Expected a non-empty string'
+    release_date = item.get('release_date')
+    try:
+        release_date = date_parser.isoparse(release_date)
+    except (AttributeError, TypeError, ValueError):
+        errors['release_date'] = 'Expected an ISO 8601 date'
+    if errors:
+        return None, errors
+
+    # the column has no time zone, values are stored as UTC
+    if release_date.tzinfo is not None:
+        release_date = release_date.astimezone(
+            timezone.utc).replace(tzinfo=None)
+
+    return {
+        'title': item['title'],
+        'release_date': release_date
+    }, errors
+
+
+'''
+validate_items(items, validate)
+    validates a whole bulk request
+    returns the rows of the valid items, their positions in `items` and
+    the per-item errors as [{'index': i, 'errors': {...}}]
+'''
+
+
+def validate_items(items, validate):
+    rows, indexes, errors = [], [], []
+    for index, item in enumerate(items):
+        row, item_errors = validate(item)
+        if item_errors:
+            errors.append({'index': index, 'errors': item_errors})
+        else:
+            rows.append(row)
+            indexes.append(index)
+    return rows, indexes, errors
+
+
+'''
+bulk_insert(model, rows)
+    inserts `rows` into the table of `model` in the current transaction
+    and returns the new ids in the same order, adding searched rows to
+    the search index
+
+    dialects able to return rows from an executemany (psycopg2) insert
+    BULK_BATCH_SIZE rows per statement; others, such as SQLite, fall back
+    to one statement per row, still inside the same transaction
+'''
+
+
+def bulk_insert(model, rows):
+    table = model.__table__
+    dialect = db.session.connection().dialect
+    ids = []
+
+    if dialect.insert_executemany_returning:
+        statement = table.insert().returning(table.c.id)
+        for start in range(0, len(rows), BULK_BATCH_SIZE):
+            result = db.session.execute(
+                statement, rows[start:start + BULK_BATCH_SIZE])
+            ids.extend(row[0] for row in result)
+    else:
+        statement = table.insert()
+        for row in rows:
+            result = db.session.execute(statement, row)
+            ids.append(result.inserted_primary_key[0])
+
+    column = SEARCHED_COLUMNS.get(table.name)
+    if column is not None:
+        index_documents(db.session, table.name,
+                        [(id, row[column]) for id, row in zip(ids, rows)])
+    return ids
+
+
+'''
+Cast assignment
+    PUT/POST /api/movies/<id>/actors and /api/actors/<id>/movies set or
+    extend the cast of one movie (or the filmography of one actor) with
+    set-based statements:
+
+        INSERT INTO casts (movie_id, actor_id)
+        SELECT :movie_id, actors.id FROM actors WHERE actors.id IN (...)
+        ON CONFLICT (movie_id, actor_id) DO NOTHING
+
+    and, when replacing, one DELETE of the pairs that are not in the list
+'''
+
+
+def _insert_ignoring_duplicates(owner_key, owner_id, member_key,
+                                member_table, member_ids):
+    table = Cast.__table__
+    dialect = db.session.connection().dialect
+    rows = select(literal(owner_id, Integer), member_table.c.id).where(
+        member_table.c.id.in_(member_ids))
+
+    if dialect.name == 'postgresql':
+        insert = postgresql.insert
+    elif dialect.name == 'sqlite':
+        insert = sqlite.insert
+    else:
+        existing = exists().where(table.c[owner_key] == owner_id).where(
+            table.c[member_key] == member_table.c.id)
+        return table.insert().from_select([owner_key, member_key],
+                                          rows.where(~existing))
+
+    return insert(table).from_select(
+        [owner_key, member_key], rows).on_conflict_do_nothing(
+        index_elements=['movie_id', 'actor_id'])
+
+
+'''
+missing_ids(table, ids)
+    the ids of `ids` that have no row in `table`
+'''
+
+
+def missing_ids(table, ids):
+    if not ids:
+        return []
+    found = db.session.execute(
+        select(table.c.id).where(table.c.id.in_(ids))).scalars().all()
+    return sorted(set(ids) - set(found))
+
+
+'''
+assign_casts(owner_key, owner_id, member_table, member_ids, replace)
+    links the movie (owner_key 'movie_id') or actor (owner_key
+    'actor_id') `owner_id` to every row of `member_table` in `member_ids`
+    returns the number of casts added and removed
+'''
+
+
+def assign_casts(owner_key, owner_id, member_table, member_ids,
+                 replace=False):
+    table = Cast.__table__
+    member_key = 'actor_id' if owner_key == 'movie_id' else 'movie_id'
+    removed = 0
+
+    if replace:
+        statement = table.delete().where(table.c[owner_key] == owner_id)
+        if member_ids:
+            statement = statement.where(
+                table.c[member_key].not_in(member_ids))
+        removed = db.session.execute(statement).rowcount
+
+    added = 0
+    if member_ids:
+        added = db.session.execute(_insert_ignoring_duplicates(
+            owner_key, owner_id, member_key, member_table,
+            member_ids)).rowcount
+
+    return added, removed
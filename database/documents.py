@@ -0,0 +1,137 @@
+import json
+import os
+import re
+
+from sqlalchemy import bindparam, text
+
+'''
+Expanded listings assembled by the database
+    GET /api/actors?expand=movies and GET /api/movies?expand=actors can
+    have the database build the long() document of every row of the page,
+    nested list included, which the app then joins into the response body
+    without loading the rows into the ORM:
+
+        PostgreSQL: json_build_object and json_agg
+        SQLite: json_object and json_group_array from JSON1
+
+    the documents hold the same keys, values and nested order as long()
+    and are laid out as jsonify lays them out, byte for byte.
+    EXPANDED_LISTING_JSON=python keeps the long() serializers.
+'''
+
+EXPANDED_LISTING_JSON = os.environ.get('EXPANDED_LISTING_JSON', 'database')
+
+# the characters jsonify escapes as \uXXXX beyond those SQLite does
+NON_ASCII = re.compile('[^\x00-\x7e]')
+
+# short() of a movie, `m` being the movies row
+RELEASE_DATE = {
+    'postgresql':
+        "to_char(m.release_date, 'YYYY-MM-DD\"T\"HH24:MI:SS.US\"Z\"')",
+    # stored by SQLAlchemy as 'YYYY-MM-DD HH:MM:SS.ffffff'
+    'sqlite': "replace(m.release_date, ' ', 'T') || 'Z'"
+}
+
+# (object, array aggregate over rows ordered by the subquery) per dialect
+JSON_FUNCTIONS = {
+    'postgresql': ('json_build_object', 'json_agg'),
+    'sqlite': ('json_object', 'json_group_array')
+}
+
+# table, alias, owner key, nested table, alias, nested key, keys of the
+# owner and of the nested short() documents, in the order jsonify sorts
+# them
+DOCUMENTS = {
+    'actors': ('actors', 'a', 'actor_id', 'movies', 'm', 'movie_id',
+               ('age', 'gender', 'id', 'movies', 'name'),
+               ('id', 'release_date', 'title')),
+    'movies': ('movies', 'm', 'movie_id', 'actors', 'a', 'actor_id',
+               ('actors', 'id', 'release_date', 'title'),
+               ('age', 'gender', 'id', 'name'))
+}
+
+
+def _fields(dialect_name, alias, keys, nested=None):
+    fields = []
+    for key in keys:
+        if key == 'release_date':
+            value = RELEASE_DATE[dialect_name]
+        elif key == nested:
+            value = None
+        else:
+            value = f'{alias}.{key}'
+        fields.append((key, value))
+    return fields
+
+
+def _object(dialect_name, fields):
+    build_object = JSON_FUNCTIONS[dialect_name][0]
+    return f'{build_object}(' + ', '.join(
+        f"'{key}', {value}" for key, value in fields) + ')'
+
+
+def documents_sql(name, dialect_name):
+    (table, alias, owner_key, nested_table, nested_alias, nested_key,
+     keys, nested_keys) = DOCUMENTS[name]
+    aggregate = JSON_FUNCTIONS[dialect_name][1]
+
+    nested_object = _object(dialect_name, _fields(
+        dialect_name, nested_alias, nested_keys))
+    if dialect_name == 'postgresql':
+        nested = (f"coalesce((SELECT json_agg({nested_object} "
+                  f"ORDER BY {nested_alias}.id) "
+                  f"FROM casts JOIN {nested_table} {nested_alias} "
+                  f"ON {nested_alias}.id = casts.{nested_key} "
+                  f"WHERE casts.{owner_key} = {alias}.id), '[]'::json)")
+    else:
+        nested = (f"json((SELECT {aggregate}(json(document)) FROM ("
+                  f"SELECT {nested_object} AS document "
+                  f"FROM casts JOIN {nested_table} {nested_alias} "
+                  f"ON {nested_alias}.id = casts.{nested_key} "
+                  f"WHERE casts.{owner_key} = {alias}.id "
+                  f"ORDER BY {nested_alias}.id)))")
+
+    fields = [(key, nested if value is None else value) for key, value in
+              _fields(dialect_name, alias, keys, nested=nested_table)]
+    document = _object(dialect_name, fields)
+    if dialect_name == 'postgresql':
+        document = f'CAST({document} AS text)'
+    return (f'SELECT {alias}.id, {document} FROM {table} {alias} '
+            f'WHERE {alias}.id IN :ids')
+
+
+def _escape(match):
+    return json.dumps(match.group())[1:-1]
+
+
+'''
+jsonify_layout(documents, dialect_name)
+    `documents` as built by the database, written as jsonify writes them:
+    SQLite leaves no whitespace and only the non-ASCII characters need
+    escaping; PostgreSQL spaces out ':' and ',', which is quicker to drop by
+    re-encoding the documents than with a regex outside the strings
+'''
+
+
+def jsonify_layout(documents, dialect_name):
+    if dialect_name == 'postgresql':
+        return json.dumps(json.loads(documents), separators=(',', ':'))
+    return NON_ASCII.sub(_escape, documents)
+
+
+'''
+listing_documents(session, name, ids)
+    the long() documents of the `name` ('actors' or 'movies') rows with
+    the given ids, as a JSON array in the order of `ids`
+'''
+
+
+def listing_documents(session, name, ids):
+    if not ids:
+        return '[]'
+    dialect_name = session.connection().dialect.name
+    statement = text(documents_sql(name, dialect_name)).bindparams(
+        bindparam('ids', expanding=True))
+    documents = dict(session.execute(statement, {'ids': ids}).fetchall())
+    return jsonify_layout('[' + ','.join(documents[id] for id in ids) + ']',
+                          dialect_name)
@@ -0,0 +1,168 @@
+import threading
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from settings import flag, read_settings
+
+'''
+Engine and pool settings
+    read by setup_db from the app config, falling back to the environment
+    and then to the defaults below:
+
+        DB_POOL_SIZE          connections kept open per process
+        DB_MAX_OVERFLOW       connections opened beyond DB_POOL_SIZE
+                              under load, closed when checked back in
+        DB_POOL_TIMEOUT       seconds a checkout waits for a connection
+        DB_POOL_RECYCLE       seconds after which a connection is
+                              replaced, -1 to keep connections forever
+        DB_POOL_PRE_PING      test connections on checkout, so requests
+                              survive a database restart
+        DB_STATEMENT_TIMEOUT  milliseconds a statement may run, 0 for no
+                              limit; PostgreSQL only, set on connect
+
+    SQLite keeps the pool SQLAlchemy picks for it (one connection per
+    thread in memory, none kept for files), so the size settings only
+    apply to other databases.
+
+    URLs naming an asyncio driver (postgresql+asyncpg, sqlite+aiosqlite)
+    are served by the ASGI app, see web/asgi.py.
+'''
+
+ENGINE_SETTINGS = {
+    'DB_POOL_SIZE': (int, 5),
+    'DB_MAX_OVERFLOW': (int, 10),
+    'DB_POOL_TIMEOUT': (float, 30),
+    'DB_POOL_RECYCLE': (int, 1800),
+    'DB_POOL_PRE_PING': (flag, True),
+    'DB_STATEMENT_TIMEOUT': (int, 0)
+}
+
+
+'''
+PoolMetrics
+    checkout counters of a MeteredQueuePool; wait times include opening
+    a new connection when the pool has none idle
+'''
+
+
+class PoolMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def observe(self, wait_seconds, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_seconds_total += wait_seconds
+            self.wait_seconds_max = max(self.wait_seconds_max,
+                                        wait_seconds)
+
+
+class MeteredQueuePool(QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.metrics.observe(time.perf_counter() - start, timed_out=True)
+            raise
+        self.metrics.observe(time.perf_counter() - start)
+        return connection
+
+
+class MeteredAsyncAdaptedQueuePool(MeteredQueuePool, AsyncAdaptedQueuePool):
+    pass
+
+
+'''
+engine_options(database_path, config)
+    the SQLALCHEMY_ENGINE_OPTIONS for `database_path` and the settings in
+    `config`
+'''
+
+
+def engine_options(database_path, config):
+    settings = read_settings(config, ENGINE_SETTINGS)
+    options = {
+        'pool_pre_ping': settings['DB_POOL_PRE_PING'],
+        'pool_recycle': settings['DB_POOL_RECYCLE']
+    }
+
+    url = make_url(database_path)
+    if url.get_backend_name() == 'sqlite':
+        return options
+
+    is_async = url.get_dialect().is_async
+    options.update({
+        'poolclass': (MeteredAsyncAdaptedQueuePool if is_async
+                      else MeteredQueuePool),
+        'pool_size': settings['DB_POOL_SIZE'],
+        'max_overflow': settings['DB_MAX_OVERFLOW'],
+        'pool_timeout': settings['DB_POOL_TIMEOUT']
+    })
+    if (url.get_backend_name() == 'postgresql' and
+            settings['DB_STATEMENT_TIMEOUT'] > 0):
+        if url.get_driver_name() == 'asyncpg':
+            options['connect_args'] = {'server_settings': {
+                'statement_timeout': str(settings['DB_STATEMENT_TIMEOUT'])}}
+        else:
+            options['connect_args'] = {
+                'options': '-c statement_timeout=%d' %
+                settings['DB_STATEMENT_TIMEOUT']}
+    return options
+
+
+'''
+build_engine(database_path, **options)
+    a synchronous Engine for `database_path`; with an asyncio driver it is
+    the synchronous facade of an AsyncEngine, whose statements only run
+    inside greenlet_spawn, as the requests of the ASGI app do
+'''
+
+
+def build_engine(database_path, **options):
+    if make_url(database_path).get_dialect().is_async:
+        return create_async_engine(database_path, **options).sync_engine
+    return create_engine(database_path, **options)
+
+
+'''
+pool_stats(engine)
+    the state of the connection pool of `engine`, for monitoring
+'''
+
+
+def pool_stats(engine):
+    pool = engine.pool
+    stats = {'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': max(pool.overflow(), 0)
+        })
+    metrics = getattr(pool, 'metrics', None)
+    if metrics is not None:
+        stats.update({
+            'checkouts': metrics.checkouts,
+            'timeouts': metrics.timeouts,
+            'wait_seconds_total': metrics.wait_seconds_total,
+            'wait_seconds_max': metrics.wait_seconds_max
+        })
+    return stats
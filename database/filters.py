@@ -0,0 +1,231 @@
+import os
+from datetime import datetime, timezone
+
+from dateutil import parser as date_parser
+from sqlalchemy import func
+
+from database.models import db, Actor, Movie, Cast
+from database.pagination import (check_keyset_cursor, get_page_args,
+                                 keyset_page, keyset_query,
+                                 load_sorted_cursor, sorted_page,
+                                 sorted_query)
+
+'''
+Filtering and sorting
+    the collection routes take filters and a `sort` key from a fixed set.
+    Every argument is parsed before any query runs, and each one compiles
+    into a WHERE or ORDER BY clause:
+
+        /api/actors  gender, age_min, age_max, name_prefix, ids
+                     sort: id, name
+        /api/movies  released_after, released_before, ids
+                     sort: id, release_date
+        /api/casts   movie_id, actor_id
+                     sort: movie_id, actor_id
+
+    a leading '-' sorts in descending order, e.g. sort=-release_date
+
+    every sort and every filter runs on an indexed expression except gender,
+    age_min and age_max, which are checked on the rows the sort walks, so
+    a page filtered on them alone may scan the whole actors table
+'''
+
+MAX_FILTER_IDS = int(os.environ.get('MAX_FILTER_IDS', 1000))
+
+# arguments read by the routes themselves
+LISTING_ARGS = {'limit', 'cursor', 'format', 'expand'}
+
+
+class FilterError(ValueError):
+    pass
+
+
+def parse_count(name, value):
+    try:
+        count = int(value)
+    except ValueError:
+        raise FilterError(f'Invalid {name} {value!r}')
+    if count < 0:
+        raise FilterError(f'Invalid {name} {value!r}')
+    return count
+
+
+def parse_text(name, value):
+    if value.strip() == '':
+        raise FilterError(f'Invalid {name} {value!r}')
+    return value
+
+
+def parse_ids(name, value):
+    ids = [parse_count(name, id) for id in value.split(',')]
+    if len(ids) > MAX_FILTER_IDS:
+        raise FilterError(f'Too many {name}, at most {MAX_FILTER_IDS}')
+    return ids
+
+
+def parse_date(name, value):
+    try:
+        date = date_parser.isoparse(value)
+    except ValueError:
+        raise FilterError(f'Invalid {name} {value!r}')
+    # release dates are stored as naive UTC
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return date
+
+
+'''
+name_prefix_clause(column, prefix)
+    case insensitive prefix match on `column`
+    PostgreSQL matches with LIKE on the text_pattern_ops index of
+    lower(name); SQLite compares byte-wise, so the prefix becomes a range
+    of the lower(name) index
+'''
+
+
+def name_prefix_clause(column, prefix):
+    if db.engine.dialect.name == 'postgresql':
+        pattern = prefix.lower()
+        for special in ('\\', '%', '_'):
+            pattern = pattern.replace(special, '\\' + special)
+        return func.lower(column).like(pattern + '%', escape='\\')
+
+    lower = func.lower(prefix)
+    return func.lower(column).between(lower, lower.concat(chr(0x10ffff)))
+
+
+'''
+KeySort(key_columns), ValueSort(expression, id_column, load)
+    orderings for the `sort` argument: on the key of the table, or on a
+    value with the key breaking ties
+'''
+
+
+class KeySort:
+
+    def __init__(self, key_columns):
+        self.key_columns = key_columns
+
+    def query(self, query, cursor=None, descending=False):
+        return keyset_query(query, self.key_columns, cursor, descending)
+
+    def page(self, query, limit, cursor=None, descending=False):
+        return keyset_page(query, self.key_columns, limit, cursor,
+                           descending)
+
+    def check_cursor(self, cursor):
+        check_keyset_cursor(cursor, self.key_columns)
+
+
+class ValueSort:
+
+    def __init__(self, expression, id_column, load=str):
+        self.expression = expression
+        self.id_column = id_column
+        self.load = load
+
+    def query(self, query, cursor=None, descending=False):
+        return sorted_query(query, self.expression, self.id_column, cursor,
+                            descending, self.load)
+
+    def page(self, query, limit, cursor=None, descending=False):
+        return sorted_page(query, self.expression, self.id_column, limit,
+                           cursor, descending, self.load)
+
+    def check_cursor(self, cursor):
+        load_sorted_cursor(cursor, self.load)
+
+
+def _text(value):
+    if not isinstance(value, str):
+        raise ValueError(f'Expected a string, got {value!r}')
+    return value
+
+
+ACTOR_FILTERS = {
+    'gender': (parse_text, lambda value: Actor.gender == value),
+    'age_min': (parse_count, lambda value: Actor.age >= value),
+    'age_max': (parse_count, lambda value: Actor.age <= value),
+    'name_prefix': (parse_text,
+                    lambda value: name_prefix_clause(Actor.name, value)),
+    'ids': (parse_ids, lambda value: Actor.id.in_(value))
+}
+
+ACTOR_SORTS = {
+    'id': KeySort(Actor.id),
+    'name': ValueSort(func.lower(Actor.name), Actor.id, load=_text)
+}
+
+MOVIE_FILTERS = {
+    'released_after': (parse_date,
+                       lambda value: Movie.release_date >= value),
+    'released_before': (parse_date,
+                        lambda value: Movie.release_date < value),
+    'ids': (parse_ids, lambda value: Movie.id.in_(value))
+}
+
+MOVIE_SORTS = {
+    'id': KeySort(Movie.id),
+    'release_date': ValueSort(Movie.release_date, Movie.id,
+                              load=datetime.fromisoformat)
+}
+
+CAST_FILTERS = {
+    'movie_id': (parse_count, lambda value: Cast.movie_id == value),
+    'actor_id': (parse_count, lambda value: Cast.actor_id == value)
+}
+
+CAST_SORTS = {
+    'movie_id': KeySort((Cast.movie_id, Cast.actor_id)),
+    'actor_id': KeySort((Cast.actor_id, Cast.movie_id))
+}
+
+
+'''
+parse_listing_args(args, filters, sorts, default_sort)
+    reads the filters and `sort` of a collection request
+    returns the WHERE criteria, the sort and whether it is descending
+    raises FilterError for unknown arguments and invalid values
+'''
+
+
+def parse_listing_args(args, filters, sorts, default_sort):
+    criteria = []
+    for name in args:
+        if name in LISTING_ARGS or name == 'sort':
+            continue
+        if name not in filters:
+            raise FilterError(f'Unknown argument {name!r}')
+        parse, clause = filters[name]
+        criteria.append(clause(parse(name, args[name])))
+
+    sort = args.get('sort', default_sort)
+    descending = sort.startswith('-')
+    if descending:
+        sort = sort[1:]
+    if sort not in sorts:
+        raise FilterError(f'Cannot sort on {sort!r}')
+
+    return criteria, sorts[sort], descending
+
+
+'''
+listing_args_check(filters, sorts, default_sort, model)
+    a function of the request arguments raising ValueError, without
+    running any query, for every argument the collection route answers
+    400 to: limit, cursor, filters, sort and, when `model` is given,
+    expand
+'''
+
+
+def listing_args_check(filters, sorts, default_sort, model=None):
+    def check(args):
+        limit, cursor = get_page_args(args)
+        criteria, sort, descending = parse_listing_args(
+            args, filters, sorts, default_sort)
+        if cursor is not None:
+            sort.check_cursor(cursor)
+        if model is not None:
+            model.query_for_listing(args.get('expand'))
+
+    return check
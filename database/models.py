@@ -1,26 +1,40 @@
 import os
-from sqlalchemy import Column, String, Integer, DateTime, create_engine, ForeignKey, UniqueConstraint
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import (Column, String, Integer, BigInteger, DateTime,
+                        create_engine, ForeignKey, UniqueConstraint, Index,
+                        DDL, and_, event, func, type_coerce)
+from sqlalchemy.orm import joinedload, selectinload
 import json
 from flask_migrate import Migrate
 
+from database.engine import engine_options
+from database.replicas import RoutingSQLAlchemy, install_replicas
+from database.search import (index_documents, install_search_index,
+                             remove_documents)
+from database.versions import install_version_table, install_version_trigger
+
 database_path = os.environ['DATABASE_URL']
 if database_path.startswith("postgres://"):
     database_path = database_path.replace("postgres://", "postgresql://", 1)
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 
 '''
 setup_db(app)
     binds a flask application and a SQLAlchemy service
+    engine and pool settings come from the app config or the environment,
+    see database/engine.py, and so do the read replicas, see
+    database/replicas.py
 '''
 
 
 def setup_db(app, database_path=database_path):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_path,
+                                                             app.config)
     db.app = app
     db.init_app(app)
+    install_replicas(app)
     migrate = Migrate(app, db)
 
 
@@ -36,9 +50,11 @@ class Actor(db.Model):
     name = Column(String)
     age = Column(Integer)
     gender = Column(String)
+    __table_args__ = (Index('ix_actors_lower_name', func.lower(name)),)
 
-    casts = db.relationship('Cast', backref='actor', lazy='joined', cascade="all, delete")
-    movies = db.relationship('Movie', secondary='casts', back_populates='actors')
+    casts = db.relationship('Cast', backref='actor', cascade="all, delete")
+    movies = db.relationship('Movie', secondary='casts',
+                             back_populates='actors', order_by='Movie.id')
 
     def __init__(self, name, age, gender):
         self.name = name
@@ -47,15 +63,54 @@ class Actor(db.Model):
 
     def insert(self):
         db.session.add(self)
+        db.session.flush()
+        index_documents(db.session, 'actors', [(self.id, self.name)])
         db.session.commit()
 
     def update(self):
+        index_documents(db.session, 'actors', [(self.id, self.name)])
         db.session.commit()
 
     def delete(self):
+        remove_documents(db.session, 'actors', [self.id])
         db.session.delete(self)
         db.session.commit()
 
+    '''
+    query_for_listing(expand)
+        actors with nothing eagerly loaded, for short(), or with
+        expand='movies' their movies loaded by one extra SELECT ... IN
+        per page, for long()
+    '''
+
+    @classmethod
+    def query_for_listing(cls, expand=None):
+        if expand is None:
+            return cls.query
+        if expand == 'movies':
+            return cls.query.options(selectinload(cls.movies))
+        raise ValueError(f'Cannot expand actors with {expand!r}')
+
+    '''
+    query_for_short(), short_row(row)
+        the columns read by short(), selected as plain rows without
+        building ORM instances, and the dictionary short() returns built
+        from one of those rows
+    '''
+
+    @classmethod
+    def query_for_short(cls):
+        return db.session.query(cls.id, cls.name, cls.age, cls.gender)
+
+    @staticmethod
+    def short_row(row):
+        return {
+            'id': row[0],
+            'name': row[1],
+            'age': row[2],
+            'gender': row[3]
+        }
+
     def short(self):
         return {
             'id': self.id,
@@ -74,6 +129,17 @@ class Actor(db.Model):
         }
 
 
+install_search_index(Actor.__table__)
+install_version_trigger(Actor.__table__)
+
+# LIKE 'prefix%' can only use an index built with text_pattern_ops
+# unless the database collation is C
+event.listen(Actor.__table__, 'after_create', DDL(
+    'CREATE INDEX ix_actors_lower_name_pattern '
+    'ON actors (lower(name) text_pattern_ops)').execute_if(
+    dialect='postgresql'))
+
+
 '''
 Movie
 '''
@@ -84,10 +150,11 @@ class Movie(db.Model):
 
     id = Column(Integer, primary_key=True)
     title = Column(String)
-    release_date = Column(DateTime)
+    release_date = Column(DateTime, index=True)
 
-    casts = db.relationship('Cast', backref='movie', lazy='joined', cascade="all, delete")
-    actors = db.relationship('Actor', secondary='casts', back_populates='movies')
+    casts = db.relationship('Cast', backref='movie', cascade="all, delete")
+    actors = db.relationship('Actor', secondary='casts',
+                             back_populates='movies', order_by='Actor.id')
 
     def __init__(self, title, release_date):
         self.title = title
@@ -95,15 +162,59 @@ class Movie(db.Model):
 
     def insert(self):
         db.session.add(self)
+        db.session.flush()
+        index_documents(db.session, 'movies', [(self.id, self.title)])
         db.session.commit()
 
     def update(self):
+        index_documents(db.session, 'movies', [(self.id, self.title)])
         db.session.commit()
 
     def delete(self):
+        remove_documents(db.session, 'movies', [self.id])
         db.session.delete(self)
         db.session.commit()
 
+    '''
+    query_for_listing(expand)
+        movies with nothing eagerly loaded, for short(), or with
+        expand='actors' their actors loaded by one extra SELECT ... IN
+        per page, for long()
+    '''
+
+    @classmethod
+    def query_for_listing(cls, expand=None):
+        if expand is None:
+            return cls.query
+        if expand == 'actors':
+            return cls.query.options(selectinload(cls.actors))
+        raise ValueError(f'Cannot expand movies with {expand!r}')
+
+    '''
+    query_for_short(), short_row(row)
+        as for actors; the database formats release_date the way short()
+        does, so no datetime is built or formatted in Python
+    '''
+
+    @classmethod
+    def query_for_short(cls):
+        if db.engine.dialect.name == 'postgresql':
+            release_date = func.to_char(
+                cls.release_date, 'YYYY-MM-DD"T"HH24:MI:SS.US"Z"')
+        else:
+            # stored by SQLAlchemy as 'YYYY-MM-DD HH:MM:SS.ffffff'
+            release_date = func.replace(
+                type_coerce(cls.release_date, String), ' ', 'T').concat('Z')
+        return db.session.query(cls.id, cls.title, release_date)
+
+    @staticmethod
+    def short_row(row):
+        return {
+            'id': row[0],
+            'title': row[1],
+            'release_date': row[2]
+        }
+
     def short(self):
         return {
             'id': self.id,
@@ -120,18 +231,26 @@ class Movie(db.Model):
         }
 
 
+install_search_index(Movie.__table__)
+install_version_trigger(Movie.__table__)
+
+
 '''
 Cast
+    one row per (movie, actor) pair, keyed by the pair itself so the table
+    and its mirrored (actor_id, movie_id) index both cover the joins behind
+    Actor.movies and Movie.actors. On SQLite the table is stored WITHOUT
+    ROWID, clustered on the pair.
 '''
 
 
 class Cast(db.Model):
     __tablename__ = 'casts'
 
-    id = Column(Integer, primary_key=True)
-    movie_id = Column(Integer, ForeignKey('movies.id'), nullable=False)
-    actor_id = Column(Integer, ForeignKey('actors.id'), nullable=False)
-    __table_args__ = (UniqueConstraint('movie_id', 'actor_id', name='_movie_actor_uc'),)
+    movie_id = Column(Integer, ForeignKey('movies.id'), primary_key=True)
+    actor_id = Column(Integer, ForeignKey('actors.id'), primary_key=True)
+    __table_args__ = (Index('ix_casts_actor_id_movie_id', actor_id, movie_id),
+                      {'sqlite_with_rowid': False})
 
     def __init__(self, movie_id, actor_id):
         self.movie_id = movie_id
@@ -148,6 +267,50 @@ class Cast(db.Model):
         db.session.delete(self)
         db.session.commit()
 
+    '''
+    query_for_format()
+        casts with their movie and actor loaded by the same select, so
+        format() on any number of rows issues no further queries
+    '''
+
+    @classmethod
+    def query_for_format(cls):
+        return cls.query.options(joinedload(cls.movie),
+                                 joinedload(cls.actor))
+
+    '''
+    get_by_legacy_id(id)
+        the cast that had the surrogate `id` before the composite primary
+        key was introduced, or None
+    '''
+
+    @classmethod
+    def get_by_legacy_id(cls, id):
+        return cls.query_for_format().join(cast_legacy_ids, and_(
+            cast_legacy_ids.c.movie_id == cls.movie_id,
+            cast_legacy_ids.c.actor_id == cls.actor_id)).filter(
+            cast_legacy_ids.c.id == id).first()
+
+    '''
+    move_legacy_id(id), drop_legacy_id(id)
+        keep cast_legacy_ids in step when the cast known by `id` changes
+        pair or is deleted; the caller commits
+    '''
+
+    def move_legacy_id(self, id):
+        # stale ids of a pair that was deleted by other routes
+        db.session.execute(cast_legacy_ids.delete().where(and_(
+            cast_legacy_ids.c.movie_id == self.movie_id,
+            cast_legacy_ids.c.actor_id == self.actor_id)))
+        db.session.execute(cast_legacy_ids.update().where(
+            cast_legacy_ids.c.id == id).values(movie_id=self.movie_id,
+                                               actor_id=self.actor_id))
+
+    @staticmethod
+    def drop_legacy_id(id):
+        db.session.execute(cast_legacy_ids.delete().where(
+            cast_legacy_ids.c.id == id))
+
     def format(self):
         return {
             'movie_id': self.movie_id,
@@ -155,3 +318,36 @@ class Cast(db.Model):
             'actor_id': self.actor_id,
             'actor': self.actor.short()
         }
+
+
+install_version_trigger(Cast.__table__)
+
+
+'''
+cast_legacy_ids
+    casts used to have a surrogate `id`. The ids that existed when the
+    composite primary key was introduced are kept here so /api/casts/<id>
+    keeps resolving them; casts created since have no id.
+'''
+
+cast_legacy_ids = db.Table(
+    'cast_legacy_ids',
+    Column('id', Integer, primary_key=True, autoincrement=False),
+    Column('movie_id', Integer, nullable=False),
+    Column('actor_id', Integer, nullable=False)
+)
+
+
+'''
+table_versions
+    the change version of every table read by the GET routes, advanced by
+    triggers on each write, see database/versions.py
+'''
+
+table_versions = db.Table(
+    'table_versions',
+    Column('table_name', String, primary_key=True),
+    Column('version', BigInteger, nullable=False)
+)
+
+install_version_table(table_versions)
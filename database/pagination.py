@@ -0,0 +1,261 @@
+import base64
+import binascii
+import json
+import os
+from datetime import datetime
+
+from sqlalchemy import and_, or_, tuple_
+
+'''
+Keyset pagination
+    collection routes accept `limit` and `cursor` query parameters.
+    Pages are read with `WHERE id > :last_id ORDER BY id LIMIT :limit`
+    instead of OFFSET, so deep pages cost the same as the first one.
+
+    the cursor is opaque to clients: the urlsafe base64 of a JSON list
+    holding the key of the last row of the previous page. Tables with a
+    composite key, such as casts, page on the row value of all its columns.
+'''
+
+DEFAULT_PAGE_SIZE = int(os.environ.get('DEFAULT_PAGE_SIZE', 100))
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 1000))
+
+
+class PaginationError(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    data = json.dumps(list(values), separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(data)
+    except (binascii.Error, ValueError):
+        raise PaginationError(f'Invalid cursor {cursor!r}')
+    if not isinstance(values, list):
+        raise PaginationError(f'Invalid cursor {cursor!r}')
+    return values
+
+
+'''
+get_page_args(args)
+    reads `limit` and `cursor` from the request arguments
+    a missing limit gives DEFAULT_PAGE_SIZE, larger limits are capped at
+    MAX_PAGE_SIZE
+'''
+
+
+def get_page_args(args):
+    limit = args.get('limit', DEFAULT_PAGE_SIZE)
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise PaginationError(f'Invalid limit {limit!r}')
+    if limit < 1:
+        raise PaginationError(f'Invalid limit {limit!r}')
+
+    cursor = args.get('cursor')
+    if cursor:
+        cursor = decode_cursor(cursor)
+    else:
+        cursor = None
+
+    return min(limit, MAX_PAGE_SIZE), cursor
+
+
+'''
+keyset_query(query, key_columns, cursor, descending)
+    `query` ordered by `key_columns`, one column or a tuple of columns,
+    starting after `cursor`
+'''
+
+
+def _as_tuple(key_columns):
+    if isinstance(key_columns, (tuple, list)):
+        return tuple(key_columns)
+    return (key_columns,)
+
+
+'''
+check_keyset_cursor(cursor, key_columns)
+    raises PaginationError unless `cursor` holds one integer per column of
+    `key_columns`
+'''
+
+
+def check_keyset_cursor(cursor, key_columns):
+    if (len(cursor) != len(_as_tuple(key_columns)) or
+            any(type(value) is not int for value in cursor)):
+        raise PaginationError(f'Invalid cursor {cursor!r}')
+
+
+def keyset_query(query, key_columns, cursor=None, descending=False):
+    key_columns = _as_tuple(key_columns)
+    if cursor is not None:
+        check_keyset_cursor(cursor, key_columns)
+        if len(key_columns) == 1:
+            key, last = key_columns[0], cursor[0]
+        else:
+            key, last = tuple_(*key_columns), tuple_(*cursor)
+        query = query.filter(key < last if descending else key > last)
+
+    if descending:
+        return query.order_by(*(column.desc() for column in key_columns))
+    return query.order_by(*key_columns)
+
+
+'''
+keyset_page(query, key_columns, limit, cursor)
+    returns one page of `query` ordered by `key_columns` and the cursor of
+    the next page, or None on the last page
+'''
+
+
+def keyset_page(query, key_columns, limit, cursor=None, descending=False):
+    query = keyset_query(query, key_columns, cursor, descending)
+    rows = query.limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    return rows, encode_cursor([getattr(rows[-1], column.key)
+                                for column in _as_tuple(key_columns)])
+
+
+'''
+Sorting on a value
+    listings sorted on a column other than their key page on the pair
+    (value, id), with the cursor holding [value, id] of the last row.
+    Rows whose value is NULL come after all others, or before them when
+    descending, so a descending listing is the exact reverse of the
+    ascending one.
+'''
+
+
+def _dump_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def load_sorted_cursor(cursor, load=str):
+    if len(cursor) != 2 or type(cursor[1]) is not int:
+        raise PaginationError(f'Invalid cursor {cursor!r}')
+    value, id = cursor
+    if value is not None:
+        try:
+            value = load(value)
+        except (TypeError, ValueError):
+            raise PaginationError(f'Invalid cursor {cursor!r}')
+    return value, id
+
+
+def _after_value(expression, id_column, value, id, descending):
+    if descending:
+        return and_(expression <= value,
+                    or_(expression < value, id_column < id))
+    return and_(expression >= value, or_(expression > value, id_column > id))
+
+
+def _after_id(id_column, id, descending):
+    return id_column < id if descending else id_column > id
+
+
+'''
+sorted_query(query, expression, id_column, cursor, descending, load)
+    `query` ordered by `expression` then `id_column`, starting after
+    `cursor`; `load` turns the value of a cursor back into a value of
+    `expression`
+    one statement for the whole listing, as read by the NDJSON export
+'''
+
+
+def sorted_query(query, expression, id_column, cursor=None,
+                 descending=False, load=str):
+    if cursor is not None:
+        value, id = load_sorted_cursor(cursor, load)
+        if value is None:
+            after = and_(expression.is_(None),
+                         _after_id(id_column, id, descending))
+            if descending:
+                after = or_(after, expression.isnot(None))
+        else:
+            after = _after_value(expression, id_column, value, id,
+                                 descending)
+            if not descending:
+                after = or_(after, expression.is_(None))
+        query = query.filter(after)
+
+    if descending:
+        return query.order_by(expression.desc().nullsfirst(),
+                              id_column.desc())
+    return query.order_by(expression.asc().nullslast(), id_column)
+
+
+'''
+sorted_page(query, expression, id_column, limit, cursor, descending, load)
+    returns one page of `query` ordered by `expression` then `id_column`
+    and the cursor of the next page, or None on the last page
+
+    rows with and without a value are read by separate statements, the
+    second one only when the first does not fill the page, so each is a
+    plain range scan of the index on `expression`
+'''
+
+
+def sorted_page(query, expression, id_column, limit, cursor=None,
+                descending=False, load=str):
+    value, id = None, None
+    if cursor is not None:
+        value, id = load_sorted_cursor(cursor, load)
+
+    phases = ['values', 'nulls']
+    if descending:
+        phases.reverse()
+    if cursor is not None and value is None:
+        phases = phases[phases.index('nulls'):]
+    elif cursor is not None:
+        phases = phases[phases.index('values'):]
+
+    # with the sort value added as a last column, a query for one entity
+    # yields (entity, value) rows and a query for columns yields those
+    # columns followed by the value
+    descriptions = query.column_descriptions
+    entity = (len(descriptions) == 1 and
+              isinstance(descriptions[0]['type'], type))
+    query = query.add_columns(expression)
+    rows = []
+    for phase in phases:
+        if phase == 'values':
+            phase_query = query.filter(expression.isnot(None))
+            if cursor is not None and value is not None:
+                phase_query = phase_query.filter(_after_value(
+                    expression, id_column, value, id, descending))
+            if descending:
+                phase_query = phase_query.order_by(expression.desc(),
+                                                   id_column.desc())
+            else:
+                phase_query = phase_query.order_by(expression, id_column)
+        else:
+            phase_query = query.filter(expression.is_(None))
+            if cursor is not None and value is None:
+                phase_query = phase_query.filter(
+                    _after_id(id_column, id, descending))
+            phase_query = phase_query.order_by(
+                id_column.desc() if descending else id_column)
+        cursor = None
+        rows.extend(phase_query.limit(limit + 1 - len(rows)).all())
+        if len(rows) > limit:
+            break
+
+    items = [row[0] for row in rows] if entity else rows
+    if len(rows) <= limit:
+        return items, None
+
+    items = items[:limit]
+    return items, encode_cursor([_dump_value(rows[limit - 1][-1]),
+                                 getattr(items[-1], id_column.key)])
@@ -0,0 +1,233 @@
+import threading
+import time
+
+from flask import _request_ctx_stack, current_app, has_request_context
+from flask import request
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import event, exc, orm, text
+
+from database.engine import build_engine, engine_options
+from settings import read_settings
+
+'''
+Read replicas
+    with DATABASE_REPLICA_URLS set to a comma separated list of database
+    URLs, the statements of GET, HEAD and OPTIONS requests run on one of
+    the replicas, picked round-robin per request; every other request,
+    and the CLI, uses the primary DATABASE_URL:
+
+        DATABASE_REPLICA_URLS            replica URLs, none by default
+        DATABASE_REPLICA_CHECK_INTERVAL  seconds between two SELECT 1
+                                         health checks of a replica
+        DATABASE_REPLICA_STICKY_SECONDS  seconds a client reads from the
+                                         primary after one of its writes
+
+    a replica that fails its health check, or loses a connection while
+    serving a request, is skipped until it passes the next check; with no
+    healthy replica reads go to the primary.
+
+    read-your-writes: a successful write remembers the client, by its
+    Authorization header in this process and by a cookie across
+    processes, and its reads stay on the primary for
+    DATABASE_REPLICA_STICKY_SECONDS, long enough for the replicas to
+    catch up.
+'''
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+STICKY_COOKIE = 'read_primary_until'
+
+
+def _urls(value):
+    if isinstance(value, str):
+        value = value.split(',')
+    return [url.strip() for url in value if url.strip()]
+
+
+REPLICA_SETTINGS = {
+    'DATABASE_REPLICA_URLS': (_urls, []),
+    'DATABASE_REPLICA_CHECK_INTERVAL': (float, 10),
+    'DATABASE_REPLICA_STICKY_SECONDS': (float, 5)
+}
+
+
+class Replica:
+    def __init__(self, url, engine):
+        self.url = url
+        self.engine = engine
+        self.healthy = False
+        self.checked_at = None
+
+
+'''
+ReplicaSet(urls, config, check_interval, sticky_seconds)
+    the engines of the replicas at `urls`, created with the engine and
+    pool settings in `config`, and the clients that wrote recently
+'''
+
+
+class ReplicaSet:
+    def __init__(self, urls, config=None, check_interval=10,
+                 sticky_seconds=5, clock=time.time):
+        self.check_interval = check_interval
+        self.sticky_seconds = sticky_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._next = 0
+        self._writers = {}
+
+        self.replicas = []
+        for url in urls:
+            replica = Replica(url, build_engine(
+                url, **engine_options(url, config or {})))
+            event.listen(replica.engine, 'handle_error',
+                         self._on_error(replica))
+            self.replicas.append(replica)
+
+    def _on_error(self, replica):
+        def mark_down(context):
+            if context.connection is None or context.is_disconnect:
+                replica.healthy = False
+                replica.checked_at = self._clock()
+        return mark_down
+
+    def check(self, replica):
+        try:
+            with replica.engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+        except exc.SQLAlchemyError:
+            return False
+        return True
+
+    def _is_healthy(self, replica):
+        now = self._clock()
+        if (replica.checked_at is None or
+                now - replica.checked_at >= self.check_interval):
+            replica.healthy = self.check(replica)
+            replica.checked_at = now
+        return replica.healthy
+
+    '''
+    pick()
+        the engine of the next healthy replica, or None
+    '''
+
+    def pick(self):
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % max(len(self.replicas), 1)
+        for offset in range(len(self.replicas)):
+            replica = self.replicas[(start + offset) % len(self.replicas)]
+            if self._is_healthy(replica):
+                return replica.engine
+        return None
+
+    '''
+    remember_write(client)
+        keeps the reads of `client` on the primary for sticky_seconds,
+        returns the time until which they stay there
+    '''
+
+    def remember_write(self, client):
+        now = self._clock()
+        until = now + self.sticky_seconds
+        if client:
+            with self._lock:
+                if len(self._writers) >= 1024:
+                    self._writers = {key: value for key, value
+                                     in self._writers.items() if value > now}
+                self._writers[client] = until
+        return until
+
+    def wrote_recently(self, client, cookie=None):
+        now = self._clock()
+        try:
+            if cookie is not None and float(cookie) > now:
+                return True
+        except ValueError:
+            pass
+        return bool(client) and self._writers.get(client, 0) > now
+
+    def dispose(self):
+        for replica in self.replicas:
+            replica.engine.dispose()
+
+
+'''
+install_replicas(app)
+    sets up the replicas of `app` from its config or the environment,
+    replacing the ones of an earlier call
+'''
+
+
+def install_replicas(app):
+    previous = app.extensions.pop('replicas', None)
+    if previous is not None:
+        previous.dispose()
+
+    settings = read_settings(app.config, REPLICA_SETTINGS)
+    if settings['DATABASE_REPLICA_URLS']:
+        app.extensions['replicas'] = ReplicaSet(
+            settings['DATABASE_REPLICA_URLS'], app.config,
+            check_interval=settings['DATABASE_REPLICA_CHECK_INTERVAL'],
+            sticky_seconds=settings['DATABASE_REPLICA_STICKY_SECONDS'])
+
+
+def _client(request):
+    return request.headers.get('Authorization')
+
+
+'''
+read_engine()
+    the replica engine the statements of the current request run on, or
+    None for the primary; picked once per request
+'''
+
+
+def read_engine():
+    if not has_request_context():
+        return None
+    top = _request_ctx_stack.top
+    if not hasattr(top, 'read_engine'):
+        replicas = current_app.extensions.get('replicas')
+        top.read_engine = None
+        if (replicas is not None and request.method in READ_METHODS and
+                not replicas.wrote_recently(
+                    _client(request), request.cookies.get(STICKY_COOKIE))):
+            top.read_engine = replicas.pick()
+    return top.read_engine
+
+
+'''
+remember_writes(request, response)
+    starts the read-your-writes window of the client of a successful
+    write, for use in an after_request hook
+'''
+
+
+def remember_writes(request, response):
+    replicas = current_app.extensions.get('replicas')
+    if (replicas is None or request.method in READ_METHODS or
+            response.status_code >= 400):
+        return response
+
+    until = replicas.remember_write(_client(request))
+    response.set_cookie(STICKY_COOKIE, '%.3f' % until,
+                        max_age=int(replicas.sticky_seconds) + 1,
+                        httponly=True, samesite='Lax')
+    return response
+
+
+class RoutingSession(SignallingSession):
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        engine = read_engine()
+        if engine is not None and not self._flushing:
+            return engine
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_engine(self, sa_url, engine_opts):
+        return build_engine(sa_url, **engine_opts)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
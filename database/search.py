@@ -0,0 +1,202 @@
+import math
+import re
+
+from sqlalchemy import DDL, event, text
+
+from database.pagination import (PaginationError, encode_cursor,
+                                 get_page_args)
+
+'''
+Full-text search
+    GET /api/search?q= matches movie titles and actor names on word
+    prefixes and ranks the matches, best first.
+
+    Every match is ranked, so the time a query takes grows with the
+    number of rows it matches; a query needs a term of at least
+    MIN_PREFIX_LENGTH letters, as a prefix of one or two letters can
+    match a large part of the catalog.
+
+    PostgreSQL: a GIN index on to_tsvector('simple', <column>) per table,
+        matched with prefix terms (word:*) and ranked with ts_rank
+    SQLite: an FTS5 table per table, <table>_search, whose rowid is the id
+        of the row it indexes, ranked with bm25. The model methods and
+        bulk inserts keep it in step with the table.
+'''
+
+SEARCHED_COLUMNS = {'actors': 'name', 'movies': 'title'}
+MAX_SEARCH_TERMS = 8
+MIN_PREFIX_LENGTH = 3
+
+# the kind of each hit in results and cursors, in tie-breaking order
+KINDS = {'actors': 'actor', 'movies': 'movie'}
+
+
+def _tsvector(column):
+    return f"to_tsvector('simple', coalesce({column}, ''))"
+
+
+'''
+install_search_index(table)
+    adds the search index of `table` to its CREATE and DROP statements
+'''
+
+
+def install_search_index(table):
+    column = SEARCHED_COLUMNS[table.name]
+    event.listen(table, 'after_create', DDL(
+        f'CREATE INDEX ix_{table.name}_{column}_search ON {table.name} '
+        f'USING gin ({_tsvector(column)})').execute_if(
+        dialect='postgresql'))
+    event.listen(table, 'after_create', DDL(
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS {table.name}_search USING '
+        f"fts5({column}, tokenize='unicode61 remove_diacritics 2', "
+        f"prefix='2 3')").execute_if(dialect='sqlite'))
+    event.listen(table, 'after_drop', DDL(
+        f'DROP TABLE IF EXISTS {table.name}_search').execute_if(
+        dialect='sqlite'))
+
+
+def _is_sqlite(session):
+    return session.connection().dialect.name == 'sqlite'
+
+
+'''
+index_documents(session, table_name, documents)
+    adds or replaces the (id, text) `documents` of `table_name` in its
+    search index; PostgreSQL indexes the column itself, so only SQLite
+    has work to do
+'''
+
+
+def index_documents(session, table_name, documents):
+    if not documents or not _is_sqlite(session):
+        return
+    session.execute(text(
+        f'INSERT OR REPLACE INTO {table_name}_search '
+        f'(rowid, {SEARCHED_COLUMNS[table_name]}) VALUES (:id, :text)'),
+        [{'id': id, 'text': value} for id, value in documents])
+
+
+def remove_documents(session, table_name, ids):
+    if not ids or not _is_sqlite(session):
+        return
+    session.execute(text(
+        f'DELETE FROM {table_name}_search WHERE rowid = :id'),
+        [{'id': id} for id in ids])
+
+
+'''
+rebuild_search_index(connection)
+    refills every SQLite search table from its table, for rows written
+    without the model methods, e.g. by a migration or a seed script
+'''
+
+
+def rebuild_search_index(connection):
+    if connection.dialect.name != 'sqlite':
+        return
+    for table_name, column in SEARCHED_COLUMNS.items():
+        connection.execute(text(f'DELETE FROM {table_name}_search'))
+        connection.execute(text(
+            f'INSERT INTO {table_name}_search (rowid, {column}) '
+            f'SELECT id, {column} FROM {table_name}'))
+
+
+'''
+search_terms(q)
+    the words of the query string `q`, lower cased
+    raises ValueError when `q` holds no word, too many, or only words
+    shorter than MIN_PREFIX_LENGTH
+'''
+
+
+def search_terms(q):
+    terms = re.findall(r'\w+', (q or '').lower())
+    if not terms:
+        raise ValueError(f'Nothing to search for in {q!r}')
+    if len(terms) > MAX_SEARCH_TERMS:
+        raise ValueError(f'Too many search terms, at most {MAX_SEARCH_TERMS}')
+    if max(len(term) for term in terms) < MIN_PREFIX_LENGTH:
+        raise ValueError(f'Search terms of at least {MIN_PREFIX_LENGTH} '
+                         f'letters needed in {q!r}')
+    return terms
+
+
+def _hits_sql(dialect_name):
+    selects = []
+    for table_name, column in SEARCHED_COLUMNS.items():
+        kind = KINDS[table_name]
+        if dialect_name == 'postgresql':
+            # ts_rank is a real; as a double precision it goes through the
+            # cursor and back unchanged, so ties at a page boundary are
+            # neither skipped nor repeated
+            selects.append(
+                f"SELECT '{kind}' AS kind, id, "
+                f"CAST(-ts_rank({_tsvector(column)}, "
+                f"to_tsquery('simple', :query)) AS double precision) AS rank "
+                f'FROM {table_name} '
+                f"WHERE {_tsvector(column)} @@ to_tsquery('simple', :query)")
+        else:
+            selects.append(
+                f"SELECT '{kind}' AS kind, rowid AS id, "
+                f'bm25({table_name}_search) AS rank '
+                f'FROM {table_name}_search '
+                f'WHERE {table_name}_search MATCH :query')
+    return ' UNION ALL '.join(selects)
+
+
+def _check_cursor(cursor):
+    if (len(cursor) != 3 or type(cursor[0]) not in (int, float) or
+            not math.isfinite(cursor[0]) or
+            cursor[1] not in KINDS.values() or type(cursor[2]) is not int):
+        raise PaginationError(f'Invalid cursor {cursor!r}')
+    return cursor
+
+
+'''
+check_search_args(args)
+    raises ValueError for the limit, cursor and `q` arguments the search
+    route answers 400 to, without running any query
+'''
+
+
+def check_search_args(args):
+    limit, cursor = get_page_args(args)
+    search_terms(args.get('q'))
+    if cursor is not None:
+        _check_cursor(cursor)
+
+
+'''
+search_page(session, terms, limit, cursor)
+    one page of the movies and actors matching every term of `terms` as
+    a word prefix, best first, as a list of (kind, id), and the cursor of
+    the next page, or None on the last page
+    lower ranks are better on both databases, ties are broken by kind
+    then id
+'''
+
+
+def search_page(session, terms, limit, cursor=None):
+    dialect_name = session.connection().dialect.name
+    if dialect_name == 'postgresql':
+        query = ' & '.join(f'{term}:*' for term in terms)
+    else:
+        query = ' '.join(f'"{term}"*' for term in terms)
+
+    params = {'query': query, 'limit': limit + 1}
+    after = ''
+    if cursor is not None:
+        params['rank'], params['kind'], params['id'] = _check_cursor(cursor)
+        after = 'WHERE (rank, kind, id) > (:rank, :kind, :id) '
+
+    rows = session.execute(text(
+        f'SELECT kind, id, rank FROM ({_hits_sql(dialect_name)}) AS hits '
+        f'{after}ORDER BY rank, kind, id LIMIT :limit'), params).fetchall()
+    if len(rows) <= limit:
+        return [(kind, id) for kind, id, rank in rows], None
+
+    rows = rows[:limit]
+    kind, id, rank = rows[-1]
+    return ([(kind, id) for kind, id, rank in rows],
+            encode_cursor([rank, kind, id]))
@@ -0,0 +1,155 @@
+import time
+
+from sqlalchemy import DDL, bindparam, event, text
+
+'''
+Table versions
+    one counter per table in the table_versions table, advanced by a
+    trigger in the same transaction as every write to the table, so the
+    model methods, direct session use, Core statements and raw SQL are
+    all covered and every process sees the same versions. Rolled back
+    writes roll the counter back with them.
+
+    PostgreSQL: one FOR EACH STATEMENT trigger per table; writers to the
+        same table queue on its version row until they commit
+    SQLite: AFTER INSERT, UPDATE and DELETE triggers, run for every row
+'''
+
+VERSIONED_TABLES = ('actors', 'movies', 'casts')
+
+
+'''
+VersionsError
+    raised when the version rows or triggers are missing, as in a
+    database that was not migrated to the latest revision; its versions
+    would never change and the ETags and cached responses never expire
+'''
+
+
+class VersionsError(RuntimeError):
+    pass
+
+
+BUMP_FUNCTION = '''
+CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+BEGIN
+    UPDATE table_versions SET version = version + 1
+    WHERE table_name = TG_TABLE_NAME;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+'''
+
+
+'''
+version_trigger_names(table_name, dialect_name)
+    the names of the triggers advancing the version of `table_name`
+'''
+
+
+def version_trigger_names(table_name, dialect_name):
+    if dialect_name == 'postgresql':
+        return [f'{table_name}_version']
+    return [f'{table_name}_version_{operation.lower()}'
+            for operation in ('INSERT', 'UPDATE', 'DELETE')]
+
+
+def version_trigger_ddl(table_name, dialect_name):
+    if dialect_name == 'postgresql':
+        return [BUMP_FUNCTION,
+                f'CREATE TRIGGER {table_name}_version '
+                f'AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE '
+                f'ON {table_name} FOR EACH STATEMENT '
+                f'EXECUTE PROCEDURE bump_table_version()']
+    return [f'CREATE TRIGGER {table_name}_version_{operation.lower()} '
+            f'AFTER {operation} ON {table_name} BEGIN '
+            f'UPDATE table_versions SET version = version + 1 '
+            f"WHERE table_name = '{table_name}'; END"
+            for operation in ('INSERT', 'UPDATE', 'DELETE')]
+
+
+'''
+seed_versions(connection)
+    adds a row per versioned table to table_versions
+    counters start from the current time in microseconds rather than 0, so
+    versions handed out before the tables were recreated or restored are
+    not handed out again
+'''
+
+
+def seed_versions(connection):
+    epoch = time.time_ns() // 1000
+    connection.execute(text(
+        'INSERT INTO table_versions (table_name, version) '
+        'VALUES (:table_name, :version)'),
+        [{'table_name': name, 'version': epoch}
+         for name in VERSIONED_TABLES])
+
+
+'''
+install_version_trigger(table)
+    adds the triggers advancing the version of `table` to its CREATE
+    statement
+'''
+
+
+def install_version_trigger(table):
+    for dialect_name in ('postgresql', 'sqlite'):
+        for statement in version_trigger_ddl(table.name, dialect_name):
+            event.listen(table, 'after_create', DDL(
+                statement).execute_if(dialect=dialect_name))
+
+
+'''
+install_version_table(table)
+    fills the table_versions `table` with a row per versioned table when
+    it is created
+'''
+
+
+def install_version_table(table):
+    event.listen(table, 'after_create',
+                 lambda target, connection, **kw: seed_versions(connection))
+
+
+'''
+check_versions(connection)
+    raises VersionsError unless every versioned table has its row in
+    table_versions and its triggers
+'''
+
+
+def check_versions(connection):
+    dialect_name = connection.dialect.name
+    if dialect_name == 'postgresql':
+        statement = 'SELECT tgname FROM pg_trigger WHERE NOT tgisinternal'
+    else:
+        statement = "SELECT name FROM sqlite_master WHERE type = 'trigger'"
+    triggers = {name for name, in connection.execute(text(statement))}
+    missing = [name for table in VERSIONED_TABLES
+               for name in version_trigger_names(table, dialect_name)
+               if name not in triggers]
+    if missing:
+        raise VersionsError(f'Missing version triggers {missing!r}, '
+                            f'run flask db upgrade')
+    read_versions(connection, VERSIONED_TABLES)
+
+
+'''
+read_versions(session, tables)
+    the current versions of `tables`, as a tuple in the same order
+    raises VersionsError when one of them has no row in table_versions
+'''
+
+
+def read_versions(session, tables):
+    statement = text('SELECT table_name, version FROM table_versions '
+                     'WHERE table_name IN :tables').bindparams(
+        bindparam('tables', expanding=True))
+    versions = dict(session.execute(
+        statement, {'tables': list(tables)}).fetchall())
+    missing = [table for table in tables if table not in versions]
+    if missing:
+        raise VersionsError(f'No version for {missing!r} in table_versions, '
+                            f'run flask db upgrade')
+    return tuple(versions[table] for table in tables)
@@ -0,0 +1,124 @@
+'''
+gunicorn settings, read by `gunicorn app:app` from the project root
+
+    GUNICORN_WORKERS         worker processes, default WEB_CONCURRENCY or
+                             2 x CPUs + 1
+    GUNICORN_THREADS         threads per worker, default 1; above 1 the
+                             workers are gthread workers
+    GUNICORN_PRELOAD         load the app once in the master before
+                             forking the workers, default true
+    GUNICORN_WARMUP          warm every worker up before it accepts
+                             connections, default true
+    GUNICORN_MAX_REQUESTS    requests after which a worker is replaced,
+                             0 never, default 1000
+    GUNICORN_MAX_REQUESTS_JITTER
+                             random extra requests per worker, so that the
+                             workers are not replaced all at once,
+                             default 100
+    GUNICORN_TIMEOUT         seconds a silent worker lives, default 30
+    PORT                     port to listen on, default 5000
+    PROMETHEUS_MULTIPROC_DIR directory where the workers write their
+                             metrics, see web/metrics.py; emptied when
+                             the server starts, default a directory named
+                             after the master's pid in the temporary
+                             directory, removed when the server exits
+'''
+import glob
+import importlib.util
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+
+# gunicorn reads this file before it puts the project root on sys.path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from settings import flag, read_settings  # noqa: E402
+
+bind = '0.0.0.0:' + os.environ.get('PORT', '5000')
+
+workers = int(os.environ.get('GUNICORN_WORKERS',
+                             os.environ.get('WEB_CONCURRENCY',
+                                            multiprocessing.cpu_count() * 2
+                                            + 1)))
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+worker_class = 'gthread' if threads > 1 else 'sync'
+
+preload_app = flag(os.environ.get('GUNICORN_PRELOAD', True))
+warmup = flag(os.environ.get('GUNICORN_WARMUP', True))
+
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = timeout
+keepalive = 5
+
+# set before the app is loaded, so that every process writes its metrics
+# to the shared directory
+metrics_dir = None
+if importlib.util.find_spec('prometheus_client') is not None:
+    if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+        os.environ['PROMETHEUS_MULTIPROC_DIR'] = os.path.join(
+            tempfile.gettempdir(), 'prometheus-%d' % os.getpid())
+        metrics_dir = os.environ['PROMETHEUS_MULTIPROC_DIR']
+
+
+def on_starting(server):
+    path = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if path:
+        # metrics left by a previous server would be added to ours
+        os.makedirs(path, exist_ok=True)
+        for name in glob.glob(os.path.join(path, '*.db')):
+            os.remove(name)
+
+
+def when_ready(server):
+    # with preload_app the mappers are configured once, in the master
+    if preload_app:
+        from sqlalchemy.orm import configure_mappers
+        configure_mappers()
+
+
+def pre_fork(server, worker):
+    # connections opened by the master must not be shared with a worker
+    if preload_app:
+        from web.warmup import reset_pools
+        reset_pools(server.app.wsgi())
+
+
+def post_worker_init(worker):
+    if not warmup:
+        return
+    from database.engine import ENGINE_SETTINGS
+    from database.versions import VersionsError
+    from web.warmup import warm_up
+
+    app = worker.wsgi
+    connections = min(threads, read_settings(
+        app.config, ENGINE_SETTINGS)['DB_POOL_SIZE'])
+    try:
+        timings = warm_up(app, connections)
+    except VersionsError:
+        # a worker failing to boot stops gunicorn, rather than serving
+        # ETags and cached responses that never expire
+        raise
+    except Exception as e:
+        # serve anyway, the first requests will retry
+        worker.log.warning('Worker warmup failed: %s', e)
+        return
+    worker.log.info('Worker warmed up in %.0f ms (%s)',
+                    sum(timings.values()) * 1000,
+                    ', '.join('%s %.0f ms' % (step, seconds * 1000)
+                              for step, seconds in timings.items()))
+
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+
+
+def on_exit(server):
+    if metrics_dir is not None:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
@@ -0,0 +1,51 @@
+"""Add indexes for the API query paths.
+
+Revision ID: 3c7e1d52a9b4
+Revises: feb35a2178a9
+Create Date: 2026-10-18 09:12:37.518204
+
+"""
+from contextlib import contextmanager
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c7e1d52a9b4'
+down_revision = 'feb35a2178a9'
+branch_labels = None
+depends_on = None
+
+
+# PostgreSQL builds the indexes CONCURRENTLY so the tables stay writable
+# while they are built; that cannot run inside a transaction block, hence
+# the autocommit block. Other databases get plain CREATE INDEX statements.
+@contextmanager
+def concurrent_ddl():
+    if op.get_context().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            yield
+    else:
+        yield
+
+
+def upgrade():
+    with concurrent_ddl():
+        op.create_index('ix_casts_actor_id', 'casts', ['actor_id'],
+                        postgresql_concurrently=True)
+        op.create_index('ix_movies_release_date', 'movies', ['release_date'],
+                        postgresql_concurrently=True)
+        op.create_index('ix_actors_lower_name', 'actors',
+                        [sa.text('lower(name)')],
+                        postgresql_concurrently=True)
+
+
+def downgrade():
+    with concurrent_ddl():
+        op.drop_index('ix_actors_lower_name', table_name='actors',
+                      postgresql_concurrently=True)
+        op.drop_index('ix_movies_release_date', table_name='movies',
+                      postgresql_concurrently=True)
+        op.drop_index('ix_casts_actor_id', table_name='casts',
+                      postgresql_concurrently=True)
@@ -0,0 +1,77 @@
+"""Track a change version per table for ETags and the response cache.
+
+Revision ID: 4b7a90e3f1c5
+Revises: e5f13a8c6d21
+Create Date: 2026-10-18 18:05:41.209337
+
+"""
+import time
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b7a90e3f1c5'
+down_revision = 'e5f13a8c6d21'
+branch_labels = None
+depends_on = None
+
+
+VERSIONED_TABLES = ('actors', 'movies', 'casts')
+
+BUMP_FUNCTION = '''
+CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+BEGIN
+    UPDATE table_versions SET version = version + 1
+    WHERE table_name = TG_TABLE_NAME;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+'''
+
+SQLITE_OPERATIONS = ('INSERT', 'UPDATE', 'DELETE')
+
+
+# versions start from the current time in microseconds, see
+# database/versions.py
+def upgrade():
+    table_versions = op.create_table('table_versions',
+    sa.Column('table_name', sa.String(), nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('table_name')
+    )
+    epoch = time.time_ns() // 1000
+    op.bulk_insert(table_versions, [
+        {'table_name': table, 'version': epoch}
+        for table in VERSIONED_TABLES])
+
+    if op.get_context().dialect.name == 'postgresql':
+        op.execute(BUMP_FUNCTION)
+        for table in VERSIONED_TABLES:
+            op.execute(f'CREATE TRIGGER {table}_version '
+                       f'AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE '
+                       f'ON {table} FOR EACH STATEMENT '
+                       f'EXECUTE PROCEDURE bump_table_version()')
+        return
+
+    for table in VERSIONED_TABLES:
+        for operation in SQLITE_OPERATIONS:
+            op.execute(f'CREATE TRIGGER {table}_version_{operation.lower()} '
+                       f'AFTER {operation} ON {table} BEGIN '
+                       f'UPDATE table_versions SET version = version + 1 '
+                       f"WHERE table_name = '{table}'; END")
+
+
+def downgrade():
+    if op.get_context().dialect.name == 'postgresql':
+        for table in VERSIONED_TABLES:
+            op.execute(f'DROP TRIGGER {table}_version ON {table}')
+        op.execute('DROP FUNCTION bump_table_version()')
+    else:
+        for table in VERSIONED_TABLES:
+            for operation in SQLITE_OPERATIONS:
+                op.execute(
+                    f'DROP TRIGGER {table}_version_{operation.lower()}')
+
+    op.drop_table('table_versions')
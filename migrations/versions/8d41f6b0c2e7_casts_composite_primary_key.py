@@ -0,0 +1,151 @@
+"""Key casts by (movie_id, actor_id).
+
+Revision ID: 8d41f6b0c2e7
+Revises: 3c7e1d52a9b4
+Create Date: 2026-10-18 11:40:03.271845
+
+"""
+from contextlib import contextmanager
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d41f6b0c2e7'
+down_revision = '3c7e1d52a9b4'
+branch_labels = None
+depends_on = None
+
+
+# the surrogate ids are copied to cast_legacy_ids before the column goes,
+# so /api/casts/<id> keeps resolving them
+def create_legacy_ids():
+    op.create_table('cast_legacy_ids',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('movie_id', sa.Integer(), nullable=False),
+    sa.Column('actor_id', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute('INSERT INTO cast_legacy_ids (id, movie_id, actor_id) '
+               'SELECT id, movie_id, actor_id FROM casts')
+
+
+@contextmanager
+def autocommit():
+    with op.get_context().autocommit_block():
+        yield
+
+
+def upgrade():
+    if op.get_context().dialect.name == 'postgresql':
+        upgrade_postgresql()
+    else:
+        upgrade_rebuild()
+
+
+def downgrade():
+    if op.get_context().dialect.name == 'postgresql':
+        downgrade_postgresql()
+    else:
+        downgrade_rebuild()
+
+
+# PostgreSQL: both new indexes are built CONCURRENTLY, then one short
+# transaction swaps the primary key onto the unique index. Dropping the
+# column does not shrink rows already written; run VACUUM FULL casts (or
+# pg_repack) in a maintenance window to reclaim the space.
+def upgrade_postgresql():
+    with autocommit():
+        op.create_index('casts_movie_id_actor_id_key', 'casts',
+                        ['movie_id', 'actor_id'], unique=True,
+                        postgresql_concurrently=True)
+        op.create_index('ix_casts_actor_id_movie_id', 'casts',
+                        ['actor_id', 'movie_id'],
+                        postgresql_concurrently=True)
+
+    op.execute('LOCK TABLE casts IN ACCESS EXCLUSIVE MODE')
+    create_legacy_ids()
+    op.drop_constraint('_movie_actor_uc', 'casts', type_='unique')
+    op.drop_constraint('casts_pkey', 'casts', type_='primary')
+    op.drop_column('casts', 'id')
+    op.execute('ALTER TABLE casts ADD CONSTRAINT casts_pkey '
+               'PRIMARY KEY USING INDEX casts_movie_id_actor_id_key')
+
+    with autocommit():
+        op.drop_index('ix_casts_actor_id', table_name='casts',
+                      postgresql_concurrently=True)
+
+
+def downgrade_postgresql():
+    with autocommit():
+        op.create_index('ix_casts_actor_id', 'casts', ['actor_id'],
+                        postgresql_concurrently=True)
+
+    op.execute('LOCK TABLE casts IN ACCESS EXCLUSIVE MODE')
+    op.add_column('casts', sa.Column('id', sa.Integer(), nullable=True))
+    op.execute('UPDATE casts SET id = cast_legacy_ids.id '
+               'FROM cast_legacy_ids '
+               'WHERE cast_legacy_ids.movie_id = casts.movie_id '
+               'AND cast_legacy_ids.actor_id = casts.actor_id')
+    op.execute('CREATE SEQUENCE casts_id_seq OWNED BY casts.id')
+    op.execute("SELECT setval('casts_id_seq', "
+               "(SELECT COALESCE(MAX(id), 0) + 1 FROM casts), false)")
+    op.execute("UPDATE casts SET id = nextval('casts_id_seq') "
+               "WHERE id IS NULL")
+    op.alter_column('casts', 'id', nullable=False,
+                    server_default=sa.text("nextval('casts_id_seq')"))
+    op.drop_constraint('casts_pkey', 'casts', type_='primary')
+    op.create_primary_key('casts_pkey', 'casts', ['id'])
+    op.create_unique_constraint('_movie_actor_uc', 'casts',
+                                ['movie_id', 'actor_id'])
+    op.drop_table('cast_legacy_ids')
+
+    with autocommit():
+        op.drop_index('ix_casts_actor_id_movie_id', table_name='casts',
+                      postgresql_concurrently=True)
+
+
+# SQLite cannot change a primary key in place: the table is rebuilt,
+# WITHOUT ROWID so that it is stored clustered on the pair
+def upgrade_rebuild():
+    create_legacy_ids()
+    op.create_table('casts_new',
+    sa.Column('movie_id', sa.Integer(), nullable=False),
+    sa.Column('actor_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['actor_id'], ['actors.id'], ),
+    sa.ForeignKeyConstraint(['movie_id'], ['movies.id'], ),
+    sa.PrimaryKeyConstraint('movie_id', 'actor_id'),
+    sqlite_with_rowid=False
+    )
+    op.execute('INSERT INTO casts_new (movie_id, actor_id) '
+               'SELECT movie_id, actor_id FROM casts')
+    op.drop_index('ix_casts_actor_id', table_name='casts')
+    op.drop_table('casts')
+    op.rename_table('casts_new', 'casts')
+    op.create_index('ix_casts_actor_id_movie_id', 'casts',
+                    ['actor_id', 'movie_id'])
+
+
+def downgrade_rebuild():
+    op.create_table('casts_old',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('movie_id', sa.Integer(), nullable=False),
+    sa.Column('actor_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['actor_id'], ['actors.id'], ),
+    sa.ForeignKeyConstraint(['movie_id'], ['movies.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('movie_id', 'actor_id', name='_movie_actor_uc')
+    )
+    # casts without a legacy id get a fresh one from the INTEGER PRIMARY KEY
+    op.execute('INSERT INTO casts_old (id, movie_id, actor_id) '
+               'SELECT cast_legacy_ids.id, casts.movie_id, casts.actor_id '
+               'FROM casts LEFT OUTER JOIN cast_legacy_ids '
+               'ON cast_legacy_ids.movie_id = casts.movie_id '
+               'AND cast_legacy_ids.actor_id = casts.actor_id '
+               'ORDER BY cast_legacy_ids.id IS NULL, cast_legacy_ids.id')
+    op.drop_index('ix_casts_actor_id_movie_id', table_name='casts')
+    op.drop_table('casts')
+    op.rename_table('casts_old', 'casts')
+    op.create_index('ix_casts_actor_id', 'casts', ['actor_id'])
+    op.drop_table('cast_legacy_ids')
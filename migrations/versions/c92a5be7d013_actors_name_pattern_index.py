@@ -0,0 +1,35 @@
+"""Add a LIKE prefix index on lower(actors.name) for PostgreSQL.
+
+Revision ID: c92a5be7d013
+Revises: 8d41f6b0c2e7
+Create Date: 2026-10-18 14:05:51.904716
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c92a5be7d013'
+down_revision = '8d41f6b0c2e7'
+branch_labels = None
+depends_on = None
+
+
+# name_prefix filters with LIKE on PostgreSQL, which needs text_pattern_ops
+# under any collation other than C. SQLite filters on a range of
+# ix_actors_lower_name instead, so there is nothing to do there.
+def upgrade():
+    if op.get_context().dialect.name != 'postgresql':
+        return
+    with op.get_context().autocommit_block():
+        op.execute('CREATE INDEX CONCURRENTLY ix_actors_lower_name_pattern '
+                   'ON actors (lower(name) text_pattern_ops)')
+
+
+def downgrade():
+    if op.get_context().dialect.name != 'postgresql':
+        return
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_actors_lower_name_pattern', table_name='actors',
+                      postgresql_concurrently=True)
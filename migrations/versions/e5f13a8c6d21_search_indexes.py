@@ -0,0 +1,51 @@
+"""Add full-text search indexes on movie titles and actor names.
+
+Revision ID: e5f13a8c6d21
+Revises: c92a5be7d013
+Create Date: 2026-10-18 16:22:08.613390
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5f13a8c6d21'
+down_revision = 'c92a5be7d013'
+branch_labels = None
+depends_on = None
+
+
+SEARCHED_COLUMNS = {'actors': 'name', 'movies': 'title'}
+
+
+# PostgreSQL indexes the column expressions, built CONCURRENTLY; SQLite
+# gets one FTS5 table per table, filled from the existing rows
+def upgrade():
+    if op.get_context().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            for table, column in SEARCHED_COLUMNS.items():
+                op.execute(
+                    f'CREATE INDEX CONCURRENTLY ix_{table}_{column}_search '
+                    f'ON {table} USING gin '
+                    f"(to_tsvector('simple', coalesce({column}, '')))")
+        return
+
+    for table, column in SEARCHED_COLUMNS.items():
+        op.execute(
+            f'CREATE VIRTUAL TABLE {table}_search USING fts5({column}, '
+            f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')")
+        op.execute(f'INSERT INTO {table}_search (rowid, {column}) '
+                   f'SELECT id, {column} FROM {table}')
+
+
+def downgrade():
+    if op.get_context().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            for table, column in SEARCHED_COLUMNS.items():
+                op.drop_index(f'ix_{table}_{column}_search', table_name=table,
+                              postgresql_concurrently=True)
+        return
+
+    for table in SEARCHED_COLUMNS:
+        op.execute(f'DROP TABLE {table}_search')
@@ -0,0 +1,36 @@
+import os
+
+'''
+Settings
+    the settings a module reads when it is installed on an app are declared
+    in a dictionary of name: (parse, default), read with read_settings from
+    the app config, falling back to the environment and then to the default
+
+    settings read from the environment when their module is imported, such
+    as the page sizes, the compression levels and the auth and cache
+    settings, do not go through read_settings
+'''
+
+
+'''
+flag(value)
+    True for 1, true, yes and on, in any case, False for anything else
+'''
+
+
+def flag(value):
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+
+'''
+read_settings(config, declared)
+    the value of every setting of `declared`, by name, parsed
+'''
+
+
+def read_settings(config, declared):
+    settings = {}
+    for name, (parse, default) in declared.items():
+        value = config.get(name, os.environ.get(name))
+        settings[name] = default if value is None else parse(value)
+    return settings
@@ -0,0 +1,1479 @@
+import asyncio
+import gzip
+import json
+import os
+import runpy
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import unittest
+import zlib
+from contextlib import contextmanager
+from functools import partial
+from unittest import mock
+from datetime import datetime, timedelta
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.setdefault('AUTH0_DOMAIN', 'capstone.test')
+os.environ.setdefault('API_AUDIENCE', 'capstone-app')
+os.environ.setdefault('EXCITED', 'true')
+
+from sqlalchemy import create_engine, event, exc, text
+
+from app import create_app
+from auth import auth
+from auth.jwks import JWKSKeyStore
+from auth.local_idp import ROLE_PERMISSIONS, LocalIdentityProvider
+from database import (bulk, documents, engine, filters, pagination,
+                      replicas, search, versions)
+from database.models import setup_db, db, Actor, Movie, Cast, cast_legacy_ids
+from web import (asgi, compression, metrics, response_cache, streaming,
+                 timing, warmup)
+
+
+class ApiTestCase(unittest.TestCase):
+    """This class represents the offline API test case
+
+    The app runs against an in-memory SQLite database and accepts tokens
+    minted by a LocalIdentityProvider, so no Postgres or Auth0 is needed.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.idp = LocalIdentityProvider(auth.AUTH0_DOMAIN, auth.API_AUDIENCE,
+                                        bits=1024)
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.default_store = auth.jwks_store
+        auth.jwks_store = JWKSKeyStore(
+            cls.idp.write_jwks(os.path.join(cls.tmpdir, 'jwks.json')),
+            key_loader=auth.jwt_backend.load_key)
+
+        cls.headers = {
+            role: {'Authorization': 'Bearer ' + cls.idp.mint_for_role(role)}
+            for role in ROLE_PERMISSIONS
+        }
+
+        cls.app = create_app()
+        setup_db(cls.app, 'sqlite://')
+
+    @classmethod
+    def tearDownClass(cls):
+        auth.jwks_store = cls.default_store
+        shutil.rmtree(cls.tmpdir)
+
+    def setUp(self):
+        self.client = self.app.test_client
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.drop_all()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        self.ctx.pop()
+
+    def get(self, url, role='casting_assistant', headers=None, **kwargs):
+        headers = dict(self.headers[role], **(headers or {}))
+        return self.client().get(url, headers=headers, **kwargs)
+
+    def post(self, url, role='executive_producer', **kwargs):
+        return self.client().post(url, headers=self.headers[role], **kwargs)
+
+    def put(self, url, role='executive_producer', **kwargs):
+        return self.client().put(url, headers=self.headers[role], **kwargs)
+
+    def patch(self, url, role='executive_producer', **kwargs):
+        return self.client().patch(url, headers=self.headers[role], **kwargs)
+
+    def delete(self, url, role='executive_producer', **kwargs):
+        return self.client().delete(url, headers=self.headers[role],
+                                    **kwargs)
+
+    def cast_pairs(self):
+        return sorted((cast.movie_id, cast.actor_id)
+                      for cast in Cast.query.all())
+
+    def seed_actors(self, count):
+        actors = [Actor(f'Actor {i}', 20 + i % 50, ['male', 'female'][i % 2])
+                  for i in range(count)]
+        db.session.add_all(actors)
+        db.session.commit()
+        return actors
+
+    def seed_movies(self, count):
+        start = datetime(2024, 3, 23, 7, 17, 59, 671000)
+        movies = [Movie(f'Movie {i}', start + timedelta(days=i))
+                  for i in range(count)]
+        db.session.add_all(movies)
+        db.session.commit()
+        return movies
+
+    def seed_casts(self, movies, actors):
+        casts = [Cast(movie.id, actor.id)
+                 for movie in movies for actor in actors]
+        db.session.add_all(casts)
+        db.session.commit()
+        return casts
+
+    def seed_catalog(self, movie_count, actor_count):
+        rows = {
+            Movie: [{'title': f'Movie {i}',
+                     'release_date': datetime(2024, 1, 1)}
+                    for i in range(movie_count)],
+            Actor: [{'name': f'Actor {i}', 'age': 30, 'gender': 'female'}
+                    for i in range(actor_count)],
+            Cast: [{'movie_id': movie_id, 'actor_id': actor_id}
+                   for movie_id in range(1, movie_count + 1)
+                   for actor_id in range(1, actor_count + 1)]
+        }
+        for model in (Movie, Actor, Cast):
+            if rows[model]:
+                db.session.execute(model.__table__.insert(), rows[model])
+        db.session.commit()
+        db.session.remove()
+
+    @contextmanager
+    def count_queries(self):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute',
+                     before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute',
+                         before_cursor_execute)
+
+    """
+    Pagination
+    """
+
+    def test_list_returns_default_page(self):
+        self.seed_actors(pagination.DEFAULT_PAGE_SIZE + 5)
+        res = self.get('/api/actors')
+        data = res.get_json()
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['actors']), pagination.DEFAULT_PAGE_SIZE)
+        self.assertIsNotNone(data['next_cursor'])
+
+    def test_cursor_walks_every_row_once(self):
+        self.seed_movies(25)
+        ids = []
+        url = '/api/movies?limit=10'
+        while True:
+            data = self.get(url).get_json()
+            ids.extend(movie['id'] for movie in data['movies'])
+            if data['next_cursor'] is None:
+                break
+            url = f'/api/movies?limit=10&cursor={data["next_cursor"]}'
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(ids), 25)
+        self.assertEqual(len(set(ids)), 25)
+
+    def test_limit_is_capped(self):
+        self.seed_actors(15)
+        default_max = pagination.MAX_PAGE_SIZE
+        pagination.MAX_PAGE_SIZE = 10
+        try:
+            data = self.get('/api/actors?limit=1000').get_json()
+        finally:
+            pagination.MAX_PAGE_SIZE = default_max
+        self.assertEqual(len(data['actors']), 10)
+
+    def test_casts_are_paginated(self):
+        self.seed_casts(self.seed_movies(3), self.seed_actors(3))
+        data = self.get('/api/casts?limit=5').get_json()
+        self.assertEqual(len(data['casts']), 5)
+        self.assertEqual(pagination.decode_cursor(data['next_cursor']),
+                         [2, 2])
+        data = self.get(
+            f'/api/casts?limit=5&cursor={data["next_cursor"]}').get_json()
+        self.assertEqual(len(data['casts']), 4)
+        self.assertIsNone(data['next_cursor'])
+
+    def test_invalid_page_arguments_400(self):
+        for query in ('limit=0', 'limit=abc', 'cursor=abc',
+                      'cursor=' + pagination.encode_cursor(['x'])):
+            res = self.get('/api/actors?' + query)
+            self.assertEqual(res.status_code, 400, query)
+            self.assertEqual(res.get_json()['success'], False)
+
+    """
+    Query counts
+    """
+
+    def test_cast_format_query_count_is_constant(self):
+        counts = []
+        for movie_count, actor_count in ((1, 1), (100, 100)):
+            db.drop_all()
+            db.create_all()
+            self.seed_catalog(movie_count, actor_count)
+            with self.count_queries() as statements:
+                casts = [cast.format()
+                         for cast in Cast.query_for_format().all()]
+            self.assertEqual(len(casts), movie_count * actor_count)
+            counts.append(len(statements))
+        self.assertEqual(counts, [1, 1])
+
+    def test_casts_page_query_count_is_constant(self):
+        counts = []
+        for movie_count, actor_count in ((1, 1), (100, 100)):
+            db.drop_all()
+            db.create_all()
+            self.seed_catalog(movie_count, actor_count)
+            with self.count_queries() as statements:
+                res = self.get(f'/api/casts?limit={pagination.MAX_PAGE_SIZE}')
+            self.assertEqual(res.status_code, 200)
+            counts.append(len(statements))
+        self.assertEqual(counts[0], counts[1])
+
+    """
+    Relationship loading
+    """
+
+    def test_short_listing_does_not_join_casts(self):
+        self.seed_catalog(5, 5)
+        with self.count_queries() as statements:
+            self.get('/api/actors')
+            self.get('/api/movies')
+        # a table version lookup and a SELECT per listing
+        self.assertEqual(len(statements), 4)
+        for statement in statements:
+            self.assertNotIn('JOIN', statement)
+
+    def test_expanded_listing_uses_one_batched_load(self):
+        self.seed_catalog(20, 30)
+        for url, key, nested, count in (
+                ('/api/actors?expand=movies', 'actors', 'movies', 20),
+                ('/api/movies?expand=actors', 'movies', 'actors', 30)):
+            with self.count_queries() as statements:
+                data = self.get(url).get_json()
+            self.assertEqual(len(statements), 3, url)
+            self.assertTrue(all(len(item[nested]) == count
+                                for item in data[key]), url)
+
+    def test_short_listing_reads_plain_rows(self):
+        self.seed_catalog(3, 3)
+        for url in ('/api/actors', '/api/movies?sort=-release_date'):
+            self.assertEqual(self.get(url).status_code, 200)
+            self.assertEqual(len(db.session.identity_map), 0, url)
+
+    def test_short_rows_match_short(self):
+        for name, age, gender in (('Zoë "Z" O\'Neil', 31, 'female'),
+                                  (None, None, None), ('Ōe\n', 0, '')):
+            Actor(name, age, gender).insert()
+        for release_date in (datetime(2024, 3, 23, 7, 17, 59, 671000),
+                             datetime(1999, 12, 31), datetime(2000, 1, 1,
+                                                              0, 0, 0, 1)):
+            Movie('Movie', release_date).insert()
+        for model in (Actor, Movie):
+            sort = model.id
+            self.assertEqual(
+                [model.short_row(row)
+                 for row in model.query_for_short().order_by(sort)],
+                [item.short() for item in model.query.order_by(sort)])
+
+    def seed_awkward_catalog(self):
+        actors = [Actor(name, age, gender) for name, age, gender in (
+            ('Zoë "Z" O\'Neil', 31, 'female'), (None, None, None),
+            ('Ōe\n\\', 0, ''))]
+        movies = [Movie(title, release_date) for title, release_date in (
+            ('Ünïcode ☃ 🎬', datetime(2024, 3, 23, 7, 17, 59, 671000)),
+            ('No cast', datetime(1999, 12, 31)),
+            ('Tab\there', datetime(2000, 1, 1, 0, 0, 0, 1)))]
+        db.session.add_all(actors + movies)
+        db.session.commit()
+        db.session.add_all([Cast(movies[0].id, actors[2].id),
+                            Cast(movies[0].id, actors[0].id),
+                            Cast(movies[2].id, actors[1].id)])
+        db.session.commit()
+
+    def test_database_documents_match_long(self):
+        self.seed_awkward_catalog()
+        for model, name in ((Actor, 'actors'), (Movie, 'movies')):
+            ids = [3, 1, 2]
+            expected = [db.session.get(model, id).long() for id in ids]
+            self.assertEqual(json.loads(documents.listing_documents(
+                db.session, name, ids)), expected)
+        self.assertEqual(documents.listing_documents(db.session, 'actors',
+                                                     []), '[]')
+
+    def test_database_documents_match_jsonify_bytes(self):
+        self.seed_awkward_catalog()
+        for url in ('/api/actors?expand=movies', '/api/movies?expand=actors',
+                    '/api/movies?expand=actors&limit=1'):
+            bodies = []
+            for builder in ('python', 'database'):
+                response_cache.response_cache.clear()
+                with mock.patch('app.EXPANDED_LISTING_JSON', builder):
+                    bodies.append(self.get(url).data)
+            self.assertEqual(bodies[0], bodies[1], url)
+            self.assertIn(b'\\u00dc', bodies[0], url)
+        self.assertEqual(documents.jsonify_layout(
+            '[{"id" : 1, "name" : "a , : b\\" é"}, \n {"id" : 2}]',
+            'postgresql'), '[{"id":1,"name":"a , : b\\" \\u00e9"},{"id":2}]')
+
+    def test_expanded_listing_built_by_the_database(self):
+        self.seed_awkward_catalog()
+        for url, model, key in (
+                ('/api/actors?expand=movies&sort=-name&limit=2', Actor,
+                 'actors'),
+                ('/api/movies?expand=actors&limit=2', Movie, 'movies')):
+            items, next_url = [], url
+            while next_url:
+                data = self.get(next_url).get_json()
+                items.extend(data[key])
+                next_url = data['next_cursor'] and (
+                    url + '&cursor=' + data['next_cursor'])
+            self.assertEqual(items, [db.session.get(model, item['id']).long()
+                                     for item in items], url)
+            self.assertEqual(len(items), 3, url)
+
+    def test_invalid_expand_400(self):
+        for url in ('/api/actors?expand=actors', '/api/movies?expand=casts',
+                    '/api/actors?expand='):
+            res = self.get(url)
+            self.assertEqual(res.status_code, 400, url)
+
+    """
+    Indexes
+    """
+
+    def query_plan(self, statement):
+        rows = db.session.execute(text('EXPLAIN QUERY PLAN ' + statement))
+        return ' '.join(row[-1] for row in rows)
+
+    def test_query_paths_use_indexes(self):
+        self.seed_catalog(5, 5)
+        for statement, index in (
+                ('SELECT movie_id FROM casts WHERE actor_id = 1',
+                 'COVERING INDEX ix_casts_actor_id_movie_id'),
+                ('SELECT actor_id FROM casts WHERE movie_id = 1',
+                 'USING PRIMARY KEY (movie_id=?)'),
+                ('SELECT id FROM movies ORDER BY release_date',
+                 'ix_movies_release_date'),
+                ("SELECT id FROM actors WHERE lower(name) = 'actor 1'",
+                 'ix_actors_lower_name')):
+            self.assertIn(index, self.query_plan(statement), statement)
+
+    """
+    NDJSON export
+    """
+
+    def read_ndjson(self, res):
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, streaming.NDJSON_MIMETYPE)
+        body = res.get_data(as_text=True)
+        self.assertTrue(body.endswith('\n'))
+        return [json.loads(line) for line in body.splitlines()]
+
+    def test_ndjson_export_streams_every_row(self):
+        self.seed_catalog(7, 3)
+        default_batch_size = streaming.EXPORT_BATCH_SIZE
+        streaming.EXPORT_BATCH_SIZE = 4
+        try:
+            movies = self.read_ndjson(self.get('/api/movies?format=ndjson'))
+            casts = self.read_ndjson(self.get(
+                '/api/casts',
+                headers={'Accept': streaming.NDJSON_MIMETYPE}))
+        finally:
+            streaming.EXPORT_BATCH_SIZE = default_batch_size
+        self.assertEqual([movie['id'] for movie in movies],
+                         list(range(1, 8)))
+        self.assertEqual(len(casts), 21)
+        self.assertEqual(casts[0]['actor'], {
+            'id': 1, 'name': 'Actor 0', 'age': 30, 'gender': 'female'})
+
+    def test_ndjson_export_matches_json_listing(self):
+        self.seed_catalog(3, 4)
+        listing = self.get('/api/actors?expand=movies').get_json()['actors']
+        exported = self.read_ndjson(
+            self.get('/api/actors?expand=movies&format=ndjson'))
+        self.assertEqual(exported, listing)
+
+    def test_ndjson_export_starts_after_cursor(self):
+        self.seed_catalog(1, 5)
+        cursor = pagination.encode_cursor([2])
+        actors = self.read_ndjson(
+            self.get(f'/api/actors?format=ndjson&cursor={cursor}'))
+        self.assertEqual([actor['id'] for actor in actors], [3, 4, 5])
+
+    def test_unknown_format_400(self):
+        res = self.get('/api/actors?format=xml')
+        self.assertEqual(res.status_code, 400)
+
+    """
+    Bulk creation
+    """
+
+    def test_bulk_create_actors(self):
+        actors = [{'name': f'Actor {i}', 'age': 20 + i, 'gender': 'female'}
+                  for i in range(5)]
+        res = self.post('/api/actors/bulk', json=actors)
+        data = res.get_json()
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['created'], 5)
+        created = {actor.id: actor.short() for actor in Actor.query.all()}
+        for id, actor in zip(data['ids'], actors):
+            self.assertEqual(created[id], dict(actor, id=id))
+
+    def test_bulk_create_movies(self):
+        movies = [{'title': 'Movie',
+                   'release_date': '2024-03-23T07:42:22.444000Z'},
+                  {'title': 'Movie 2',
+                   'release_date': '2024-03-23T09:42:22+02:00'}]
+        data = self.post('/api/movies/bulk', json=movies).get_json()
+        self.assertEqual(
+            [Movie.query.get(id).short()['release_date']
+             for id in data['ids']],
+            ['2024-03-23T07:42:22.444000Z', '2024-03-23T07:42:22.000000Z'])
+
+    def test_bulk_create_is_all_or_nothing(self):
+        actors = [{'name': 'Actor', 'age': 30, 'gender': 'male'},
+                  {'name': '', 'age': -1, 'gender': 'male'}]
+        res = self.post('/api/actors/bulk', json=actors)
+        data = res.get_json()
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['errors'], [
+            {'index': 1, 'errors': {'name': 'Expected a non-empty string',
+                                    'age': 'Expected a non-negative integer'}}
+        ])
+        self.assertEqual(Actor.query.count(), 0)
+
+    def test_bulk_create_partial(self):
+        movies = [{'title': 'Movie', 'release_date': 'yesterday'},
+                  {'title': 'Movie', 'release_date': '2024-03-23'}]
+        res = self.post('/api/movies/bulk?atomic=false', json=movies)
+        data = res.get_json()
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['created'], 1)
+        self.assertIsNone(data['ids'][0])
+        self.assertEqual(data['errors'][0]['index'], 0)
+        self.assertEqual(Movie.query.count(), 1)
+
+    def test_bulk_create_limits(self):
+        too_many = [{'name': 'Actor', 'age': 30, 'gender': 'male'}] * (
+            bulk.BULK_MAX_ITEMS + 1)
+        self.assertEqual(
+            self.post('/api/actors/bulk', json=too_many).status_code, 413)
+        self.assertEqual(
+            self.post('/api/actors/bulk', json={}).status_code, 400)
+        self.assertEqual(
+            self.post('/api/movies/bulk', role='casting_director',
+                      json=[]).status_code, 403)
+
+    """
+    Cast assignment
+    """
+
+    def test_add_movie_actors_ignores_duplicates(self):
+        self.seed_catalog(2, 0)
+        self.seed_actors(4)
+        data = self.post('/api/movies/1/actors', json=[1, 2]).get_json()
+        self.assertEqual((data['added'], data['removed']), (2, 0))
+        data = self.post('/api/movies/1/actors', json=[2, 3, 3]).get_json()
+        self.assertEqual((data['added'], data['removed']), (1, 0))
+        self.assertEqual(self.cast_pairs(), [(1, 1), (1, 2), (1, 3)])
+
+    def test_replace_movie_actors(self):
+        self.seed_catalog(2, 4)
+        data = self.put('/api/movies/1/actors', json=[2, 4]).get_json()
+        self.assertEqual((data['added'], data['removed']), (0, 2))
+        data = self.put('/api/movies/1/actors', json=[]).get_json()
+        self.assertEqual((data['added'], data['removed']), (0, 2))
+        self.assertEqual(self.cast_pairs(),
+                         [(2, 1), (2, 2), (2, 3), (2, 4)])
+
+    def test_replace_actor_movies(self):
+        self.seed_catalog(3, 2)
+        data = self.put('/api/actors/1/movies', role='casting_director',
+                        json=[3]).get_json()
+        self.assertEqual((data['actor_id'], data['added'], data['removed']),
+                         (1, 0, 2))
+        data = self.post('/api/actors/2/movies', role='casting_director',
+                         json=[1, 2, 3]).get_json()
+        self.assertEqual(data['added'], 0)
+        self.assertEqual(self.cast_pairs(), [(1, 2), (2, 2), (3, 1), (3, 2)])
+
+    def test_cast_assignment_errors(self):
+        self.seed_catalog(1, 2)
+        res = self.post('/api/movies/1/actors', json=[1, 5, 6])
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(res.get_json()['unknown_ids'], [5, 6])
+        self.assertEqual(len(self.cast_pairs()), 2)
+        self.assertEqual(
+            self.post('/api/movies/9/actors', json=[1]).status_code, 404)
+        self.assertEqual(
+            self.put('/api/movies/1/actors', json=['1']).status_code, 400)
+        self.assertEqual(
+            self.put('/api/movies/1/actors', role='casting_assistant',
+                     json=[1]).status_code, 403)
+
+    """
+    Filtering and sorting
+    """
+
+    def list_ids(self, url, key):
+        data = self.get(url).get_json()
+        return [item['id'] for item in data[key]]
+
+    def walk_pages(self, url, key):
+        ids, cursor = [], None
+        while True:
+            page_url = url + (f'&cursor={cursor}' if cursor else '')
+            data = self.get(page_url).get_json()
+            ids.extend(item['id'] for item in data[key])
+            cursor = data['next_cursor']
+            if cursor is None:
+                return ids
+
+    def test_actor_filters(self):
+        self.seed_actors(10)
+        self.assertEqual(self.list_ids('/api/actors?gender=female', 'actors'),
+                         [2, 4, 6, 8, 10])
+        self.assertEqual(
+            self.list_ids('/api/actors?age_min=22&age_max=24', 'actors'),
+            [3, 4, 5])
+        self.assertEqual(
+            self.list_ids('/api/actors?ids=9,2,5&gender=male', 'actors'),
+            [5, 9])
+        self.assertEqual(
+            self.list_ids('/api/actors?name_prefix=aCTOR%201', 'actors'),
+            [2])
+
+    def test_movie_filters(self):
+        self.seed_movies(5)
+        self.assertEqual(self.list_ids(
+            '/api/movies?released_after=2024-03-24T07:17:59.671Z'
+            '&released_before=2024-03-26', 'movies'), [2, 3])
+        self.assertEqual(self.list_ids(
+            '/api/movies?released_after=2024-03-25T09:17:59.671%2B02:00',
+            'movies'), [3, 4, 5])
+
+    def test_cast_filters_and_sorts(self):
+        self.seed_catalog(3, 3)
+        data = self.get('/api/casts?actor_id=2').get_json()
+        self.assertEqual([(cast['movie_id'], cast['actor_id'])
+                          for cast in data['casts']], [(1, 2), (2, 2), (3, 2)])
+        data = self.get('/api/casts?sort=-actor_id&limit=4').get_json()
+        self.assertEqual([(cast['movie_id'], cast['actor_id'])
+                          for cast in data['casts']],
+                         [(3, 3), (2, 3), (1, 3), (3, 2)])
+
+    def test_sorted_pages_follow_the_sort(self):
+        self.seed_movies(7)
+        for movie in Movie.query.filter(Movie.id.in_([2, 5])):
+            movie.release_date = datetime(2030, 1, 1)
+        db.session.commit()
+        self.assertEqual(
+            self.walk_pages('/api/movies?sort=release_date&limit=2', 'movies'),
+            [1, 3, 4, 6, 7, 2, 5])
+        self.assertEqual(
+            self.walk_pages('/api/movies?sort=-release_date&limit=3',
+                            'movies'),
+            [5, 2, 7, 6, 4, 3, 1])
+        self.assertEqual(self.walk_pages('/api/movies?sort=-id&limit=3',
+                                         'movies'),
+                         [7, 6, 5, 4, 3, 2, 1])
+
+    def test_null_values_sort_last(self):
+        self.seed_actors(5)
+        for name, id in (('b', 1), (None, 2), ('A', 3), (None, 4), ('a', 5)):
+            db.session.get(Actor, id).name = name
+        db.session.commit()
+        for limit in (1, 2, 10):
+            self.assertEqual(self.walk_pages(
+                f'/api/actors?sort=name&limit={limit}', 'actors'),
+                [3, 5, 1, 2, 4])
+            self.assertEqual(self.walk_pages(
+                f'/api/actors?sort=-name&limit={limit}', 'actors'),
+                [4, 2, 1, 5, 3])
+        body = self.get('/api/actors?sort=name&format=ndjson',
+                        headers={}).get_data(as_text=True)
+        self.assertEqual([json.loads(line)['id']
+                          for line in body.splitlines()], [3, 5, 1, 2, 4])
+
+    def test_invalid_filters_400_before_any_query(self):
+        for url in ('/api/actors?age_min=-1', '/api/actors?age=3',
+                    '/api/actors?name_prefix=', '/api/actors?ids=1,x',
+                    '/api/actors?sort=age', '/api/movies?sort=title',
+                    '/api/movies?released_after=yesterday',
+                    '/api/movies?sort=release_date&cursor=' +
+                    pagination.encode_cursor(['x', 1]),
+                    '/api/casts?actor_id=a', '/api/casts?sort=id',
+                    '/api/actors?expand=casts', '/api/actors?limit=0',
+                    '/api/search?q=', '/api/search?q=act&cursor=x'):
+            with self.count_queries() as statements:
+                res = self.get(url)
+            self.assertEqual(res.status_code, 400, url)
+            self.assertEqual(statements, [], url)
+
+    def test_too_many_ids_400(self):
+        ids = ','.join(str(id) for id in range(filters.MAX_FILTER_IDS + 1))
+        self.assertEqual(self.get('/api/actors?ids=' + ids).status_code, 400)
+
+    def test_filters_use_indexes(self):
+        for query, index in (
+                (Actor.query.filter(
+                    filters.name_prefix_clause(Actor.name, 'Ab')),
+                 'ix_actors_lower_name'),
+                (filters.ACTOR_SORTS['name'].query(Actor.query, ['ab', 3]),
+                 'ix_actors_lower_name'),
+                (Movie.query.filter(
+                    filters.MOVIE_FILTERS['released_after'][1](
+                        datetime(2024, 1, 1))),
+                 'ix_movies_release_date'),
+                (Cast.query.filter(filters.CAST_FILTERS['actor_id'][1](1)),
+                 'ix_casts_actor_id_movie_id')):
+            statement = str(query.statement.compile(
+                db.engine, compile_kwargs={'literal_binds': True}))
+            self.assertIn(index, self.query_plan(statement), statement)
+
+    """
+    Search
+    """
+
+    def search(self, q, **kwargs):
+        res = self.get('/api/search', query_string=dict(q=q, **kwargs))
+        self.assertEqual(res.status_code, 200)
+        return res.get_json()
+
+    def hit_names(self, data):
+        return [hit[hit['type']].get('name') or hit[hit['type']]['title']
+                for hit in data['results']]
+
+    def test_search_matches_word_prefixes(self):
+        for name in ('Anna Karina', 'Karl Malden', 'Ann Sothern'):
+            Actor(name, 40, 'female').insert()
+        Movie('Anna and the King', datetime(1999, 12, 17)).insert()
+        self.assertEqual(sorted(self.hit_names(self.search('ann'))),
+                         ['Ann Sothern', 'Anna Karina', 'Anna and the King'])
+        self.assertEqual(self.hit_names(self.search('KAR ann')),
+                         ['Anna Karina'])
+        data = self.search('king')
+        self.assertEqual(data['results'][0]['type'], 'movie')
+        self.assertEqual(data['results'][0]['movie']['id'], 1)
+        self.assertEqual(self.search('zzz')['results'], [])
+
+    def test_search_ranks_closer_matches_first(self):
+        Movie('The Long Goodbye and Other Stories of the City',
+              datetime(2000, 1, 1)).insert()
+        Movie('Goodbye', datetime(2000, 1, 1)).insert()
+        self.assertEqual(self.hit_names(self.search('goodbye')),
+                         ['Goodbye',
+                          'The Long Goodbye and Other Stories of the City'])
+
+    def test_search_is_paginated(self):
+        self.post('/api/actors/bulk', json=[
+            {'name': f'Mira {i}', 'age': 30, 'gender': 'female'}
+            for i in range(7)])
+        names, cursor = [], None
+        while True:
+            data = self.search('mira', limit=3,
+                               **({'cursor': cursor} if cursor else {}))
+            self.assertLessEqual(len(data['results']), 3)
+            names.extend(self.hit_names(data))
+            cursor = data['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(sorted(names), [f'Mira {i}' for i in range(7)])
+
+    def test_search_ranks_every_match(self):
+        self.post('/api/actors/bulk', json=[
+            {'name': f'Mira Lo {i}', 'age': 30, 'gender': 'female'}
+            for i in range(600)])
+        Actor('Mira', 40, 'female').insert()
+        data = self.search('mir', limit=1)
+        self.assertEqual(data['results'][0]['actor']['id'], 601)
+        self.assertEqual(self.hit_names(self.search(
+            'mir', limit=1, cursor=data['next_cursor'])), ['Mira Lo 0'])
+
+    def test_search_index_follows_model_changes(self):
+        actor = Actor('Gena Rowlands', 60, 'female')
+        actor.insert()
+        actor.name = 'Gena Marlowe'
+        actor.update()
+        self.assertEqual(self.search('rowlands')['results'], [])
+        self.assertEqual(self.hit_names(self.search('marl')),
+                         ['Gena Marlowe'])
+        actor.delete()
+        self.assertEqual(self.search('gena')['results'], [])
+
+    def test_postgresql_search_pages_through_tied_ranks(self):
+        # ts_rank returns a real; PostgreSQL sends a real as its shortest
+        # text, which is not the value it compares with, and a double
+        # precision exactly
+        def real(value):
+            return struct.unpack('f', struct.pack('f', value))[0]
+
+        def sent(value, sql):
+            if 'AS double precision' in sql:
+                return value
+            return next(float(f'{value:.{digits}g}') for digits in
+                        range(1, 10)
+                        if real(float(f'{value:.{digits}g}')) == value)
+
+        rank = real(-0.0607927)
+        hits = sorted([(rank, 'actor', id) for id in range(1, 6)] +
+                      [(rank, 'movie', id) for id in range(1, 4)] +
+                      [(real(-0.1), 'movie', 9)])
+
+        def execute(statement, params):
+            sql, rows = str(statement), hits
+            if 'rank' in params:
+                rows = [hit for hit in hits if hit >
+                        (params['rank'], params['kind'], params['id'])]
+            return mock.Mock(fetchall=lambda: [
+                (kind, id, sent(value, sql))
+                for value, kind, id in rows[:params['limit']]])
+
+        session = mock.Mock(execute=execute)
+        session.connection.return_value.dialect.name = 'postgresql'
+        found, cursor = [], None
+        for _ in range(len(hits)):
+            page, next_cursor = search.search_page(session, ['act'], 3,
+                                                   cursor)
+            found.extend(page)
+            if next_cursor is None:
+                break
+            cursor = pagination.decode_cursor(next_cursor)
+        self.assertEqual(found, [(kind, id) for _, kind, id in hits])
+
+    def test_invalid_search_400(self):
+        for query_string in ({}, {'q': ' -- '}, {'q': 'abc ' * 9},
+                             {'q': 'an'}, {'q': 'to ha'},
+                             {'q': 'act', 'cursor': pagination.encode_cursor(
+                                 ['x', 'actor', 1])}):
+            res = self.get('/api/search', query_string=query_string)
+            self.assertEqual(res.status_code, 400, query_string)
+
+    """
+    Legacy cast ids
+    """
+
+    def seed_legacy_ids(self):
+        self.seed_catalog(2, 2)
+        db.session.execute(cast_legacy_ids.insert(), [
+            {'id': 10, 'movie_id': 1, 'actor_id': 1},
+            {'id': 11, 'movie_id': 2, 'actor_id': 2}])
+        db.session.commit()
+
+    def test_update_cast_by_legacy_id(self):
+        self.seed_legacy_ids()
+        self.assertEqual(Cast.query.filter_by(movie_id=1).delete(), 2)
+        db.session.commit()
+        res = self.patch('/api/casts/11', role='casting_director',
+                         json={'movie_id': 1, 'actor_id': 1})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(self.cast_pairs(), [(1, 1), (2, 1)])
+        self.assertEqual(
+            db.session.execute(cast_legacy_ids.select()).fetchall(),
+            [(11, 1, 1)])
+        self.assertEqual(Cast.get_by_legacy_id(11).format()['actor_id'], 1)
+
+    def test_delete_cast_by_legacy_id(self):
+        self.seed_legacy_ids()
+        res = self.delete('/api/casts/10', role='casting_director')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.get_json()['cast']['movie_id'], 1)
+        self.assertEqual(self.cast_pairs(), [(1, 2), (2, 1), (2, 2)])
+        self.assertIsNone(Cast.get_by_legacy_id(10))
+
+    def test_legacy_id_errors(self):
+        self.seed_legacy_ids()
+        self.assertEqual(self.delete('/api/casts/12').status_code, 404)
+        self.assertEqual(
+            self.delete('/api/casts/10', role='casting_assistant').status_code,
+            403)
+        self.assertEqual(
+            self.patch('/api/casts/10',
+                       json={'movie_id': 2, 'actor_id': 2}).status_code, 400)
+        self.assertEqual(len(self.cast_pairs()), 4)
+
+    """
+    Response cache
+    """
+
+    def test_repeated_listing_is_served_from_cache(self):
+        self.seed_actors(3)
+        first = self.get('/api/actors?limit=2&sort=name')
+        self.assertEqual(first.headers['X-Cache'], 'MISS')
+        with self.count_queries() as statements:
+            second = self.get('/api/actors?sort=name&limit=2')
+        self.assertEqual(second.headers['X-Cache'], 'HIT')
+        self.assertEqual(len(statements), 1)
+        self.assertIn('table_versions', statements[0])
+        self.assertEqual(second.get_data(), first.get_data())
+        self.assertEqual(second.mimetype, 'application/json')
+
+    def test_cache_is_keyed_by_permissions(self):
+        self.seed_actors(1)
+        self.get('/api/actors')
+        res = self.get('/api/actors', role='casting_director')
+        self.assertEqual(res.headers['X-Cache'], 'MISS')
+
+    def test_writes_invalidate_cached_listings(self):
+        self.seed_actors(1)
+        self.get('/api/actors')
+        self.post('/api/actors', json={'name': 'New', 'age': 30,
+                                       'gender': 'female'})
+        res = self.get('/api/actors')
+        self.assertEqual(res.headers['X-Cache'], 'MISS')
+        self.assertEqual(len(res.get_json()['actors']), 2)
+
+        # raw SQL through the session is seen as well
+        db.session.execute(text("UPDATE actors SET name = 'Renamed'"))
+        db.session.commit()
+        res = self.get('/api/actors')
+        self.assertEqual(res.headers['X-Cache'], 'MISS')
+        self.assertEqual({actor['name'] for actor in res.get_json()['actors']},
+                         {'Renamed'})
+
+    def test_expanded_listing_follows_casts(self):
+        movies = self.seed_movies(1)
+        actors = self.seed_actors(1)
+        self.get('/api/actors?expand=movies')
+        self.assertEqual(self.get('/api/actors').headers['X-Cache'], 'MISS')
+        self.seed_casts(movies, actors)
+        self.assertEqual(self.get('/api/actors').headers['X-Cache'], 'HIT')
+        res = self.get('/api/actors?expand=movies')
+        self.assertEqual(res.headers['X-Cache'], 'MISS')
+        self.assertEqual(len(res.get_json()['actors'][0]['movies']), 1)
+
+    def test_rolled_back_writes_keep_the_cache(self):
+        self.seed_actors(1)
+        self.get('/api/actors')
+        db.session.execute(text("DELETE FROM actors"))
+        db.session.rollback()
+        self.assertEqual(self.get('/api/actors').headers['X-Cache'], 'HIT')
+
+    def test_errors_and_exports_are_not_cached(self):
+        self.assertEqual(self.get('/api/actors?limit=x').status_code, 400)
+        self.assertNotIn('X-Cache',
+                         self.get('/api/actors?limit=x').headers)
+        self.assertNotIn('X-Cache',
+                         self.get('/api/actors?format=ndjson').headers)
+
+    def test_response_cache_evicts_and_expires(self):
+        now = [0.0]
+        cache = response_cache.ResponseCache(max_entries=2, max_bytes=10,
+                                             ttl=5, clock=lambda: now[0])
+        cache.put('a', (1,), b'aaaa')
+        cache.put('b', (1,), b'bbbb')
+        cache.put('c', (1,), b'cccc')
+        self.assertIsNone(cache.get('a', (1,)))
+        self.assertEqual(cache.get('b', (1,)), b'bbbb')
+        cache.put('d', (1,), b'dddd')
+        self.assertIsNone(cache.get('c', (1,)))
+        self.assertIsNone(cache.get('b', (2,)))
+        now[0] = 5
+        self.assertIsNone(cache.get('d', (1,)))
+        cache.put('e', (1,), b'x' * 11)
+        self.assertEqual(cache.stats(), {
+            'entries': 0, 'bytes': 0, 'hits': 1, 'misses': 4,
+            'evictions': 2, 'expirations': 1, 'invalidations': 1,
+            'hit_rate': 0.2})
+
+    """
+    Conditional GET
+    """
+
+    def test_matching_etag_is_answered_with_304(self):
+        self.seed_actors(2)
+        res = self.get('/api/actors')
+        etag = res.headers['ETag']
+        with self.count_queries() as statements:
+            res = self.get('/api/actors', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.get_data(), b'')
+        self.assertEqual(res.headers['ETag'], etag)
+        self.assertEqual(len(statements), 1)
+        self.assertIn('table_versions', statements[0])
+
+    def test_etag_depends_on_the_request(self):
+        self.seed_actors(2)
+        etags = {self.get(url).headers['ETag']
+                 for url in ('/api/actors', '/api/actors?limit=1',
+                             '/api/actors?format=ndjson', '/api/movies')}
+        self.assertEqual(len(etags), 4)
+        self.assertEqual(self.get('/api/actors?limit=1').headers['ETag'],
+                         self.get('/api/actors?limit=1',
+                                  role='executive_producer').headers['ETag'])
+
+    def test_writes_change_the_etag(self):
+        movies = self.seed_movies(1)
+        actors = self.seed_actors(1)
+        etag = self.get('/api/casts').headers['ETag']
+        self.seed_casts(movies, actors)
+        res = self.get('/api/casts', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+        # writes that bypass SQLAlchemy, as from another worker, too
+        etag = self.get('/api/movies').headers['ETag']
+        db.session.remove()
+        connection = db.engine.raw_connection()
+        connection.execute("UPDATE movies SET title = 'Renamed'")
+        connection.commit()
+        res = self.get('/api/movies', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.get_json()['movies'][0]['title'], 'Renamed')
+
+    def test_versions_restart_above_earlier_versions(self):
+        self.seed_actors(1)
+        before = versions.read_versions(db.session, ('actors',))
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        self.seed_actors(1)
+        self.assertGreater(versions.read_versions(db.session, ('actors',)),
+                           before)
+
+    def test_missing_versions_fail_loudly(self):
+        with db.engine.connect() as connection:
+            versions.check_versions(connection)
+        db.session.execute(text('DROP TRIGGER actors_version_update'))
+        db.session.commit()
+        with db.engine.connect() as connection:
+            with self.assertRaises(versions.VersionsError):
+                versions.check_versions(connection)
+        with self.assertRaises(versions.VersionsError):
+            warmup.warm_up(self.app)
+
+        db.session.execute(text(
+            "DELETE FROM table_versions WHERE table_name = 'movies'"))
+        db.session.commit()
+        with self.assertRaises(versions.VersionsError):
+            versions.read_versions(db.session, ('actors', 'movies'))
+
+    """
+    Compression
+    """
+
+    def test_large_json_is_gzipped(self):
+        self.seed_catalog(0, 50)
+        plain = self.get('/api/actors')
+        res = self.get('/api/actors', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', res.headers['Vary'])
+        self.assertEqual(gzip.decompress(res.get_data()), plain.get_data())
+        self.assertLess(int(res.headers['Content-Length']),
+                        len(plain.get_data()) / 4)
+
+        etag = res.headers['ETag']
+        self.assertTrue(etag.startswith('W/'))
+        res = self.get('/api/actors', headers={'Accept-Encoding': 'gzip',
+                                               'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+
+    def test_small_and_unwanted_bodies_are_not_compressed(self):
+        self.seed_catalog(0, 1)
+        for headers in ({'Accept-Encoding': 'gzip'},
+                        {'Accept-Encoding': 'identity'},
+                        {'Accept-Encoding': 'gzip;q=0'}, {}):
+            res = self.get('/api/actors?limit=1', headers=headers)
+            self.assertNotIn('Content-Encoding', res.headers, headers)
+            self.assertEqual(res.get_json()['actors'][0]['id'], 1)
+
+    @unittest.skipIf(compression.brotli is None, 'brotli is not installed')
+    def test_brotli_is_preferred_when_accepted(self):
+        self.seed_catalog(0, 50)
+        plain = self.get('/api/actors').get_data()
+        res = self.get('/api/actors',
+                       headers={'Accept-Encoding': 'gzip, deflate, br'})
+        self.assertEqual(res.headers['Content-Encoding'], 'br')
+        self.assertEqual(compression.brotli.decompress(res.get_data()), plain)
+        res = self.get('/api/actors',
+                       headers={'Accept-Encoding': 'gzip;q=1, br;q=0.5'})
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+
+    def test_ndjson_export_is_compressed_chunk_by_chunk(self):
+        self.seed_catalog(0, 30)
+        plain = self.get('/api/actors?format=ndjson').get_data()
+        default_batch_size = streaming.EXPORT_BATCH_SIZE
+        streaming.EXPORT_BATCH_SIZE = 4
+        try:
+            res = self.get('/api/actors?format=ndjson', buffered=False,
+                           headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+            self.assertNotIn('Content-Length', res.headers)
+            decompressor = zlib.decompressobj(31)
+            lines = []
+            for chunk in res.response:
+                # every chunk decodes to whole lines on arrival
+                text = decompressor.decompress(chunk).decode('utf-8')
+                self.assertTrue(text == '' or text.endswith('\n'))
+                lines.append(text)
+            res.close()
+        finally:
+            streaming.EXPORT_BATCH_SIZE = default_batch_size
+        self.assertEqual(''.join(lines).encode('utf-8'), plain)
+
+    """
+    Engine and pool settings
+    """
+
+    def test_engine_options_from_config_and_environment(self):
+        os.environ['DB_POOL_SIZE'] = '12'
+        try:
+            options = engine.engine_options(
+                'postgresql://capstone@localhost/capstone',
+                {'DB_MAX_OVERFLOW': '3', 'DB_STATEMENT_TIMEOUT': 5000,
+                 'DB_POOL_PRE_PING': 'false'})
+        finally:
+            del os.environ['DB_POOL_SIZE']
+        self.assertEqual(options, {
+            'poolclass': engine.MeteredQueuePool, 'pool_size': 12,
+            'max_overflow': 3, 'pool_timeout': 30, 'pool_recycle': 1800,
+            'pool_pre_ping': False,
+            'connect_args': {'options': '-c statement_timeout=5000'}})
+        self.assertEqual(engine.engine_options('sqlite://', {}),
+                         {'pool_pre_ping': True, 'pool_recycle': 1800})
+
+    def test_engine_options_for_asyncio_drivers(self):
+        options = engine.engine_options(
+            'postgresql+asyncpg://capstone@localhost/capstone',
+            {'DB_STATEMENT_TIMEOUT': 5000})
+        self.assertIs(options['poolclass'],
+                      engine.MeteredAsyncAdaptedQueuePool)
+        self.assertEqual(options['connect_args'], {
+            'server_settings': {'statement_timeout': '5000'}})
+
+    def test_pool_stats_count_checkouts_and_timeouts(self):
+        pool_engine = create_engine(
+            'sqlite:///' + os.path.join(self.tmpdir, 'pool.db'),
+            poolclass=engine.MeteredQueuePool, pool_size=1, max_overflow=0,
+            pool_timeout=0.01)
+        try:
+            with pool_engine.connect():
+                self.assertEqual(engine.pool_stats(pool_engine)[
+                    'checked_out'], 1)
+                with self.assertRaises(exc.TimeoutError):
+                    pool_engine.connect()
+            stats = engine.pool_stats(pool_engine)
+        finally:
+            pool_engine.dispose()
+        self.assertEqual(stats['pool'], 'MeteredQueuePool')
+        self.assertEqual((stats['size'], stats['checked_in'],
+                          stats['checked_out'], stats['overflow']),
+                         (1, 1, 0, 0))
+        self.assertEqual((stats['checkouts'], stats['timeouts']), (1, 1))
+        self.assertGreaterEqual(stats['wait_seconds_max'], 0.01)
+
+    """
+    Read replicas
+    """
+
+    @contextmanager
+    def replica_app(self, replica_url):
+        primary_url = 'sqlite:///' + os.path.join(self.tmpdir, 'primary.db')
+        app = create_app()
+        app.config['DATABASE_REPLICA_URLS'] = replica_url
+        db.session.remove()
+        setup_db(app, primary_url)
+        response_cache.response_cache.clear()
+        try:
+            with app.app_context():
+                db.drop_all()
+                db.create_all()
+                Actor('Primary actor', 40, 'female').insert()
+                yield app
+                db.session.remove()
+                db.drop_all()
+        finally:
+            db.session.remove()
+            replica_set = app.extensions.get('replicas')
+            if replica_set is not None:
+                replica_set.dispose()
+            db.get_engine(app).dispose()
+            db.app = self.app
+            response_cache.response_cache.clear()
+
+    def actor_names(self, client, role='casting_assistant'):
+        res = client.get('/api/actors', headers=self.headers[role])
+        self.assertEqual(res.status_code, 200)
+        return [actor['name'] for actor in json.loads(res.data)['actors']]
+
+    def test_reads_go_to_replica_and_writes_to_primary(self):
+        replica_url = 'sqlite:///' + os.path.join(self.tmpdir, 'replica.db')
+        replica_engine = create_engine(replica_url)
+        db.Model.metadata.drop_all(replica_engine)
+        db.Model.metadata.create_all(replica_engine)
+        with replica_engine.begin() as connection:
+            connection.execute(Actor.__table__.insert(), {
+                'name': 'Replica actor', 'age': 50, 'gender': 'male'})
+
+        try:
+            with self.replica_app(replica_url) as app:
+                writer = app.test_client()
+                reader = app.test_client()
+                self.assertEqual(self.actor_names(writer), ['Replica actor'])
+
+                res = writer.post('/api/actors', json={
+                    'name': 'New actor', 'age': 30, 'gender': 'female'},
+                    headers=self.headers['executive_producer'])
+                self.assertEqual(res.status_code, 200)
+                self.assertIn(replicas.STICKY_COOKIE,
+                              res.headers['Set-Cookie'])
+                self.assertEqual(Actor.query.count(), 2)
+
+                # the writer reads its write back from the primary, by
+                # cookie and by token; everyone else keeps the replica
+                self.assertEqual(self.actor_names(writer),
+                                 ['Primary actor', 'New actor'])
+                self.assertEqual(
+                    self.actor_names(reader, role='executive_producer'),
+                    ['Primary actor', 'New actor'])
+                self.assertEqual(self.actor_names(reader), ['Replica actor'])
+        finally:
+            replica_engine.dispose()
+
+    def test_reads_fall_back_to_primary_without_healthy_replica(self):
+        missing = os.path.join(self.tmpdir, 'missing', 'replica.db')
+        with self.replica_app('sqlite:///' + missing) as app:
+            self.assertEqual(self.actor_names(app.test_client()),
+                             ['Primary actor'])
+            replica = app.extensions['replicas'].replicas[0]
+            self.assertFalse(replica.healthy)
+
+    def test_replica_set_round_robin_and_write_window(self):
+        now = [1000.0]
+        urls = ['sqlite:///' + os.path.join(self.tmpdir, name)
+                for name in ('one.db', 'two.db', 'missing/three.db')]
+        replica_set = replicas.ReplicaSet(urls, check_interval=10,
+                                          sticky_seconds=5,
+                                          clock=lambda: now[0])
+        try:
+            one, two, three = (replica.engine
+                               for replica in replica_set.replicas)
+            self.assertEqual([replica_set.pick() for _ in range(4)],
+                             [one, two, one, one])
+
+            until = replica_set.remember_write('Bearer token')
+            self.assertEqual(until, 1005.0)
+            self.assertTrue(replica_set.wrote_recently('Bearer token'))
+            self.assertTrue(replica_set.wrote_recently(None, '1005.000'))
+            self.assertFalse(replica_set.wrote_recently('Bearer other'))
+            self.assertFalse(replica_set.wrote_recently(None, 'garbage'))
+            now[0] += 5
+            self.assertFalse(replica_set.wrote_recently('Bearer token'))
+            self.assertFalse(replica_set.wrote_recently(None, '1005.000'))
+        finally:
+            replica_set.dispose()
+
+    """
+    ASGI serving
+    """
+
+    def asgi_request(self, method, url, headers=None, body=b''):
+        path, _, query = url.partition('?')
+        scope = {
+            'type': 'http', 'http_version': '1.1', 'method': method,
+            'scheme': 'http', 'path': path, 'root_path': '',
+            'query_string': query.encode('ascii'),
+            'headers': [(name.lower().encode('latin-1'),
+                         value.encode('latin-1'))
+                        for name, value in (headers or {}).items()],
+            'server': ('localhost', 80), 'client': ('127.0.0.1', 50000)
+        }
+        requests = [{'type': 'http.request', 'body': body[:5],
+                     'more_body': True},
+                    {'type': 'http.request', 'body': body[5:],
+                     'more_body': False}]
+        messages = []
+
+        async def receive():
+            return requests.pop(0)
+
+        async def send(message):
+            messages.append(message)
+
+        asyncio.run(asgi.ASGIApp(self.app)(scope, receive, send))
+        start, chunks = messages[0], messages[1:]
+        self.assertEqual(start['type'], 'http.response.start')
+        self.assertEqual([chunk['more_body'] for chunk in chunks],
+                         [True] * (len(chunks) - 1) + [False])
+        return (start['status'], dict(start['headers']),
+                b''.join(chunk['body'] for chunk in chunks), len(chunks))
+
+    def test_asgi_app_serves_same_responses(self):
+        self.seed_actors(3)
+        body = json.dumps({'name': 'New', 'age': 33, 'gender': 'male'})
+        cases = [
+            ('GET', '/api/actors?limit=2', 'casting_assistant', None),
+            ('GET', '/api/actors?limit=abc', 'casting_assistant', None),
+            ('GET', '/api/actors', None, None),
+            ('DELETE', '/api/actors/999', 'executive_producer', None),
+            ('POST', '/api/actors', 'executive_producer', body)
+        ]
+        for method, url, role, data in cases:
+            headers = dict(self.headers[role]) if role else {}
+            if data is not None:
+                headers['Content-Type'] = 'application/json'
+            status, _, asgi_body, _ = self.asgi_request(
+                method, url, headers, (data or '').encode('utf-8'))
+            if method == 'POST':
+                self.assertEqual(Actor.query.filter_by(name='New').count(),
+                                 1)
+                self.assertEqual(status, 200)
+                self.assertEqual(json.loads(asgi_body)['success'], True)
+                continue
+            res = self.client().open(url, method=method, headers=headers)
+            self.assertEqual((status, json.loads(asgi_body)),
+                             (res.status_code, json.loads(res.data)), url)
+
+    def test_asgi_app_streams_ndjson_export(self):
+        self.seed_actors(5)
+        default_batch_size = streaming.EXPORT_BATCH_SIZE
+        streaming.EXPORT_BATCH_SIZE = 2
+        try:
+            status, headers, body, chunks = self.asgi_request(
+                'GET', '/api/actors?format=ndjson',
+                self.headers['casting_assistant'])
+        finally:
+            streaming.EXPORT_BATCH_SIZE = default_batch_size
+        self.assertEqual(status, 200)
+        self.assertEqual(headers[b'content-type'], b'application/x-ndjson')
+        self.assertGreater(chunks, 2)
+        self.assertEqual(len(body.splitlines()), 5)
+
+    def test_asgi_lifespan_warms_up_before_startup_completes(self):
+        refreshes = auth.jwks_store.refreshes
+
+        def failing_warm_up():
+            raise RuntimeError('database unreachable')
+
+        for on_startup, added in ((partial(warmup.warm_up, self.app), 1),
+                                  (failing_warm_up, 0)):
+            messages = [{'type': 'lifespan.startup'},
+                        {'type': 'lifespan.shutdown'}]
+            sent = []
+
+            async def receive():
+                return messages.pop(0)
+
+            async def send(message):
+                sent.append(message['type'])
+
+            asyncio.run(asgi.ASGIApp(self.app, on_startup)(
+                {'type': 'lifespan'}, receive, send))
+            self.assertEqual(sent, ['lifespan.startup.complete',
+                                    'lifespan.shutdown.complete'])
+            self.assertEqual(auth.jwks_store.refreshes, refreshes + added)
+            refreshes = auth.jwks_store.refreshes
+
+    """
+    Worker lifecycle
+    """
+
+    def test_warm_up_opens_connections_and_fetches_keys(self):
+        refreshes = auth.jwks_store.refreshes
+        timings = warmup.warm_up(self.app, connections=2)
+        self.assertEqual(set(timings),
+                         {'mappers', 'connections', 'versions', 'jwks'})
+        self.assertEqual(auth.jwks_store.refreshes, refreshes + 1)
+
+    def test_failed_warm_up_does_not_delay_the_first_request(self):
+        jwks_path = os.path.join(self.tmpdir, 'late-jwks.json')
+        default_store = auth.jwks_store
+        auth.jwks_store = JWKSKeyStore(
+            'file://' + jwks_path, key_loader=auth.jwt_backend.load_key)
+        try:
+            with self.assertRaises(RuntimeError):
+                warmup.warm_up(self.app)
+            self.idp.write_jwks(jwks_path)
+            auth.token_cache.clear()
+            self.assertEqual(self.get('/api/actors').status_code, 200)
+            self.assertEqual(auth.jwks_store.refreshes, 1)
+        finally:
+            auth.jwks_store = default_store
+
+    def test_reset_pools_replaces_the_pool(self):
+        pool = db.get_engine(self.app).pool
+        warmup.reset_pools(self.app)
+        self.assertIsNot(db.get_engine(self.app).pool, pool)
+
+    def test_gunicorn_config_from_environment(self):
+        environ = {'GUNICORN_WORKERS': '3', 'GUNICORN_THREADS': '4',
+                   'GUNICORN_PRELOAD': 'false', 'GUNICORN_MAX_REQUESTS': '50',
+                   'PORT': '8080'}
+        with mock.patch.dict(os.environ, environ):
+            config = runpy.run_path(os.path.join(os.path.dirname(
+                os.path.abspath(__file__)), 'gunicorn.conf.py'))
+        self.assertEqual(
+            (config['bind'], config['workers'], config['threads'],
+             config['worker_class'], config['preload_app'],
+             config['max_requests'], config['max_requests_jitter']),
+            ('0.0.0.0:8080', 3, 4, 'gthread', False, 50, 100))
+
+    """
+    Request timing
+    """
+
+    @contextmanager
+    def timed_app(self, **settings):
+        with mock.patch.dict(os.environ, settings):
+            app = create_app()
+        db.session.remove()
+        setup_db(app, 'sqlite://')
+        response_cache.response_cache.clear()
+        auth.token_cache.clear()
+        try:
+            with app.app_context():
+                db.create_all()
+                self.seed_actors(3)
+                yield app
+        finally:
+            db.session.remove()
+            db.get_engine(app).dispose()
+            db.app = self.app
+            response_cache.response_cache.clear()
+
+    def server_timing(self, res):
+        metrics = {}
+        for metric in res.headers['Server-Timing'].split(', '):
+            name, *params = metric.split(';')
+            metrics[name] = dict(param.split('=', 1) for param in params)
+        return metrics
+
+    def test_server_timing_header_lists_request_phases(self):
+        with self.timed_app(REQUEST_TIMING_HEADER='true') as app:
+            res = app.test_client().get(
+                '/api/actors', headers=self.headers['casting_assistant'])
+            self.assertEqual(res.status_code, 200)
+            metrics = self.server_timing(res)
+            self.assertEqual(list(metrics), [
+                'auth.header', 'auth.cache', 'auth.key', 'auth.decode',
+                'auth.permissions', 'db', 'json', 'total'])
+            self.assertRegex(metrics['db']['desc'], r'^"[1-9]\d* queries"$')
+            self.assertGreaterEqual(
+                float(metrics['total']['dur']),
+                sum(float(metric['dur']) for name, metric in metrics.items()
+                    if name != 'total'))
+
+            # the verified token is cached, no key lookup or decoding
+            res = app.test_client().get(
+                '/api/actors', headers=self.headers['casting_assistant'])
+            self.assertNotIn('auth.decode', self.server_timing(res))
+
+    def test_request_timing_logs_one_line_per_request(self):
+        with self.timed_app(REQUEST_TIMING_LOG='true') as app:
+            client = app.test_client()
+            with self.assertLogs('request_timing', 'INFO') as logs:
+                res = client.patch(
+                    '/api/actors/1', json={'age': 41},
+                    headers=self.headers['executive_producer'])
+                client.get('/api/actors?format=ndjson',
+                           headers=self.headers['casting_assistant']).data
+                client.get('/api/actors')
+            self.assertNotIn('Server-Timing', res.headers)
+        lines = [json.loads(record.getMessage()) for record in logs.records]
+        self.assertEqual(
+            [(line['method'], line['path'], line['route'], line['status'])
+             for line in lines],
+            [('PATCH', '/api/actors/1', '/api/actors/<int:id>', 200),
+             ('GET', '/api/actors', '/api/actors', 200),
+             ('GET', '/api/actors', '/api/actors', 401)])
+        # the streamed export is logged once its rows have been read
+        self.assertGreater(lines[1]['queries'], 0)
+        self.assertIn('db_ms', lines[1])
+        self.assertEqual(lines[2]['queries'], 0)
+
+    def test_request_timing_is_off_by_default(self):
+        self.seed_actors(1)
+        res = self.get('/api/actors')
+        self.assertNotIn('Server-Timing', res.headers)
+        with self.app.test_request_context():
+            self.assertIsNone(timing.current_timings())
+            self.assertIs(timing.phase('db'), timing.phase('json'))
+
+    """
+    Metrics
+    """
+
+    def scrape(self):
+        from prometheus_client.parser import text_string_to_metric_families
+
+        res = self.client().get('/metrics')
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.content_type.startswith('text/plain'))
+        return {(sample.name, tuple(sorted(sample.labels.items()))):
+                sample.value
+                for family in text_string_to_metric_families(
+                    res.data.decode('utf-8'))
+                for sample in family.samples}
+
+    @unittest.skipIf(metrics.prometheus_client is None,
+                     'needs pip install prometheus_client')
+    def test_metrics_count_requests_failures_and_cache_lookups(self):
+        self.seed_actors(3)
+        requests = ('http_requests_total', (('method', 'GET'),
+                                            ('route', '/api/actors'),
+                                            ('status', '200')))
+        latency = ('http_request_duration_seconds_count',
+                   (('method', 'GET'), ('route', '/api/actors')))
+        failures = ('auth_failures_total',
+                    (('code', 'authorization_header_missing'),))
+        token_hits = ('cache_lookups', (('cache', 'token'),
+                                        ('result', 'hit')))
+        before = self.scrape()
+
+        for _ in range(3):
+            self.assertEqual(self.get('/api/actors').status_code, 200)
+        self.assertEqual(self.client().get('/api/actors').status_code, 401)
+        self.assertEqual(self.client().get('/missing').status_code, 404)
+
+        after = self.scrape()
+        for sample, added in ((requests, 3), (latency, 4), (failures, 1)):
+            self.assertEqual(after[sample] - before.get(sample, 0), added)
+        self.assertGreaterEqual(after[token_hits] - before[token_hits], 3)
+        self.assertEqual(after[('http_requests_total', (
+            ('method', 'GET'), ('route', 'unmatched'), ('status', '404')))],
+            before.get(('http_requests_total', (
+                ('method', 'GET'), ('route', 'unmatched'),
+                ('status', '404'))), 0) + 1)
+        # the scrape itself is the only request in progress
+        self.assertEqual(after[('http_requests_in_progress', (
+            ('method', 'GET'), ('route', '/api/actors')))], 0)
+        self.assertEqual(after[('http_requests_in_progress', (
+            ('method', 'GET'), ('route', '/metrics')))], 1)
+
+    @unittest.skipIf(metrics.prometheus_client is None,
+                     'needs pip install prometheus_client')
+    def test_metrics_add_up_worker_processes(self):
+        from prometheus_client import CollectorRegistry, multiprocess
+
+        path = os.path.join(self.tmpdir, 'metrics')
+        os.mkdir(path)
+        script = ('from app import app\n'
+                  'client = app.test_client()\n'
+                  'for _ in range({}):\n'
+                  '    client.get("/api/actors")\n')
+        workers = [subprocess.Popen(
+            [sys.executable, '-c', script.format(count)],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=dict(os.environ, PROMETHEUS_MULTIPROC_DIR=path))
+            for count in (2, 3)]
+        for worker in workers:
+            self.assertEqual(worker.wait(), 0)
+            multiprocess.mark_process_dead(worker.pid, path)
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, path)
+        self.assertEqual(registry.get_sample_value('http_requests_total', {
+            'method': 'GET', 'route': '/api/actors', 'status': '401'}), 5)
+        self.assertEqual(registry.get_sample_value('auth_failures_total', {
+            'code': 'authorization_header_missing'}), 5)
+        self.assertEqual(registry.get_sample_value(
+            'http_requests_in_progress',
+            {'method': 'GET', 'route': '/api/actors'}), None)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,354 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+from flask import Flask
+
+os.environ.setdefault('AUTH0_DOMAIN', 'capstone.test')
+os.environ.setdefault('API_AUDIENCE', 'capstone-app')
+
+from auth import auth
+from auth.auth import AuthError, verify_decode_jwt
+from auth.backends import BACKENDS, get_backend
+from auth.jwks import JWKSKeyStore
+from auth.local_idp import LocalIdentityProvider
+from auth.token_cache import TokenCache
+from sqlalchemy.util import greenlet_spawn
+from web.asgi import AsyncJWKSKeyStore
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class JWKSKeyStoreTestCase(unittest.TestCase):
+    """This class represents the JWKS key store test case"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.idp = LocalIdentityProvider(auth.AUTH0_DOMAIN, auth.API_AUDIENCE)
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.jwks_path = os.path.join(self.tmpdir, 'jwks.json')
+        self.jwks_url = self.idp.write_jwks(self.jwks_path)
+        self.clock = FakeClock()
+        self.store = JWKSKeyStore(self.jwks_url, ttl=600,
+                                  min_refresh_interval=30, clock=self.clock,
+                                  key_loader=auth.jwt_backend.load_key)
+        self.default_store = auth.jwks_store
+        auth.jwks_store = self.store
+
+    def tearDown(self):
+        auth.jwks_store = self.default_store
+        shutil.rmtree(self.tmpdir)
+
+    def test_key_set_is_fetched_once(self):
+        for _ in range(5):
+            self.assertIsNotNone(self.store.get_key(self.idp.kid))
+        self.assertEqual(self.store.refreshes, 1)
+        self.assertEqual(self.store.hits, 5)
+        self.assertEqual(self.store.misses, 0)
+
+    def test_verify_decode_jwt_uses_cached_keys(self):
+        token = self.idp.mint(['get:actors'])
+        for _ in range(3):
+            payload = verify_decode_jwt(token)
+            self.assertEqual(payload['permissions'], ['get:actors'])
+        self.assertEqual(self.store.refreshes, 1)
+
+    def test_key_set_is_refetched_after_ttl(self):
+        self.store.get_key(self.idp.kid)
+        self.clock.now += 599
+        self.store.get_key(self.idp.kid)
+        self.assertEqual(self.store.refreshes, 1)
+        self.clock.now += 1
+        self.store.get_key(self.idp.kid)
+        self.assertEqual(self.store.refreshes, 2)
+
+    def test_unknown_kid_refresh_is_rate_limited(self):
+        self.store.get_key(self.idp.kid)
+        self.clock.now += 31
+        for _ in range(10):
+            self.assertIsNone(self.store.get_key('unknown'))
+        self.assertEqual(self.store.refreshes, 2)
+        self.assertEqual(self.store.misses, 10)
+
+    def test_unknown_kid_is_rejected(self):
+        token = self.idp.mint(['get:actors'], kid='unknown')
+        with self.assertRaises(AuthError) as context:
+            verify_decode_jwt(token)
+        self.assertEqual(context.exception.status_code, 400)
+        self.assertEqual(context.exception.error['code'], 'invalid_header')
+
+    def test_stale_keys_are_served_when_refresh_fails(self):
+        self.store.get_key(self.idp.kid)
+        os.remove(self.jwks_path)
+        self.clock.now += 601
+        self.assertIsNotNone(self.store.get_key(self.idp.kid))
+        self.assertEqual(self.store.refresh_failures, 1)
+        # the failed attempt is rate-limited as well
+        self.store.get_key(self.idp.kid)
+        self.assertEqual(self.store.refresh_failures, 1)
+
+    def concurrent_get_key(self, kid, threads=5):
+        fetch = JWKSKeyStore._fetch
+        barrier = threading.Barrier(threads)
+
+        def slow_fetch(store):
+            time.sleep(0.1)
+            return fetch(store)
+
+        def get_key(index):
+            barrier.wait()
+            keys[index] = self.store.get_key(kid)
+
+        keys = [None] * threads
+        with mock.patch.object(JWKSKeyStore, '_fetch', slow_fetch):
+            workers = [threading.Thread(target=get_key, args=(index,))
+                       for index in range(threads)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        return keys
+
+    def test_concurrent_misses_wait_for_the_refresh_in_flight(self):
+        # cold start
+        keys = self.concurrent_get_key(self.idp.kid)
+        self.assertEqual([key is None for key in keys], [False] * len(keys))
+        self.assertEqual(self.store.refreshes, 1)
+
+        # key rotation
+        rotated = LocalIdentityProvider(auth.AUTH0_DOMAIN, auth.API_AUDIENCE,
+                                        kid='rotated-key', bits=1024)
+        rotated.write_jwks(self.jwks_path)
+        self.clock.now += 31
+        keys = self.concurrent_get_key('rotated-key')
+        self.assertEqual([key is None for key in keys], [False] * len(keys))
+        self.assertEqual(self.store.refreshes, 2)
+
+    def test_key_set_from_local_http_server(self):
+        url = self.idp.serve()
+        try:
+            store = JWKSKeyStore(url, clock=self.clock,
+                                 key_loader=auth.jwt_backend.load_key)
+            auth.jwks_store = store
+            token = self.idp.mint(['get:movies'])
+            for _ in range(3):
+                verify_decode_jwt(token)
+            self.assertEqual(self.idp._server.handler.requests_served, 1)
+            self.assertEqual(store.stats()['hits'], 3)
+        finally:
+            self.idp.shutdown()
+
+    def test_async_store_fetches_without_blocking_event_loop(self):
+        store = AsyncJWKSKeyStore(self.jwks_url, clock=self.clock,
+                                  key_loader=auth.jwt_backend.load_key)
+        fetch = JWKSKeyStore._fetch
+
+        def slow_fetch(self):
+            time.sleep(0.2)
+            return fetch(self)
+
+        async def tick(ticks):
+            while not store.refreshes:
+                ticks.append(1)
+                await asyncio.sleep(0.01)
+
+        async def get_key_while_ticking():
+            ticks = []
+            key, _ = await asyncio.gather(
+                greenlet_spawn(store.get_key, self.idp.kid), tick(ticks))
+            return key, len(ticks)
+
+        with mock.patch.object(JWKSKeyStore, '_fetch', slow_fetch):
+            key, ticks = asyncio.run(get_key_while_ticking())
+        self.assertIsNotNone(key)
+        self.assertGreater(ticks, 5)
+        # outside an event loop the store fetches like JWKSKeyStore
+        self.clock.now += 600
+        self.assertTrue(store.refresh())
+        self.assertEqual(store.refreshes, 2)
+
+
+class TokenCacheTestCase(unittest.TestCase):
+    """This class represents the verified token cache test case"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = TokenCache(max_entries=2, max_bytes=1024, max_ttl=300,
+                                clock=self.clock)
+
+    def payload(self, expires_in=3600, **claims):
+        claims['exp'] = self.clock.now + expires_in
+        return claims
+
+    def test_cached_payload_is_returned(self):
+        payload = self.payload(permissions=['get:actors'])
+        self.assertIsNone(self.cache.get('token'))
+        self.cache.put('token', payload)
+        self.assertIs(self.cache.get('token'), payload)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_entry_never_outlives_exp(self):
+        self.cache.put('token', self.payload(expires_in=10))
+        self.clock.now += 9
+        self.assertIsNotNone(self.cache.get('token'))
+        self.clock.now += 1
+        self.assertIsNone(self.cache.get('token'))
+        self.assertEqual(self.cache.expirations, 1)
+
+    def test_entry_is_bounded_by_max_ttl(self):
+        self.cache.put('token', self.payload(expires_in=3600))
+        self.clock.now += 300
+        self.assertIsNone(self.cache.get('token'))
+
+    def test_payload_without_exp_is_not_cached(self):
+        self.cache.put('token', {'permissions': []})
+        self.assertIsNone(self.cache.get('token'))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        self.cache.put('a', self.payload())
+        self.cache.put('b', self.payload())
+        self.cache.get('a')
+        self.cache.put('c', self.payload())
+        self.assertIsNone(self.cache.get('b'))
+        self.assertIsNotNone(self.cache.get('a'))
+        self.assertEqual(self.cache.evictions, 1)
+
+    def test_cache_is_bounded_by_bytes(self):
+        self.cache.put('a', self.payload(blob='x' * 600))
+        self.cache.put('b', self.payload(blob='x' * 600))
+        self.assertIsNone(self.cache.get('a'))
+        self.assertLessEqual(self.cache.stats()['bytes'], 1024)
+
+    def test_requires_auth_verifies_token_once(self):
+        idp = LocalIdentityProvider(auth.AUTH0_DOMAIN, auth.API_AUDIENCE,
+                                    bits=1024)
+        token = idp.mint(['get:actors'])
+        calls = []
+
+        def verify(token):
+            calls.append(token)
+            return verify_decode_jwt(token)
+
+        tmpdir = tempfile.mkdtemp()
+        default_store, default_cache = auth.jwks_store, auth.token_cache
+        default_verify = auth.verify_decode_jwt
+        try:
+            auth.jwks_store = JWKSKeyStore(
+                idp.write_jwks(os.path.join(tmpdir, 'jwks.json')),
+                key_loader=auth.jwt_backend.load_key)
+            auth.token_cache = TokenCache()
+            auth.verify_decode_jwt = verify
+            app = Flask(__name__)
+            view = auth.requires_auth('get:actors')(lambda payload: 'ok')
+            headers = {'Authorization': 'Bearer ' + token}
+            for _ in range(3):
+                with app.test_request_context(headers=headers):
+                    self.assertEqual(view(), 'ok')
+            with app.test_request_context(headers=headers):
+                with self.assertRaises(AuthError) as context:
+                    auth.requires_auth('post:actors')(lambda payload: 'ok')()
+            self.assertEqual(context.exception.status_code, 403)
+            self.assertEqual(len(calls), 1)
+        finally:
+            auth.jwks_store, auth.token_cache = default_store, default_cache
+            auth.verify_decode_jwt = default_verify
+            shutil.rmtree(tmpdir)
+
+
+def available_backends():
+    names = []
+    for name in sorted(BACKENDS):
+        try:
+            get_backend(name)
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+class JWTBackendTestCase(unittest.TestCase):
+    """This class represents the JWT signature backend test case"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.idp = LocalIdentityProvider(auth.AUTH0_DOMAIN, auth.API_AUDIENCE)
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.jwks_url = cls.idp.write_jwks(
+            os.path.join(cls.tmpdir, 'jwks.json'))
+        impostor = LocalIdentityProvider(auth.AUTH0_DOMAIN,
+                                         auth.API_AUDIENCE,
+                                         kid=cls.idp.kid, bits=1024)
+        cls.tokens = {
+            'expired': cls.idp.mint(expires_in=-60),
+            'audience': cls.idp.mint(aud='another-app'),
+            'issuer': cls.idp.mint(iss='https://another.test/'),
+            'signature': impostor.mint(),
+            'garbage': 'not.a.token'
+        }
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    def setUp(self):
+        self.default_backend = auth.jwt_backend
+        self.default_store = auth.jwks_store
+
+    def tearDown(self):
+        auth.jwt_backend = self.default_backend
+        auth.jwks_store = self.default_store
+
+    def use_backend(self, name):
+        auth.jwt_backend = get_backend(name)
+        auth.jwks_store = JWKSKeyStore(self.jwks_url,
+                                       key_loader=auth.jwt_backend.load_key)
+
+    def error_for(self, token):
+        try:
+            verify_decode_jwt(token)
+        except AuthError as e:
+            return e.error['code'], e.status_code
+        return None
+
+    def test_unknown_backend_is_rejected(self):
+        with self.assertRaises(ValueError):
+            get_backend('unknown')
+
+    def test_backends_accept_valid_token(self):
+        token = self.idp.mint(['get:actors'])
+        for name in available_backends():
+            self.use_backend(name)
+            payload = verify_decode_jwt(token)
+            self.assertEqual(payload['permissions'], ['get:actors'], name)
+
+    def test_backends_raise_identical_errors(self):
+        expected = {
+            'expired': ('token_expired', 401),
+            'audience': ('invalid_claims', 401),
+            'issuer': ('invalid_claims', 401),
+            'signature': ('invalid_header', 400),
+            'garbage': ('invalid_header', 400)
+        }
+        for name in available_backends():
+            self.use_backend(name)
+            for case, token in self.tokens.items():
+                self.assertEqual(self.error_for(token), expected[case],
+                                 f'{name}: {case}')
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
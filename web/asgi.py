@@ -0,0 +1,211 @@
+import asyncio
+import io
+import logging
+import sys
+import threading
+from functools import partial
+
+from sqlalchemy.util import await_only, greenlet_spawn
+
+from auth.jwks import JWKSKeyStore
+from database.versions import VersionsError
+
+logger = logging.getLogger(__name__)
+
+'''
+ASGI serving
+    ASGIApp runs the unchanged Flask app, routes, requires_auth and error
+    handlers included, one greenlet per request on an asyncio event loop.
+    Whenever a request waits, for a database driven by an asyncio driver
+    (postgresql+asyncpg, sqlite+aiosqlite), for the signing keys or for
+    the client, its greenlet yields and the loop serves other requests:
+
+        pip install uvicorn asyncpg aiosqlite
+        uvicorn asgi:app --workers 4
+
+    code that waits without yielding (a psycopg2 or pysqlite database,
+    time.sleep) blocks every request of the worker, so the database URLs
+    must name an asyncio driver. Migrations and the CLI keep the
+    synchronous drivers.
+'''
+
+
+def _running_loop():
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+'''
+GreenletLock
+    a lock for code running in the greenlets of the event loop, where a
+    threading.Lock held across a yield would block the whole thread;
+    outside an event loop it is a threading.Lock
+'''
+
+
+class GreenletLock:
+    def __init__(self):
+        self._thread_lock = threading.Lock()
+        self._loop = None
+        self._loop_lock = None
+        self._held = None
+
+    def __enter__(self):
+        loop = _running_loop()
+        if loop is None:
+            lock = self._thread_lock
+            lock.acquire()
+        else:
+            if self._loop is not loop:
+                self._loop, self._loop_lock = loop, asyncio.Lock()
+            lock = self._loop_lock
+            await_only(lock.acquire())
+        self._held = lock
+
+    def __exit__(self, *exc_info):
+        self._held.release()
+
+
+'''
+AsyncJWKSKeyStore
+    JWKSKeyStore fetching the key set in the event loop's executor, so a
+    refresh does not block the other requests of the worker
+'''
+
+
+class AsyncJWKSKeyStore(JWKSKeyStore):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = GreenletLock()
+
+    def _fetch(self):
+        loop = _running_loop()
+        if loop is None:
+            return super()._fetch()
+        return await_only(loop.run_in_executor(
+            None, partial(JWKSKeyStore._fetch, self)))
+
+
+def wsgi_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode(
+            'latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope['http_version'],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+        environ['REMOTE_PORT'] = str(scope['client'][1])
+
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        if name in environ:
+            value = environ[name] + ',' + value
+        environ[name] = value
+    # the body has been read whole, chunked or not
+    environ['CONTENT_LENGTH'] = str(len(body))
+    return environ
+
+
+'''
+ASGIApp(wsgi_app, on_startup)
+    ASGI application serving the WSGI application `wsgi_app`. The
+    optional `on_startup` runs in a greenlet when the server starts,
+    before it accepts connections, e.g. web.warmup.warm_up; a failure is
+    logged and the app serves anyway, except for a VersionsError, which
+    fails the startup.
+'''
+
+
+class ASGIApp:
+    def __init__(self, wsgi_app, on_startup=None):
+        self.wsgi_app = wsgi_app
+        self.on_startup = on_startup
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            body = await self._read_body(receive)
+            await greenlet_spawn(self._serve, scope, body, send)
+        else:
+            raise ValueError('Unsupported ASGI scope type ' + scope['type'])
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                if self.on_startup is not None:
+                    try:
+                        await greenlet_spawn(self.on_startup)
+                    except VersionsError as e:
+                        await send({'type': 'lifespan.startup.failed',
+                                    'message': str(e)})
+                        return
+                    except Exception as e:
+                        logger.warning('Startup failed: %s', e)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _read_body(self, receive):
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body', False):
+                break
+        return b''.join(chunks)
+
+    # runs in the request's greenlet, awaiting through await_only
+    def _serve(self, scope, body, send):
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response.get('sent'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [
+                (name.lower().encode('latin-1'), value.encode('latin-1'))
+                for name, value in headers]
+            return lambda data: send_body(data, more_body=True)
+
+        def send_body(data, more_body):
+            if not response.get('sent'):
+                response['sent'] = True
+                await_only(send({'type': 'http.response.start',
+                                 'status': response['status'],
+                                 'headers': response['headers']}))
+            if data or not more_body:
+                await_only(send({'type': 'http.response.body',
+                                 'body': data, 'more_body': more_body}))
+
+        chunks = self.wsgi_app(wsgi_environ(scope, body), start_response)
+        try:
+            for chunk in chunks:
+                if chunk:
+                    send_body(chunk, more_body=True)
+            send_body(b'', more_body=False)
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
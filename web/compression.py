@@ -0,0 +1,139 @@
+import os
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+'''
+Response compression
+    JSON, NDJSON and text responses are compressed with brotli (when the
+    optional `brotli` package is installed) or gzip, whichever the client
+    prefers in Accept-Encoding, brotli winning ties:
+
+        pip install brotli
+
+    buffered bodies smaller than COMPRESSION_MIN_SIZE bytes are sent as
+    they are. Streamed bodies are compressed chunk by chunk, each chunk
+    flushed so that the client can decode it as soon as it arrives.
+
+    a compressed body is a different representation from the identity
+    one, so a strong ETag becomes weak; If-None-Match still matches it.
+'''
+
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 4))
+
+COMPRESSIBLE_MIMETYPES = {'application/json', 'application/x-ndjson'}
+
+
+class GzipCompressor:
+    def __init__(self, level=None):
+        # wbits 31: deflate with a gzip header and trailer
+        self._compressor = zlib.compressobj(
+            GZIP_LEVEL if level is None else level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliCompressor:
+    def __init__(self, quality=None):
+        self._compressor = brotli.Compressor(
+            quality=BROTLI_QUALITY if quality is None else quality)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+COMPRESSORS = {'gzip': GzipCompressor}
+if brotli is not None:
+    COMPRESSORS['br'] = BrotliCompressor
+
+
+'''
+negotiate_encoding(request)
+    the content coding to use for the response to `request`, or None
+'''
+
+
+def negotiate_encoding(request):
+    accepted = request.accept_encodings
+    best = None
+    for encoding in ('br', 'gzip'):
+        quality = accepted[encoding]
+        if encoding in COMPRESSORS and quality > 0 and (
+                best is None or quality > accepted[best]):
+            best = encoding
+    return best
+
+
+def _compressible(response):
+    return ((response.mimetype in COMPRESSIBLE_MIMETYPES or
+             response.mimetype.startswith('text/')) and
+            200 <= response.status_code < 300 and
+            response.status_code != 204 and
+            not response.direct_passthrough and
+            'Content-Encoding' not in response.headers)
+
+
+def _compress_stream(chunks, compressor):
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compressor.compress(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+'''
+compress_response(request, response)
+    compresses `response` in place with the encoding negotiated for
+    `request`, for use in an after_request hook
+'''
+
+
+def compress_response(request, response):
+    if not _compressible(response):
+        return response
+    response.vary.add('Accept-Encoding')
+
+    encoding = negotiate_encoding(request)
+    if encoding is None or request.method == 'HEAD':
+        return response
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.response,
+                                             COMPRESSORS[encoding]())
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < COMPRESSION_MIN_SIZE:
+            return response
+        compressor = COMPRESSORS[encoding]()
+        response.set_data(compressor.compress(body) + compressor.finish())
+
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
@@ -0,0 +1,88 @@
+import hashlib
+from functools import wraps
+
+from flask import Response, _request_ctx_stack, request
+
+from database.models import db
+from database.versions import read_versions
+from web.response_cache import response_cache
+from web.streaming import wants_ndjson
+
+'''
+Conditional GET
+    the GET routes send a strong ETag computed from the request and the
+    versions of the tables they read, see database/versions.py. The
+    versions come from one primary key lookup, so a request whose
+    If-None-Match holds the current ETag is answered with 304 before any
+    row is loaded, and the ETag is the same in every worker.
+'''
+
+
+def _etag(representation, versions):
+    return hashlib.sha256(repr((
+        request.path, sorted(request.args.items(multi=True)),
+        representation, versions)).encode('utf-8')).hexdigest()[:32]
+
+
+'''
+versioned_response(*tables, expand_tables=(), check_args=None)
+    adds ETags, If-None-Match and the response cache to a GET route that
+    reads `tables`, and `expand_tables` too when the request has `expand`
+    check_args(request.args) raises ValueError for the arguments the route
+    answers 400 to, which is then called without reading any version
+    cache entries are keyed by path, query string and the permissions of
+    the token; NDJSON exports and error responses are never cached
+'''
+
+
+def versioned_response(*tables, expand_tables=(), check_args=None):
+    def versioned_response_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            try:
+                streamed = wants_ndjson(request)
+                if check_args is not None:
+                    check_args(request.args)
+            except ValueError:
+                # the route answers 400
+                return f(*args, **kwargs)
+
+            read = tables + (expand_tables if 'expand' in request.args
+                             else ())
+            # read before the query runs, so a write committed while the
+            # body is built leaves the ETag and cache entry stale rather
+            # than wrong
+            versions = read_versions(db.session, read)
+            etag = _etag('ndjson' if streamed else 'json', versions)
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+
+            if streamed or response_cache.max_entries <= 0:
+                response = f(*args, **kwargs)
+                response.set_etag(etag)
+                return response
+
+            payload = getattr(_request_ctx_stack.top, 'current_user', {})
+            key = (request.path,
+                   tuple(sorted(request.args.items(multi=True))),
+                   tuple(sorted(payload.get('permissions', []))))
+            body = response_cache.get(key, versions)
+            if body is not None:
+                response = Response(body, mimetype='application/json')
+                response.headers['X-Cache'] = 'HIT'
+                response.set_etag(etag)
+                return response
+
+            response = f(*args, **kwargs)
+            if (isinstance(response, Response) and
+                    response.status_code == 200):
+                response_cache.put(key, versions, response.get_data())
+                response.headers['X-Cache'] = 'MISS'
+                response.set_etag(etag)
+            return response
+
+        return wrapper
+
+    return versioned_response_decorator
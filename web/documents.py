@@ -0,0 +1,15 @@
+import json
+
+from flask import Response
+
+'''
+document_listing_response(key, documents, next_cursor)
+    a page of a listing whose items come as an already encoded JSON array,
+    laid out as jsonify lays out {key: [...], 'next_cursor', 'success'}
+'''
+
+
+def document_listing_response(key, documents, next_cursor):
+    body = (f'{{"{key}":{documents},'
+            f'"next_cursor":{json.dumps(next_cursor)},"success":true}}\n')
+    return Response(body, mimetype='application/json')
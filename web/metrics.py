@@ -0,0 +1,205 @@
+import os
+import time
+
+from flask import Response, _request_ctx_stack, request
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+from auth import auth
+from database.engine import pool_stats
+from database.models import db
+from settings import flag, read_settings
+from web import response_cache
+
+'''
+Prometheus metrics
+    GET /metrics answers in the Prometheus text format when the optional
+    `prometheus_client` package is installed:
+
+        pip install prometheus_client
+
+    read by install_metrics from the app config, falling back to the
+    environment and then to the defaults below:
+
+        METRICS_ENABLED         serve /metrics and record the request
+                                metrics, default true
+        METRICS_STATS_INTERVAL  seconds between two copies of the pool and
+                                cache statistics into the gauges, default 5
+
+    with several worker processes, set PROMETHEUS_MULTIPROC_DIR to an empty
+    directory shared by the workers before they start (gunicorn.conf.py
+    does). Every worker then writes its metrics to memory-mapped files in
+    that directory, and /metrics adds up the files of all workers,
+    whichever worker serves the scrape.
+
+    requests only update in-memory values; the pool and cache statistics
+    are copied at most every METRICS_STATS_INTERVAL seconds and before
+    every scrape.
+'''
+
+
+METRICS_SETTINGS = {
+    'METRICS_ENABLED': (flag, True),
+    'METRICS_STATS_INTERVAL': (float, 5)
+}
+
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10)
+
+if prometheus_client is not None:
+    from prometheus_client import Counter, Gauge, Histogram
+
+    REQUESTS = Counter(
+        'http_requests_total', 'Requests answered',
+        ['method', 'route', 'status'])
+    LATENCY = Histogram(
+        'http_request_duration_seconds',
+        'Seconds from the start of a request to its response',
+        ['method', 'route'], buckets=LATENCY_BUCKETS)
+    IN_PROGRESS = Gauge(
+        'http_requests_in_progress', 'Requests being served',
+        ['method', 'route'], multiprocess_mode='livesum')
+    AUTH_FAILURES = Counter(
+        'auth_failures_total', 'Requests rejected by requires_auth',
+        ['code'])
+
+    # copies of the statistics kept by each process; counts only grow, so
+    # the copies of workers that exited still count in the sums
+    POOL_CONNECTIONS = Gauge(
+        'db_pool_connections', 'Pooled database connections',
+        ['engine', 'state'], multiprocess_mode='livesum')
+    POOL_CHECKOUTS = Gauge(
+        'db_pool_checkouts', 'Connections checked out of the pool',
+        ['engine'], multiprocess_mode='sum')
+    POOL_TIMEOUTS = Gauge(
+        'db_pool_timeouts', 'Checkouts that timed out waiting',
+        ['engine'], multiprocess_mode='sum')
+    POOL_WAIT = Gauge(
+        'db_pool_wait_seconds', 'Seconds spent waiting for a connection',
+        ['engine'], multiprocess_mode='sum')
+    CACHE_LOOKUPS = Gauge(
+        'cache_lookups', 'Cache lookups', ['cache', 'result'],
+        multiprocess_mode='sum')
+    CACHE_ENTRIES = Gauge(
+        'cache_entries', 'Entries in the cache', ['cache'],
+        multiprocess_mode='livesum')
+    JWKS_REFRESHES = Gauge(
+        'jwks_refreshes', 'Fetches of the signing keys', ['result'],
+        multiprocess_mode='sum')
+
+
+'''
+count_auth_failure(error)
+    counts an AuthError by its code, see the auth_error handler of app.py
+'''
+
+
+def count_auth_failure(error):
+    if prometheus_client is not None:
+        AUTH_FAILURES.labels(error.error.get('code', 'unknown')).inc()
+
+
+def _engines(app):
+    engines = [('primary', db.get_engine(app))]
+    replicas = app.extensions.get('replicas')
+    if replicas is not None:
+        engines.extend((f'replica{index}', replica.engine)
+                       for index, replica in enumerate(replicas.replicas))
+    return engines
+
+
+'''
+copy_stats(app)
+    sets the pool and cache gauges from database.engine.pool_stats and the
+    stats() of the response, token and signing key caches
+'''
+
+
+def copy_stats(app):
+    for name, engine in _engines(app):
+        stats = pool_stats(engine)
+        for state in ('checked_in', 'checked_out', 'overflow'):
+            if state in stats:
+                POOL_CONNECTIONS.labels(name, state).set(stats[state])
+        if 'checkouts' in stats:
+            POOL_CHECKOUTS.labels(name).set(stats['checkouts'])
+            POOL_TIMEOUTS.labels(name).set(stats['timeouts'])
+            POOL_WAIT.labels(name).set(stats['wait_seconds_total'])
+
+    jwks = auth.jwks_store.stats()
+    caches = {
+        'response': response_cache.response_cache.stats(),
+        'token': auth.token_cache.stats(),
+        'jwks': dict(jwks, entries=jwks['keys'])
+    }
+    for cache, stats in caches.items():
+        CACHE_LOOKUPS.labels(cache, 'hit').set(stats['hits'])
+        CACHE_LOOKUPS.labels(cache, 'miss').set(stats['misses'])
+        CACHE_ENTRIES.labels(cache).set(stats['entries'])
+
+    JWKS_REFRESHES.labels('ok').set(jwks['refreshes'])
+    JWKS_REFRESHES.labels('failed').set(jwks['refresh_failures'])
+
+
+def exposition():
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry)
+
+
+'''
+install_metrics(app)
+    adds the /metrics route to `app` and records its request metrics, when
+    prometheus_client is installed and METRICS_ENABLED is set
+'''
+
+
+def install_metrics(app):
+    settings = read_settings(app.config, METRICS_SETTINGS)
+    if prometheus_client is None or not settings['METRICS_ENABLED']:
+        return
+    interval = settings['METRICS_STATS_INTERVAL']
+    next_copy = [0.0]
+
+    @app.before_request
+    def before_request_metrics():
+        top = _request_ctx_stack.top
+        rule = request.url_rule
+        top.metrics_labels = (request.method,
+                              rule.rule if rule is not None else 'unmatched')
+        top.metrics_start = time.perf_counter()
+        IN_PROGRESS.labels(*top.metrics_labels).inc()
+
+    @app.after_request
+    def after_request_metrics(response):
+        top = _request_ctx_stack.top
+        labels = getattr(top, 'metrics_labels', None)
+        if labels is not None:
+            LATENCY.labels(*labels).observe(
+                time.perf_counter() - top.metrics_start)
+            REQUESTS.labels(*labels, str(response.status_code)).inc()
+        now = time.monotonic()
+        if now >= next_copy[0]:
+            next_copy[0] = now + interval
+            copy_stats(app)
+        return response
+
+    @app.teardown_request
+    def teardown_request_metrics(exc):
+        labels = getattr(_request_ctx_stack.top, 'metrics_labels', None)
+        if labels is not None:
+            IN_PROGRESS.labels(*labels).dec()
+
+    @app.route('/metrics')
+    def get_metrics():
+        copy_stats(app)
+        return Response(exposition(),
+                        content_type=prometheus_client.CONTENT_TYPE_LATEST)
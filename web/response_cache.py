@@ -0,0 +1,108 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+'''
+ResponseCache
+    bounded LRU cache of serialized response bodies
+
+    every entry carries the versions of the tables its body was read from
+    and is dropped on the first lookup after one of them has moved, see
+    database/versions.py. Entries also expire after `ttl` seconds.
+
+    the cache is bounded by `max_entries` and by `max_bytes`, the total
+    size of the cached bodies.
+'''
+
+
+class ResponseCache:
+    def __init__(self, max_entries=256, max_bytes=16 * 1024 * 1024, ttl=30,
+                 clock=time.monotonic):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key, versions):
+        if self.max_entries <= 0:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            body, entry_versions, expires_at = entry
+            if entry_versions != versions:
+                self._remove(key)
+                self.invalidations += 1
+                self.misses += 1
+                return None
+            if self._clock() >= expires_at:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key, versions, body):
+        if self.max_entries <= 0 or len(body) > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (body, versions, self._clock() + self.ttl)
+            self._bytes += len(body)
+            while (len(self._entries) > self.max_entries or
+                   self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+    def _remove(self, key):
+        body, versions, expires_at = self._entries.pop(key)
+        self._bytes -= len(body)
+
+
+'''
+response_cache
+    process-wide cache of GET responses used by versioned_response,
+    disabled when RESPONSE_CACHE_SIZE is 0
+'''
+response_cache = ResponseCache(
+    max_entries=int(os.environ.get('RESPONSE_CACHE_SIZE', 256)),
+    max_bytes=int(os.environ.get('RESPONSE_CACHE_MAX_BYTES',
+                                 16 * 1024 * 1024)),
+    ttl=float(os.environ.get('RESPONSE_CACHE_TTL', 30)))
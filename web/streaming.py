@@ -0,0 +1,62 @@
+import os
+from flask import Response, current_app, stream_with_context
+
+'''
+NDJSON export
+    collection routes stream every row as one JSON document per line when
+    the client sends `Accept: application/x-ndjson` or `?format=ndjson`.
+
+    rows are read through a server-side cursor in batches of
+    EXPORT_BATCH_SIZE and written out one batch at a time, so memory use
+    stays flat whatever the size of the table.
+'''
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+
+
+'''
+wants_ndjson(request)
+    True when the request asks for the NDJSON export
+    raises ValueError for an unknown `format`
+'''
+
+
+def wants_ndjson(request):
+    format = request.args.get('format')
+    if format is not None:
+        if format not in ('json', 'ndjson'):
+            raise ValueError(f'Unknown format {format!r}')
+        return format == 'ndjson'
+
+    best = request.accept_mimetypes.best_match(
+        ['application/json', NDJSON_MIMETYPE])
+    return best == NDJSON_MIMETYPE
+
+
+'''
+ndjson_response(query, serialize)
+    streams `serialize(row)` for every row of `query`
+'''
+
+
+def ndjson_response(query, serialize, batch_size=None):
+    batch_size = batch_size or EXPORT_BATCH_SIZE
+
+    def generate():
+        encode = current_app.json_encoder(
+            separators=(',', ':'),
+            sort_keys=current_app.config['JSON_SORT_KEYS']).encode
+        lines = []
+        for row in query.yield_per(batch_size):
+            lines.append(encode(serialize(row)))
+            if len(lines) == batch_size:
+                lines.append('')
+                yield '\n'.join(lines)
+                lines = []
+        if lines:
+            lines.append('')
+            yield '\n'.join(lines)
+
+    return Response(stream_with_context(generate()),
+                    mimetype=NDJSON_MIMETYPE)
@@ -0,0 +1,218 @@
+import json
+import logging
+import sys
+import time
+
+from flask import _request_ctx_stack, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from settings import flag, read_settings
+
+'''
+Request timing
+    read by install_request_timing from the app config, falling back to
+    the environment and then to the defaults below:
+
+        REQUEST_TIMING_HEADER  send the timings back in a Server-Timing
+                               header, default false
+        REQUEST_TIMING_LOG     log one JSON line per request with the
+                               `request_timing` logger, default false
+
+    with either one set, every request records how long it spent in
+
+        auth.header       reading the Authorization header
+        auth.cache        looking the token up in auth.token_cache
+        auth.key          looking the signing key up in auth.jwks_store
+        auth.decode       verifying the token
+        auth.permissions  checking the permission of the route
+        db                executing SQL statements, with their number
+        json              serializing JSON bodies
+
+    and in total. With both unset no hook is installed and the phases
+    above cost one attribute lookup each.
+'''
+
+logger = logging.getLogger('request_timing')
+
+
+TIMING_SETTINGS = {
+    'REQUEST_TIMING_HEADER': (flag, False),
+    'REQUEST_TIMING_LOG': (flag, False)
+}
+
+
+'''
+RequestTimings
+    seconds spent by one request in each phase, kept in insertion order
+'''
+
+
+class RequestTimings:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = {}
+        self.statements = 0
+        self.line = None
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def total(self):
+        return time.perf_counter() - self.start
+
+    def server_timing(self, total):
+        metrics = []
+        for name, seconds in self.phases.items():
+            metric = f'{name};dur={seconds * 1000:.2f}'
+            if name == 'db':
+                metric += f';desc="{self.statements} queries"'
+            metrics.append(metric)
+        metrics.append(f'total;dur={total * 1000:.2f}')
+        return ', '.join(metrics)
+
+
+class _Phase:
+    __slots__ = ('timings', 'name', 'start')
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.timings.add(self.name, time.perf_counter() - self.start)
+
+
+class _NoPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NO_PHASE = _NoPhase()
+
+
+'''
+current_timings()
+    the RequestTimings of the current request, None when timing is off or
+    outside of a request
+'''
+
+
+def current_timings():
+    return getattr(_request_ctx_stack.top, 'request_timings', None)
+
+
+'''
+phase(name)
+    context manager adding the time spent in its block to phase `name` of
+    the current request, or doing nothing when timing is off
+'''
+
+
+def phase(name):
+    timings = getattr(_request_ctx_stack.top, 'request_timings', None)
+    if timings is None:
+        return _NO_PHASE
+    return _Phase(timings, name)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    context.request_timing_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    timings = current_timings()
+    if timings is not None:
+        timings.statements += 1
+        timings.add('db', time.perf_counter() - context.request_timing_start)
+
+
+def _listen_to_engines():
+    if not event.contains(Engine, 'before_cursor_execute',
+                          _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def timed_json_encoder(encoder):
+    class TimedJSONEncoder(encoder):
+        def encode(self, o):
+            with phase('json'):
+                return super().encode(o)
+
+    return TimedJSONEncoder
+
+
+def _log_line(line, timings, total):
+    line = dict(line, total_ms=round(total * 1000, 2),
+                queries=timings.statements)
+    for name, seconds in timings.phases.items():
+        line[name + '_ms'] = round(seconds * 1000, 2)
+    return json.dumps(line, separators=(',', ':'))
+
+
+'''
+install_request_timing(app)
+    records the timings of every request of `app` when REQUEST_TIMING_HEADER
+    or REQUEST_TIMING_LOG is set. Call it before registering the other
+    after_request functions, so that the total includes them.
+'''
+
+
+def install_request_timing(app):
+    settings = read_settings(app.config, TIMING_SETTINGS)
+    send_header = settings['REQUEST_TIMING_HEADER']
+    log = settings['REQUEST_TIMING_LOG']
+    if not (send_header or log):
+        return
+
+    _listen_to_engines()
+    app.json_encoder = timed_json_encoder(app.json_encoder)
+    if log and not logger.handlers:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+    @app.before_request
+    def before_request_timing():
+        _request_ctx_stack.top.request_timings = RequestTimings()
+
+    @app.after_request
+    def after_request_timing(response):
+        timings = current_timings()
+        if timings is None:
+            return response
+        total = timings.total()
+        if send_header:
+            response.headers['Server-Timing'] = timings.server_timing(total)
+        if log:
+            rule = request.url_rule
+            timings.line = {
+                'method': request.method,
+                'path': request.path,
+                'route': rule.rule if rule is not None else None,
+                'status': response.status_code
+            }
+        return response
+
+    if log:
+        # the request context of a streamed response lives until the body
+        # has been sent, so the line covers the whole export
+        @app.teardown_request
+        def teardown_request_timing(exc):
+            timings = current_timings()
+            if timings is not None and timings.line is not None:
+                logger.info(_log_line(timings.line, timings,
+                                      timings.total()))
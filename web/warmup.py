@@ -0,0 +1,80 @@
+import time
+
+from sqlalchemy import text
+from sqlalchemy.orm import configure_mappers
+
+from auth import auth
+from database.models import db
+from database.versions import check_versions
+
+'''
+Worker lifecycle, see gunicorn.conf.py
+
+    a worker's first requests used to pay for the mapper configuration,
+    the database connections and the JWKS fetch; warm_up pays for them
+    when the worker boots, before it accepts connections
+'''
+
+
+def _engines(app):
+    engines = [db.get_engine(app)]
+    replicas = app.extensions.get('replicas')
+    if replicas is not None:
+        engines.extend(replica.engine for replica in replicas.replicas)
+    return engines
+
+
+'''
+reset_pools(app)
+    closes the pooled connections of the primary and replica engines of
+    `app`, so that processes forked afterwards open their own
+'''
+
+
+def reset_pools(app):
+    for engine in _engines(app):
+        engine.dispose()
+
+
+'''
+warm_up(app, connections)
+    configures the SQLAlchemy mappers, opens `connections` connections to
+    the primary and to every replica, checks the table versions and fetches
+    the signing keys. Returns the seconds each step took. Raises
+    VersionsError when the database lacks the table versions, and
+    RuntimeError when the keys cannot be fetched; the first request that
+    needs them fetches them again.
+'''
+
+
+def warm_up(app, connections=1):
+    timings = {}
+
+    start = time.perf_counter()
+    configure_mappers()
+    timings['mappers'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for engine in _engines(app):
+        opened = []
+        try:
+            for _ in range(max(connections, 1)):
+                connection = engine.connect()
+                opened.append(connection)
+                connection.execute(text('SELECT 1'))
+        finally:
+            for connection in opened:
+                connection.close()
+    timings['connections'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with db.get_engine(app).connect() as connection:
+        check_versions(connection)
+    timings['versions'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if not auth.jwks_store.refresh(rate_limited=False):
+        raise RuntimeError('Unable to fetch the signing keys from %s'
+                           % auth.jwks_store.url)
+    timings['jwks'] = time.perf_counter() - start
+    return timings